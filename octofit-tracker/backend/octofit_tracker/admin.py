@@ -1,10 +1,40 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from . import loaders
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, LeaderboardWindow, OutboxEvent, Workout
+
+
+class RelatedNamesMixin:
+    """
+    `user_name` and `team_name` columns for models that store `user_id` and
+    `team_id` strings. The ids of the whole change list page are queued up
+    front, so each column costs one query per page instead of one per row.
+    """
+    related_columns = {'user_name': (User, 'user_id'), 'team_name': (Team, 'team_id')}
+    
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        for column, (model, id_field) in self.related_columns.items():
+            if column in changelist.list_display:
+                loaders.documents(model).queue(getattr(obj, id_field) for obj in changelist.result_list)
+        return changelist
+    
+    def related_name(self, column, obj):
+        model, id_field = self.related_columns[column]
+        document = loaders.documents(model).load(getattr(obj, id_field))
+        return document['name'] if document else getattr(obj, id_field)
+    
+    @admin.display(description='User')
+    def user_name(self, obj):
+        return self.related_name('user_name', obj)
+    
+    @admin.display(description='Team')
+    def team_name(self, obj):
+        return self.related_name('team_name', obj)
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'team_id', 'created_at')
+class UserAdmin(RelatedNamesMixin, admin.ModelAdmin):
+    list_display = ('name', 'email', 'team_name', 'created_at')
     list_filter = ('created_at', 'team_id')
     search_fields = ('name', 'email')
     ordering = ('-created_at',)
@@ -19,21 +49,45 @@ class TeamAdmin(admin.ModelAdmin):
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
-    list_display = ('user_id', 'activity_type', 'duration', 'calories', 'date')
+class ActivityAdmin(RelatedNamesMixin, admin.ModelAdmin):
+    list_display = ('user_name', 'activity_type', 'duration', 'calories', 'date')
     list_filter = ('activity_type', 'date')
     search_fields = ('user_id', 'activity_type')
     ordering = ('-date',)
 
 
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(RelatedNamesMixin, admin.ModelAdmin):
+    list_display = ('user_name', 'team_name', 'day', 'activity_type', 'total_calories', 'total_duration', 'total_activities')
+    list_filter = ('activity_type', 'day')
+    search_fields = ('user_id', 'team_id')
+    ordering = ('-day',)
+
+
 @admin.register(Leaderboard)
-class LeaderboardAdmin(admin.ModelAdmin):
-    list_display = ('user_id', 'team_id', 'total_calories', 'total_duration', 'total_activities', 'last_updated')
+class LeaderboardAdmin(RelatedNamesMixin, admin.ModelAdmin):
+    list_display = ('user_name', 'team_name', 'total_calories', 'total_duration', 'total_activities', 'last_updated')
     list_filter = ('team_id', 'last_updated')
     search_fields = ('user_id', 'team_id')
     ordering = ('-total_calories',)
 
 
+@admin.register(LeaderboardWindow)
+class LeaderboardWindowAdmin(RelatedNamesMixin, admin.ModelAdmin):
+    list_display = ('window', 'user_name', 'team_name', 'total_calories', 'total_duration', 'total_activities', 'last_updated')
+    list_filter = ('window', 'team_id')
+    search_fields = ('user_id', 'team_id')
+    ordering = ('window', '-total_calories')
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(RelatedNamesMixin, admin.ModelAdmin):
+    list_display = ('user_name', 'day', 'partition', 'attempts', 'available_at', 'last_error', 'created_at')
+    list_filter = ('partition', 'attempts')
+    search_fields = ('user_id',)
+    ordering = ('available_at',)
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     list_display = ('name', 'activity_type', 'duration', 'difficulty', 'target_calories')
@@ -0,0 +1,24 @@
+from django.apps import AppConfig
+from django.core.management import call_command
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+from pymongo import monitoring
+
+
+def ensure_indexes(sender, verbosity=1, **kwargs):
+    """Create any declared MongoDB index that syncdb skipped on existing collections"""
+    call_command('ensure_indexes', verbosity=verbosity)
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+    verbose_name = 'OctoFit Tracker'
+
+    def ready(self):
+        from . import instrumentation, mongo, signals  # noqa: F401
+        post_migrate.connect(ensure_indexes, sender=self)
+        # Listeners only apply to clients created afterwards, which is all
+        # of them: djongo and mongo.py connect lazily.
+        monitoring.register(instrumentation.CommandListener())
+        monitoring.register(mongo.pool_stats)
+        connection_created.connect(instrumentation.install_execute_wrapper)
@@ -0,0 +1,178 @@
+"""
+Async (ASGI-native) versions of the hot read endpoints.
+
+These views are plain Django coroutines served by the existing ASGI app.
+They query MongoDB through Motor, so one worker can keep hundreds of slow
+queries in flight. Without Motor installed, the same queries run on the
+shared pymongo client in a thread pool. Responses have the same shape as
+the DRF endpoints: rows match the serializers, ``?fields=`` limits them to
+a sparse fieldset, and lists are paged with a forward-only keyset ``cursor``.
+"""
+import base64
+
+from asgiref.sync import sync_to_async
+from bson import ObjectId, json_util
+from django.http import Http404, HttpResponse
+from pymongo import ASCENDING, DESCENDING
+from rest_framework.exceptions import ValidationError
+
+from . import fastjson, instrumentation, mongo, native
+from .models import User, Team, Activity, Leaderboard, Workout
+from .serializers import (
+    UserSerializer,
+    ActivitySerializer,
+    LeaderboardSerializer,
+    WorkoutSerializer,
+    requested_fields,
+)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def json_response(data, status=200):
+    with instrumentation.timer('render'):
+        body = fastjson.dumps(data)
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def projection_for(serializer_class, only=None, sort=()):
+    projection = {name: 1 for name in native.readable_fields(serializer_class, only)}
+    projection.update((field, 1) for field, _ in sort)
+    return projection
+
+
+def sparse_fields(request, serializer_class):
+    """Return the ``?fields=`` of ``request``, or raise ValidationError"""
+    return requested_fields(request.GET, native.readable_fields(serializer_class))
+
+
+async def find(model, query, projection, sort=None, limit=0):
+    """Run a projected find() and return the raw documents"""
+    table = model._meta.db_table
+    database = mongo.get_async_database()
+    if database is not None:
+        cursor = database[table].find(query, projection, sort=sort, limit=limit)
+        return await cursor.to_list(length=None)
+
+    def blocking_find():
+        cursor = mongo.get_database()[table].find(query, projection, sort=sort, limit=limit)
+        return list(cursor)
+
+    return await sync_to_async(blocking_find, thread_sensitive=False)()
+
+
+async def get_or_404(model, object_id):
+    """Fetch one document by its ``_id`` string, or raise Http404"""
+    if not ObjectId.is_valid(object_id):
+        raise Http404
+    documents = await find(model, {'_id': ObjectId(object_id)}, {'_id': 1}, limit=1)
+    if not documents:
+        raise Http404
+    return documents[0]
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+
+
+def after(sort, values):
+    """Keyset filter for the rows that follow ``values`` in ``sort`` order"""
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {name: values[index] for index, (name, _) in enumerate(sort[:position])}
+        clause[field] = {'$lt' if direction == DESCENDING else '$gt': values[position]}
+        clauses.append(clause)
+    return {'$or': clauses}
+
+
+async def paginated(request, model, query, serializer_class, sort):
+    """One page of ``query`` in ``sort`` order as a JSON response"""
+    try:
+        page_size = min(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    page_size = max(page_size, 1)
+    try:
+        only = sparse_fields(request, serializer_class)
+    except ValidationError as exc:
+        return json_response(exc.detail, status=400)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != len(sort):
+            return json_response({'detail': 'Invalid cursor'}, status=404)
+        query = {'$and': [query, after(sort, values)]}
+
+    projection = projection_for(serializer_class, only, sort)
+    documents = await find(model, query, projection, sort=sort, limit=page_size + 1)
+    page = documents[:page_size]
+    next_link = None
+    if len(documents) > page_size:
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor([page[-1][field] for field, _ in sort])
+        next_link = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    return json_response({
+        'next': next_link,
+        'results': native.represent(page, serializer_class, only),
+    })
+
+
+async def top_users(request):
+    """Get top 10 users by calories"""
+    try:
+        only = sparse_fields(request, LeaderboardSerializer)
+    except ValidationError as exc:
+        return json_response(exc.detail, status=400)
+    documents = await find(
+        Leaderboard, {}, projection_for(LeaderboardSerializer, only),
+        sort=[('total_calories', DESCENDING), ('_id', DESCENDING)], limit=10,
+    )
+    return json_response(native.represent(documents, LeaderboardSerializer, only))
+
+
+async def leaderboard_by_team(request):
+    """Get the leaderboard of one team (`team_id`), or of everyone"""
+    query = {}
+    if request.GET.get('team_id'):
+        query['team_id'] = request.GET['team_id']
+    return await paginated(
+        request, Leaderboard, query, LeaderboardSerializer,
+        sort=[('total_calories', DESCENDING), ('_id', DESCENDING)],
+    )
+
+
+async def user_activities(request, pk):
+    """Get all activities for a specific user, newest first"""
+    user = await get_or_404(User, pk)
+    return await paginated(
+        request, Activity, {'user_id': str(user['_id'])}, ActivitySerializer,
+        sort=[('date', DESCENDING), ('_id', DESCENDING)],
+    )
+
+
+async def team_members(request, pk):
+    """Get all members of a specific team"""
+    team = await get_or_404(Team, pk)
+    return await paginated(
+        request, User, {'team_id': str(team['_id'])}, UserSerializer,
+        sort=[('_id', ASCENDING)],
+    )
+
+
+async def workouts(request):
+    """List workouts, optionally filtered by `difficulty` and `activity_type`"""
+    query = {
+        field: request.GET[field]
+        for field in ('difficulty', 'activity_type')
+        if field in request.GET
+    }
+    return await paginated(request, Workout, query, WorkoutSerializer, sort=[('_id', ASCENDING)])
@@ -0,0 +1,32 @@
+"""
+djongo for the ``replica`` database alias.
+
+The connection reuses the MongoClient djongo caches for the database name,
+so it shares the ``default`` alias' pool. Only its Database handle differs:
+it carries ``OCTOFIT_REPLICA_READ_PREFERENCE``, so reads may be served by
+secondaries while writes, which pymongo always sends to the primary, stay
+correct even if one is routed here.
+"""
+from django.conf import settings
+from djongo import base
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+
+def read_preference():
+    return make_read_preference(
+        read_pref_mode_from_name(settings.OCTOFIT_REPLICA_READ_PREFERENCE),
+        None,
+        settings.OCTOFIT_REPLICA_MAX_STALENESS_SECONDS or -1,
+    )
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, connection_params):
+        # The client is shared with the default alias; never let djongo close it
+        self.client_connection = None
+        database = super().get_new_connection(connection_params)
+        return database.client.get_database(database.name, read_preference=read_preference())
+
+    def _close(self):
+        pass
@@ -0,0 +1,122 @@
+"""
+Response cache for the read-heavy leaderboard and workout endpoints.
+
+Entries live in the Django cache configured in ``settings.CACHES``. That is
+an in-process LRU by default, or a shared backend such as Redis when
+``OCTOFIT_CACHE_URL`` is set. Every cached response belongs to a scope,
+for example ``top_users`` or ``by_team:<team_id>``. Each scope has a
+generation number that is part of the key. Invalidating a scope bumps its
+generation, so stale entries are never read again and simply age out. This
+works the same on backends that cannot enumerate their keys.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+
+def by_team_scope(team_id):
+    """Scope of the by_team leaderboard for one team, or for all teams"""
+    return f'by_team:{team_id or "all"}'
+
+
+def leaderboard_scopes(team_ids):
+    """Scopes to evict when entries of ``team_ids`` change"""
+    return ['top_users', by_team_scope(None)] + [by_team_scope(team_id) for team_id in team_ids]
+
+
+class ResponseCache:
+    """Generation-keyed response cache with per-endpoint hit/miss counters"""
+    prefix = 'octofit:response'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _generation_key(self, scope):
+        return f'{self.prefix}:generation:{scope}'
+
+    def generation(self, scope):
+        key = self._generation_key(scope)
+        generation = cache.get(key)
+        if generation is None:
+            # Start from the clock so a generation evicted from the cache can
+            # never come back lower than one that was already served.
+            cache.add(key, time.time_ns(), timeout=None)
+            generation = cache.get(key)
+        return generation
+
+    def key(self, endpoint, scope, request):
+        params = sorted(
+            (name, value)
+            for name, values in request.query_params.lists()
+            for value in values
+        )
+        raw = repr((request.get_host(), request.path, params)).encode()
+        digest = hashlib.sha1(raw).hexdigest()
+        return f'{self.prefix}:{endpoint}:{scope}:{self.generation(scope)}:{digest}'
+
+    def record(self, endpoint, outcome):
+        with self._lock:
+            self._stats[endpoint, outcome] += 1
+
+    def get(self, endpoint, key):
+        data = cache.get(key)
+        self.record(endpoint, 'hits' if data is not None else 'misses')
+        return data
+
+    def set(self, key, data):
+        cache.set(key, data, timeout=settings.OCTOFIT_CACHE_TTL)
+
+    def invalidate(self, *scopes):
+        """Evict every cached response of ``scopes``"""
+        for scope in set(scopes):
+            try:
+                cache.incr(self._generation_key(scope))
+            except ValueError:
+                # No generation yet means nothing was cached for this scope.
+                pass
+
+    def stats(self):
+        """Hit/miss counters of this process, in total and per endpoint"""
+        with self._lock:
+            stats = dict(self._stats)
+        endpoints = {}
+        for (endpoint, outcome), count in stats.items():
+            endpoints.setdefault(endpoint, {'hits': 0, 'misses': 0})[outcome] = count
+        return {
+            'hits': sum(counts['hits'] for counts in endpoints.values()),
+            'misses': sum(counts['misses'] for counts in endpoints.values()),
+            'endpoints': endpoints,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(endpoint, scope):
+    """
+    Serve a GET view method from the response cache. ``scope`` is a scope
+    name or a callable that derives it from the request.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key_scope = scope(request) if callable(scope) else scope
+            # The key pins the generation seen before the data is read, so a
+            # write that lands meanwhile leaves this entry unreachable.
+            key = response_cache.key(endpoint, key_scope, request)
+            data = response_cache.get(endpoint, key)
+            if data is not None:
+                return Response(data)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.set(key, response.data)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,256 @@
+"""
+Per-request instrumentation: MongoDB round trips and time, djongo's SQL
+translation time, serializer and renderer time, and payload size.
+
+``RequestMetrics`` for the running request live in a context variable, so
+sync views, async views and ``sync_to_async`` threads all record into the
+right request. They are fed by three hooks:
+
+* a pymongo ``CommandListener``, registered once per process, which sees
+  every command sent by djongo and by the native/raw pymongo paths;
+* a Django ``execute_wrapper`` on every database connection, which times
+  ``cursor.execute``. Minus the MongoDB time spent inside it, that is the
+  time djongo needs to parse the SQL and build the Mongo query;
+* ``timer()`` blocks around serializer ``.data`` and the JSON renderer.
+
+``InstrumentationMiddleware`` reports the numbers in a ``Server-Timing``
+header and one structured log line per request. It also folds them into
+the per-route histograms served by ``/api/metrics/``.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from pymongo import monitoring
+
+logger = logging.getLogger('octofit_tracker.requests')
+
+DURATION_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+TIMINGS = ('db', 'translate', 'serialize', 'render')
+
+_current = contextvars.ContextVar('octofit_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counters of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_statements = 0
+        self.timings = Counter()  # seconds, by TIMINGS name
+
+    def add(self, name, seconds):
+        self.timings[name] += seconds
+
+
+def current():
+    """The metrics of the running request, or None outside a request"""
+    return _current.get()
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block to ``name`` of the running request"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - start)
+
+
+class CommandListener(monitoring.CommandListener):
+    """Counts MongoDB commands and their server round-trip time per request"""
+
+    def started(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries += 1
+
+    def succeeded(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add('db', event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Time djongo's SQL translation: cursor.execute minus MongoDB time"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    db_before = metrics.timings['db']
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.sql_statements += 1
+        metrics.add('translate', max(elapsed - (metrics.timings['db'] - db_before), 0))
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """``connection_created`` receiver adding ``execute_wrapper`` once"""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+class Histogram:
+    """Cumulative bucket counts with a sum and a maximum"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.max = max(self.max, value)
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self):
+        buckets, total = {}, 0
+        for bound, count in zip([*self.bounds, '+Inf'], self.counts):
+            total += count
+            buckets[str(bound)] = total
+        return {'sum': round(self.sum, 3), 'max': round(self.max, 3), 'buckets': buckets}
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.duration_ms = Histogram(DURATION_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.totals_ms = Counter()
+        self.bytes = 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'duration_ms': self.duration_ms.snapshot(),
+            'queries': self.queries.snapshot(),
+            **{f'{name}_ms': round(self.totals_ms[name], 3) for name in TIMINGS},
+            'bytes': self.bytes,
+        }
+
+
+class MetricsRegistry:
+    """Per-route aggregates of this worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, record):
+        with self._lock:
+            stats = self._routes.setdefault(route, RouteStats())
+            stats.count += 1
+            stats.errors += record['status'] >= 500
+            stats.duration_ms.observe(record['duration_ms'])
+            stats.queries.observe(record['queries'])
+            stats.totals_ms.update({name: record[f'{name}_ms'] for name in TIMINGS})
+            stats.bytes += record['bytes'] or 0
+
+    def snapshot(self):
+        with self._lock:
+            return {route: stats.snapshot() for route, stats in sorted(self._routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return f'{request.method} {match.view_name if match else "unresolved"}'
+
+
+def server_timing(record):
+    entries = [f'db;dur={record["db_ms"]};desc="{record["queries"]} queries"']
+    entries += [f'{name};dur={record[f"{name}_ms"]}' for name in TIMINGS[1:]]
+    entries.append(f'total;dur={record["duration_ms"]}')
+    return ', '.join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    Collects ``RequestMetrics`` for every request, then reports them in the
+    response headers, the request log and the metrics registry.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Tell Django to await this middleware, the same way MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        duration = time.perf_counter() - metrics.started
+        route = route_of(request)
+        record = {
+            'route': route,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'queries': metrics.queries,
+            'sql_statements': metrics.sql_statements,
+            **{f'{name}_ms': round(metrics.timings[name] * 1000, 3) for name in TIMINGS},
+            'bytes': None if response.streaming else len(response.content),
+        }
+        registry.record(route, record)
+        if settings.OCTOFIT_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(record)
+
+        level = logging.INFO
+        if metrics.queries > settings.OCTOFIT_QUERY_WARNING_THRESHOLD:
+            # Far more round trips than any list endpoint needs: likely N+1
+            level = logging.WARNING
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(record))
+        return response
@@ -0,0 +1,192 @@
+from collections import Counter, defaultdict
+
+from bson import ObjectId
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from . import versions
+from .cache import leaderboard_scopes, response_cache
+from .models import User, Activity, Leaderboard
+
+TOTAL_FIELDS = ('total_calories', 'total_duration', 'total_activities')
+
+
+def activity_delta(activity, sign=1):
+    """Return the leaderboard totals contributed by a single activity"""
+    return {
+        'total_calories': sign * activity.calories,
+        'total_duration': sign * activity.duration,
+        'total_activities': sign,
+    }
+
+
+def collect_deltas(changes):
+    """
+    Fold ``(activity, sign)`` pairs into one delta per user so that a
+    batch of writes costs a single update per leaderboard entry.
+    """
+    deltas = defaultdict(Counter)
+    for activity, sign in changes:
+        deltas[activity.user_id].update(activity_delta(activity, sign))
+    return deltas
+
+
+def nonzero_deltas(deltas):
+    """Drop zero fields, and keys left with nothing to change"""
+    deltas = {
+        key: {field: value for field, value in delta.items() if value}
+        for key, delta in deltas.items()
+    }
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def totals_pipeline(user_ids=None):
+    """
+    Aggregation pipeline that sums activities into leaderboard totals
+    server side, one output document per user (``_id`` is the user id).
+    """
+    pipeline = []
+    if user_ids is not None:
+        pipeline.append({'$match': {'user_id': {'$in': list(user_ids)}}})
+    pipeline.append({
+        '$group': {
+            '_id': '$user_id',
+            'total_calories': {'$sum': '$calories'},
+            'total_duration': {'$sum': '$duration'},
+            'total_activities': {'$sum': 1},
+        }
+    })
+    return pipeline
+
+
+def team_ids_for(user_ids):
+    """Look up the team of every user in ``user_ids`` with one query"""
+    object_ids = [ObjectId(user_id) for user_id in user_ids if ObjectId.is_valid(user_id)]
+    if not object_ids:
+        return {}
+    users = User.objects.mongo_find({'_id': {'$in': object_ids}}, {'team_id': 1})
+    return {str(user['_id']): user.get('team_id') for user in users}
+
+
+def stored_team_ids(model, user_ids):
+    """
+    Teams recorded on the ``model`` rows of ``user_ids``. A row keeps the
+    team it was created with, so after a team change it is still listed,
+    and cached, under the old one.
+    """
+    rows = model.objects.mongo_find({'user_id': {'$in': list(user_ids)}}, {'team_id': 1})
+    return {row.get('team_id') for row in rows}
+
+
+def apply_deltas(deltas, teams=None):
+    """
+    Apply per-user deltas to the leaderboard with atomic ``$inc`` updates.
+
+    Missing entries are upserted and take the team of their user, so the
+    first activity of a new user creates its leaderboard row. ``teams`` maps
+    user ids to team ids and is looked up when not given.
+    """
+    deltas = nonzero_deltas(deltas)
+    if not deltas:
+        return
+
+    if teams is None:
+        teams = team_ids_for(deltas)
+    stored_teams = stored_team_ids(Leaderboard, deltas)
+    now = timezone.now()
+    operations = [
+        UpdateOne(
+            {'user_id': user_id},
+            {
+                '$inc': delta,
+                '$set': {'last_updated': now},
+                '$setOnInsert': {'team_id': teams.get(user_id)},
+            },
+            upsert=True,
+        )
+        for user_id, delta in deltas.items()
+    ]
+    Leaderboard.objects.mongo_bulk_write(operations, ordered=False)
+    response_cache.invalidate(*leaderboard_scopes({teams.get(user_id) for user_id in deltas} | stored_teams))
+    versions.bump(Leaderboard)
+
+
+def recompute(user_ids, teams=None):
+    """
+    Set the totals of ``user_ids`` to the sums of their activities. Unlike
+    ``apply_deltas`` this is idempotent: running it twice, or after a
+    partial failure, gives the same totals.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    if teams is None:
+        teams = team_ids_for(user_ids)
+    totals = {row['_id']: row for row in Activity.objects.mongo_aggregate(totals_pipeline(user_ids))}
+    stored_teams = stored_team_ids(Leaderboard, user_ids)
+    now = timezone.now()
+    operations = []
+    for user_id in user_ids:
+        row = totals.get(user_id, {})
+        values = {field: row.get(field, 0) for field in TOTAL_FIELDS}
+        # Like apply_deltas, an entry whose activities are all gone stays at zero
+        operations.append(UpdateOne(
+            {'user_id': user_id},
+            {'$set': {**values, 'last_updated': now}, '$setOnInsert': {'team_id': teams.get(user_id)}},
+            upsert=bool(row),
+        ))
+    Leaderboard.objects.mongo_bulk_write(operations, ordered=False)
+    response_cache.invalidate(*leaderboard_scopes({teams.get(user_id) for user_id in user_ids} | stored_teams))
+    versions.bump(Leaderboard)
+
+
+def drift(user_ids):
+    """
+    Compare the stored entries of ``user_ids`` with the totals of their
+    activities. Returns ``{user_id: {field: (stored, expected)}}`` for every
+    entry that is missing (stored values are None) or differs, including
+    a ``team_id`` that no longer matches the user's team.
+    """
+    user_ids = list(user_ids)
+    totals = {row['_id']: row for row in Activity.objects.mongo_aggregate(totals_pipeline(user_ids))}
+    stored = {
+        row['user_id']: row
+        for row in Leaderboard.objects.mongo_find(
+            {'user_id': {'$in': user_ids}}, {'user_id': 1, 'team_id': 1, **{field: 1 for field in TOTAL_FIELDS}}
+        )
+    }
+    teams = team_ids_for(user_ids)
+    drifted = {}
+    for user_id in user_ids:
+        row, entry = totals.get(user_id), stored.get(user_id)
+        if row is None and entry is None:
+            continue
+        expected = {field: (row or {}).get(field, 0) for field in TOTAL_FIELDS}
+        # Users without a document keep whatever team their entry has
+        expected['team_id'] = teams[user_id] if user_id in teams else (entry or {}).get('team_id')
+        changes = {
+            field: (None if entry is None else entry.get(field), value)
+            for field, value in expected.items()
+            if entry is None or entry.get(field) != value
+        }
+        if changes:
+            drifted[user_id] = changes
+    return drifted
+
+
+def write_corrections(drifted):
+    """
+    Write the expected values of a ``drift()`` result, only the fields that
+    differ. The caller invalidates the cached leaderboards.
+    """
+    now = timezone.now()
+    operations = [
+        UpdateOne(
+            {'user_id': user_id},
+            {'$set': {**{field: expected for field, (_, expected) in changes.items()}, 'last_updated': now}},
+            upsert=True,
+        )
+        for user_id, changes in drifted.items()
+    ]
+    if operations:
+        Leaderboard.objects.mongo_bulk_write(operations, ordered=False)
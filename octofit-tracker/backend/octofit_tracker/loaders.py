@@ -0,0 +1,131 @@
+"""
+Request-scoped batch loaders, in the style of DataLoader.
+
+The models point at each other through string ids rather than foreign
+keys, so nested output easily costs one query per row. A ``Loader`` wraps
+a batch function taking a list of keys. Serializers ``queue`` the keys a
+whole page will need, and the first ``load`` of a key that is not known yet
+resolves everything queued with a single batch call. Results are memoized,
+so later loads of the same key, in this or any other serializer, cost
+nothing.
+
+Loaders are shared for the duration of a request: ``LoaderMiddleware``
+opens a ``scope()``, and ``get_loader`` returns the same loader for the same
+name within it. Outside a scope every call returns a fresh loader. ORM
+writes forget the memoized values of the written model (see signals.py).
+"""
+import asyncio
+import contextvars
+from contextlib import contextmanager
+
+from bson import ObjectId
+
+_loaders = contextvars.ContextVar('octofit_loaders', default=None)
+
+
+class Loader:
+    """Batches and memoizes the calls of ``batch``, a function of a list of keys to a dict"""
+
+    def __init__(self, batch, default=None):
+        self.batch = batch
+        self.default = default
+        self._values = {}
+        self._queued = set()
+
+    def queue(self, keys):
+        """Resolve ``keys`` with the next batch"""
+        self._queued.update(key for key in keys if key is not None and key not in self._values)
+
+    def prime(self, key, value):
+        """Memoize ``value`` for ``key`` without a batch call"""
+        self._values[key] = value
+        self._queued.discard(key)
+
+    def load_many(self, keys):
+        """Map each of ``keys`` to its value, running at most one batch"""
+        keys = list(keys)
+        self.queue(keys)
+        if any(key in self._queued for key in keys):
+            self.dispatch()
+        return {key: self._values.get(key, self.default) for key in keys}
+
+    def load(self, key):
+        return self.load_many([key])[key]
+
+    def dispatch(self):
+        """Resolve every queued key with one batch call"""
+        keys, self._queued = list(self._queued), set()
+        found = self.batch(keys)
+        for key in keys:
+            self._values[key] = found.get(key, self.default)
+
+    def clear(self):
+        self._values.clear()
+
+
+@contextmanager
+def scope():
+    """Share loaders by name until the block exits"""
+    token = _loaders.set({})
+    try:
+        yield
+    finally:
+        _loaders.reset(token)
+
+
+def get_loader(name, batch, default=None):
+    """
+    The loader called ``name`` in the current scope, created from ``batch``
+    on first use. ``name`` is a tuple starting with the model whose writes
+    invalidate it.
+    """
+    loaders = _loaders.get()
+    if loaders is None:
+        return Loader(batch, default)
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders[name] = Loader(batch, default)
+    return loader
+
+
+def forget(model):
+    """Drop what the current scope's loaders memoized for ``model``"""
+    for name, loader in (_loaders.get() or {}).items():
+        if name[0] is model:
+            loader.clear()
+
+
+def documents(model, fields=('name',)):
+    """Loader of ``model`` documents, limited to ``fields``, by their string id"""
+    fields = tuple(fields)
+
+    def batch(ids):
+        object_ids = [ObjectId(value) for value in ids if ObjectId.is_valid(value)]
+        if not object_ids:
+            return {}
+        cursor = model.objects.mongo_find({'_id': {'$in': object_ids}}, {field: 1 for field in fields})
+        return {str(doc['_id']): doc for doc in cursor}
+
+    return get_loader((model, 'documents', fields), batch)
+
+
+class LoaderMiddleware:
+    """Gives every request its own set of loaders"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with scope():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with scope():
+            return await self.get_response(request)
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from octofit_tracker import leaderboard, rollups, versions, windows
+from octofit_tracker.management.commands.populate_db import chunked
+from octofit_tracker.models import Activity, ActivityRollup
+
+# Tolerated difference between this clock and the one stamping server-side _ids
+CLOCK_SKEW = timedelta(seconds=5)
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the daily activity rollups from the activities collection. '
+        'Buckets are upserted in place, so statistics keep being served and '
+        'concurrent activity writes keep working while it runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rollup buckets per bulk write')
+
+    def handle(self, *args, **options):
+        # Every bucket written by this run carries its id; older buckets
+        # without it are stale. Buckets created after the run started come
+        # from concurrent activity writes and are left alone.
+        run = str(ObjectId())
+        started = ObjectId.from_datetime(timezone.now() - CLOCK_SKEW)
+
+        # Group server side by user, UTC day and activity type; only the
+        # bucket totals ever reach Python.
+        rows = Activity.objects.mongo_aggregate(rollups.bucket_pipeline({}), allowDiskUse=True)
+
+        self.stdout.write('Writing rollups...')
+        written = 0
+        for chunk in chunked(rows, options['chunk_size']):
+            teams = leaderboard.team_ids_for({row['_id']['user_id'] for row in chunk})
+            operations = [
+                UpdateOne(
+                    {
+                        'user_id': row['_id']['user_id'],
+                        'day': rollups.parse_day(row['_id']['day']),
+                        'activity_type': row['_id']['activity_type'],
+                    },
+                    {'$set': {
+                        'team_id': teams.get(row['_id']['user_id']),
+                        'total_calories': row['total_calories'],
+                        'total_duration': row['total_duration'],
+                        'total_distance': row['total_distance'],
+                        'total_activities': row['total_activities'],
+                        'backfill_run': run,
+                    }},
+                    upsert=True,
+                )
+                for row in chunk
+            ]
+            ActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+            written += len(operations)
+
+        self.stdout.write('Deleting stale rollups...')
+        stale = ActivityRollup.objects.mongo_delete_many({'backfill_run': {'$ne': run}, '_id': {'$lt': started}})
+        versions.bump(Activity)
+
+        self.stdout.write('Rebuilding windowed leaderboards...')
+        windows.rebuild_all()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rollups rebuilt: {written} daily buckets, {stale.deleted_count} stale ones deleted'
+        ))
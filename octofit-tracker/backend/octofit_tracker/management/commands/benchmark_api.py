@@ -0,0 +1,253 @@
+import json
+import math
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from pymongo import monitoring
+
+from octofit_tracker import fastjson
+from octofit_tracker.models import User, Team, Activity
+
+# Deterministic datasets, named after their number of activities
+DATASETS = {
+    '1k': {'users': 100, 'teams': 10, 'activities_per_user': 10},
+    '100k': {'users': 5000, 'teams': 50, 'activities_per_user': 20},
+    '1m': {'users': 20000, 'teams': 100, 'activities_per_user': 50},
+}
+DATASET_SEED = 800
+
+# Endpoint name -> function building its URL from the benchmark user and team ids
+ENDPOINTS = {
+    'top_users': lambda ids: reverse('leaderboard-top-users'),
+    'top_users_7d': lambda ids: reverse('leaderboard-top-users') + '?window=7d',
+    'leaderboard_expand': lambda ids: reverse('leaderboard-list') + '?expand=user,team',
+    'by_team': lambda ids: reverse('leaderboard-by-team') + f'?team_id={ids["team"]}',
+    'leaderboard_rank': lambda ids: reverse('leaderboard-rank', args=[ids['user']]) + '?around=5',
+    'users': lambda ids: reverse('user-list'),
+    'teams': lambda ids: reverse('team-list'),
+    'members': lambda ids: reverse('team-members', args=[ids['team']]),
+    'user_activities': lambda ids: reverse('user-activities', args=[ids['user']]),
+    'activities': lambda ids: reverse('activity-list'),
+    'activity_stats': lambda ids: reverse('activity-stats') + f'?team_id={ids["team"]}&period=week',
+    'workouts': lambda ids: reverse('workout-list'),
+    'async_top_users': lambda ids: reverse('async-leaderboard-top-users'),
+    'async_by_team': lambda ids: reverse('async-leaderboard-by-team') + f'?team_id={ids["team"]}',
+    'async_user_activities': lambda ids: reverse('async-user-activities', args=[ids['user']]),
+    'async_members': lambda ids: reverse('async-team-members', args=[ids['team']]),
+    'async_workouts': lambda ids: reverse('async-workouts'),
+}
+
+# Driver chatter that is not a query made by the endpoint
+IGNORED_COMMANDS = {'isMaster', 'ismaster', 'hello', 'ping', 'endSessions', 'buildInfo', 'saslStart', 'saslContinue'}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the MongoDB commands sent by every client in the process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            with self.lock:
+                self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the API hot paths against a deterministic dataset of 1k, '
+        '100k or 1m activities in a separate benchmark database. Reports '
+        'p50/p99 latency, MongoDB commands per request and peak allocations '
+        'per endpoint, and can compare the results with an earlier run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=DATASETS, default='1k', help='Dataset size (number of activities)')
+        parser.add_argument(
+            '--database', default='octofit_benchmark',
+            help='MongoDB database to seed and query; it is wiped when (re)seeded',
+        )
+        parser.add_argument('--reseed', action='store_true', help='Seed the dataset even if it is already present')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint')
+        parser.add_argument(
+            '--cache', choices=('cold', 'warm'), default='cold',
+            help='cold disables the Django cache so every request does the full work',
+        )
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='Only run these endpoints')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Earlier --output file to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Relative p50 slowdown reported as a regression with --compare',
+        )
+
+    def handle(self, *args, **options):
+        if options['database'] == settings.DATABASES['default']['NAME']:
+            raise CommandError('Refusing to benchmark against the main database; pick another --database')
+        # Point the ORM and the shared pymongo clients at the benchmark database
+        # before anything connects.
+        for alias in ('default', 'replica'):
+            settings.DATABASES[alias]['NAME'] = options['database']
+            connections[alias].settings_dict['NAME'] = options['database']
+            connections[alias].close()
+
+        self.counter = CommandCounter()
+        monitoring.register(self.counter)
+
+        dataset = DATASETS[options['size']]
+        self.seed(dataset, options['reseed'])
+        ids = {
+            'team': str(Team.objects.get(name='Team 1')._id),
+            'user': str(User.objects.get(email='athlete1@octofit.test')._id),
+        }
+
+        caches = None
+        if options['cache'] == 'cold':
+            caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        client = Client(HTTP_HOST='localhost')
+        results = {}
+        with override_settings(CACHES=caches or settings.CACHES):
+            for name in options['endpoint'] or ENDPOINTS:
+                url = ENDPOINTS[name](ids)
+                try:
+                    results[name] = self.measure(client, url, options['requests'], options['warmup'])
+                except Exception as exc:
+                    # One broken endpoint must not cost the measurements of the others
+                    results[name] = {'url': url, 'error': str(exc) or repr(exc)}
+                if options['verbosity'] > 0 or 'error' in results[name]:
+                    self.stdout.write(self.format_row(name, results[name]))
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'size': options['size'],
+                'dataset': dict(dataset, seed=DATASET_SEED),
+                'requests': options['requests'],
+                'cache': options['cache'],
+                'python': platform.python_version(),
+                'orjson': fastjson.orjson is not None,
+                'native_endpoints': list(settings.OCTOFIT_NATIVE_ENDPOINTS),
+                'read_replica': settings.OCTOFIT_READ_REPLICA,
+            },
+            'results': results,
+        }
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+        if options['compare']:
+            self.compare(json.loads(Path(options['compare']).read_text()), report, options['threshold'])
+        failed = [name for name, result in results.items() if 'error' in result]
+        if failed:
+            raise CommandError(f'Failed endpoints: {", ".join(failed)}')
+
+    def seed(self, dataset, reseed):
+        """Create the collections and the dataset unless it is already there"""
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        expected = dataset['users'] * dataset['activities_per_user']
+        if not reseed and Activity.objects.mongo_count_documents({}) == expected:
+            self.stdout.write(f'Reusing the {expected} activity dataset')
+            return
+        call_command(
+            'populate_db', users=dataset['users'], teams=dataset['teams'],
+            activities_per_user=dataset['activities_per_user'], seed=DATASET_SEED,
+            verbosity=0, stdout=self.stdout,
+        )
+
+    def measure(self, client, url, requests, warmup):
+        for _ in range(warmup):
+            self.get(client, url)
+
+        timings, queries = [], []
+        for _ in range(requests):
+            before = self.counter.count
+            start = time.perf_counter()
+            response = self.get(client, url)
+            timings.append(time.perf_counter() - start)
+            queries.append(self.counter.count - before)
+
+        # Allocations are traced on a separate request: tracing slows
+        # everything down and would distort the latencies.
+        tracemalloc.start()
+        self.get(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'url': url,
+            'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+            'queries': max(queries),
+            'alloc_peak_kb': round(peak / 1024, 1),
+            'bytes': len(response.content),
+        }
+
+    def get(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} returned {response.status_code}')
+        return response
+
+    def format_row(self, name, result):
+        if 'error' in result:
+            return self.style.ERROR(f'{name:<24} failed: {result["error"]}')
+        return (
+            f'{name:<24} p50 {result["p50_ms"]:>9.2f}ms  p99 {result["p99_ms"]:>9.2f}ms  '
+            f'queries {result["queries"]:>3}  alloc {result["alloc_peak_kb"]:>9.1f}KiB  {result["bytes"]:>8}B'
+        )
+
+    def compare(self, baseline, report, threshold):
+        """Print the change of every endpoint and fail on regressions"""
+        if baseline['meta']['size'] != report['meta']['size']:
+            raise CommandError('The baseline was measured on a different dataset size')
+        regressions = []
+        self.stdout.write(f'\nCompared with {baseline["meta"].get("revision") or "baseline"}:')
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None or 'error' in before or 'error' in result:
+                continue
+            change = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0
+            line = (
+                f'{name:<24} p50 {before["p50_ms"]:>9.2f} -> {result["p50_ms"]:>9.2f}ms ({change:+.0%})  '
+                f'queries {before["queries"]} -> {result["queries"]}'
+            )
+            if change > threshold or result['queries'] > before['queries']:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Regressions in: {", ".join(regressions)}')
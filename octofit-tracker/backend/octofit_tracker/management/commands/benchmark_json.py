@@ -0,0 +1,115 @@
+import json
+import random
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from octofit_tracker import fastjson, loaders
+from octofit_tracker.management.commands.populate_db import ACTIVITY_TYPES, WORKOUTS
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.serializers import (
+    UserSerializer,
+    TeamSerializer,
+    ActivitySerializer,
+    LeaderboardSerializer,
+    WorkoutSerializer,
+    members_counts,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the stdlib and fast JSON renderers and parsers on the output '
+        'of every serializer. Instances are built in memory, so no database '
+        'is needed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Objects per serializer')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case; the best one is reported')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated objects')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        if fastjson.orjson is None:
+            self.stderr.write('orjson is not installed; the fast renderer will use its stdlib fallback')
+        rng = random.Random(options['seed'])
+        rows = options['rows']
+        now = timezone.now()
+
+        teams = [Team(_id=ObjectId(), name=f'Team {i}', description='Benchmark team', created_at=now) for i in range(rows)]
+        with loaders.scope():
+            # Primed member counts keep TeamSerializer off the database
+            for team in teams:
+                members_counts().prime(str(team._id), rng.randint(0, 50))
+            cases = [
+                (UserSerializer, UserSerializer([
+                    User(_id=ObjectId(), name=f'User {i}', email=f'user{i}@example.com', password='x',
+                         team_id=str(ObjectId()), created_at=now)
+                    for i in range(rows)
+                ], many=True).data),
+                (TeamSerializer, TeamSerializer(teams, many=True).data),
+                (ActivitySerializer, ActivitySerializer([
+                    Activity(_id=ObjectId(), user_id=str(ObjectId()), activity_type=rng.choice(ACTIVITY_TYPES),
+                             duration=rng.randint(10, 120), distance=round(rng.uniform(1, 20), 2),
+                             calories=rng.randint(50, 900), date=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                             notes='Benchmark activity ' * rng.randint(0, 5))
+                    for _ in range(rows)
+                ], many=True).data),
+                (LeaderboardSerializer, LeaderboardSerializer([
+                    Leaderboard(_id=ObjectId(), user_id=str(ObjectId()), team_id=str(ObjectId()),
+                                total_calories=rng.randint(0, 100000), total_duration=rng.randint(0, 5000),
+                                total_activities=rng.randint(0, 300), last_updated=now)
+                    for _ in range(rows)
+                ], many=True).data),
+                (WorkoutSerializer, WorkoutSerializer(
+                    [Workout(_id=ObjectId(), **rng.choice(WORKOUTS)) for _ in range(rows)], many=True
+                ).data),
+            ]
+
+        stdlib_renderer, fast_renderer = JSONRenderer(), fastjson.JSONRenderer()
+        stdlib_parser, fast_parser = JSONParser(), fastjson.JSONParser()
+        results = []
+        for serializer_class, data in cases:
+            body = stdlib_renderer.render(data)
+            if json.loads(fast_renderer.render(data)) != json.loads(body):
+                self.stderr.write(f'{serializer_class.__name__}: renderers disagree')
+            timings = {
+                'render_stdlib': self.best(lambda: stdlib_renderer.render(data), options['repeat']),
+                'render_fast': self.best(lambda: fast_renderer.render(data), options['repeat']),
+                'parse_stdlib': self.best(lambda: stdlib_parser.parse(BytesIO(body)), options['repeat']),
+                'parse_fast': self.best(lambda: fast_parser.parse(BytesIO(body)), options['repeat']),
+            }
+            results.append({'serializer': serializer_class.__name__, 'rows': rows, 'bytes': len(body), **timings})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f'{"serializer":<24}{"bytes":>10}{"render stdlib":>15}{"render fast":>13}{"x":>6}'
+            f'{"parse stdlib":>14}{"parse fast":>12}{"x":>6}'
+        )
+        for row in results:
+            self.stdout.write(
+                f'{row["serializer"]:<24}{row["bytes"]:>10}'
+                f'{row["render_stdlib"] * 1000:>13.2f}ms{row["render_fast"] * 1000:>11.2f}ms'
+                f'{row["render_stdlib"] / row["render_fast"]:>6.1f}'
+                f'{row["parse_stdlib"] * 1000:>12.2f}ms{row["parse_fast"] * 1000:>10.2f}ms'
+                f'{row["parse_stdlib"] / row["parse_fast"]:>6.1f}'
+            )
+
+    @staticmethod
+    def best(function, repeat):
+        """Fastest of ``repeat`` runs of ``function``, in seconds"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
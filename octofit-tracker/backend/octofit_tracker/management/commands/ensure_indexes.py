@@ -0,0 +1,64 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from pymongo import ASCENDING, DESCENDING
+
+
+def declared_indexes(model):
+    """Yield ``(name, keys, unique)`` for every index declared on ``model``"""
+    def key(field_name):
+        direction = DESCENDING if field_name.startswith('-') else ASCENDING
+        return (model._meta.get_field(field_name.lstrip('-')).column, direction)
+
+    for index in model._meta.indexes:
+        yield index.name, [key(field_name) for field_name in index.fields], False
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint):
+            yield constraint.name, [key(field_name) for field_name in constraint.fields], True
+
+
+class Command(BaseCommand):
+    help = 'Create or verify the MongoDB indexes declared on the octofit_tracker models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report missing or mismatched indexes; exit with an error if any are found',
+        )
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+        problems = 0
+
+        for model in apps.get_app_config('octofit_tracker').get_models():
+            existing = model.objects.mongo_index_information()
+            table = model._meta.db_table
+
+            for name, keys, unique in declared_indexes(model):
+                current = existing.get(name)
+                if current is not None:
+                    matches = (
+                        [tuple(key) for key in current['key']] == keys
+                        and bool(current.get('unique')) == unique
+                    )
+                    if matches:
+                        self.stdout.write(f'{table}.{name}: ok')
+                        continue
+                    problems += 1
+                    self.stdout.write(self.style.WARNING(f'{table}.{name}: definition differs'))
+                    if check_only:
+                        continue
+                    model.objects.mongo_drop_index(name)
+                else:
+                    problems += 1
+                    self.stdout.write(self.style.WARNING(f'{table}.{name}: missing'))
+                    if check_only:
+                        continue
+
+                model.objects.mongo_create_index(keys, name=name, unique=unique)
+                self.stdout.write(self.style.SUCCESS(f'{table}.{name}: created'))
+
+        if check_only and problems:
+            raise CommandError(f'{problems} index(es) missing or out of date')
+        self.stdout.write(self.style.SUCCESS('Indexes are up to date'))
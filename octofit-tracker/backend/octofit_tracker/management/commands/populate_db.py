@@ -1,199 +1,264 @@
+import random
+from datetime import timedelta
+from itertools import islice
+
+from bson import ObjectId
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from octofit_tracker import leaderboard, versions
 from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timedelta
-import random
+
+
+MARVEL_HEROES = [
+    {'name': 'Tony Stark', 'email': 'ironman@marvel.com', 'password': 'stark123'},
+    {'name': 'Steve Rogers', 'email': 'captain@marvel.com', 'password': 'shield123'},
+    {'name': 'Thor Odinson', 'email': 'thor@marvel.com', 'password': 'hammer123'},
+    {'name': 'Natasha Romanoff', 'email': 'blackwidow@marvel.com', 'password': 'widow123'},
+    {'name': 'Bruce Banner', 'email': 'hulk@marvel.com', 'password': 'smash123'},
+    {'name': 'Peter Parker', 'email': 'spiderman@marvel.com', 'password': 'web123'},
+]
+
+DC_HEROES = [
+    {'name': 'Clark Kent', 'email': 'superman@dc.com', 'password': 'krypton123'},
+    {'name': 'Bruce Wayne', 'email': 'batman@dc.com', 'password': 'gotham123'},
+    {'name': 'Diana Prince', 'email': 'wonderwoman@dc.com', 'password': 'themyscira123'},
+    {'name': 'Barry Allen', 'email': 'flash@dc.com', 'password': 'speed123'},
+    {'name': 'Arthur Curry', 'email': 'aquaman@dc.com', 'password': 'atlantis123'},
+    {'name': 'Hal Jordan', 'email': 'greenlantern@dc.com', 'password': 'willpower123'},
+]
+
+WORKOUTS = [
+    {
+        'name': 'Iron Man Cardio Blast',
+        'description': 'High-intensity cardio workout to boost stamina and endurance',
+        'activity_type': 'HIIT',
+        'duration': 30,
+        'difficulty': 'hard',
+        'target_calories': 400
+    },
+    {
+        'name': 'Captain America Strength Training',
+        'description': 'Build strength and muscle with this comprehensive workout',
+        'activity_type': 'Weight Training',
+        'duration': 60,
+        'difficulty': 'medium',
+        'target_calories': 450
+    },
+    {
+        'name': 'Thor Thunder Run',
+        'description': 'Long-distance running to build godlike endurance',
+        'activity_type': 'Running',
+        'duration': 45,
+        'difficulty': 'medium',
+        'target_calories': 500
+    },
+    {
+        'name': 'Black Widow Flexibility Flow',
+        'description': 'Yoga and stretching for flexibility and balance',
+        'activity_type': 'Yoga',
+        'duration': 40,
+        'difficulty': 'easy',
+        'target_calories': 200
+    },
+    {
+        'name': 'Superman Speed Cycling',
+        'description': 'Fast-paced cycling workout for speed and power',
+        'activity_type': 'Cycling',
+        'duration': 50,
+        'difficulty': 'hard',
+        'target_calories': 550
+    },
+    {
+        'name': 'Batman Night Patrol',
+        'description': 'Evening run through the city streets',
+        'activity_type': 'Running',
+        'duration': 35,
+        'difficulty': 'easy',
+        'target_calories': 350
+    },
+    {
+        'name': 'Wonder Woman Warrior Training',
+        'description': 'Complete warrior workout combining strength and cardio',
+        'activity_type': 'HIIT',
+        'duration': 45,
+        'difficulty': 'hard',
+        'target_calories': 480
+    },
+    {
+        'name': 'Flash Speed Circuit',
+        'description': 'Lightning-fast circuit training for maximum results',
+        'activity_type': 'HIIT',
+        'duration': 25,
+        'difficulty': 'hard',
+        'target_calories': 380
+    },
+    {
+        'name': 'Aquaman Swim Session',
+        'description': 'Ocean-inspired swimming workout for full body fitness',
+        'activity_type': 'Swimming',
+        'duration': 40,
+        'difficulty': 'medium',
+        'target_calories': 420
+    },
+]
+
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'HIIT']
+DISTANCE_ACTIVITY_TYPES = {'Running', 'Cycling', 'Swimming'}
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items without materializing ``iterable``"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class Command(BaseCommand):
-    help = 'Populate the octofit_db database with test data'
+    help = (
+        'Populate the octofit_db database with test data. Without --users the '
+        'superhero roster is created; with --users a synthetic dataset of that '
+        'size is generated for load testing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, help='Number of synthetic users to generate')
+        parser.add_argument('--teams', type=int, default=20, help='Number of synthetic teams (with --users)')
+        parser.add_argument(
+            '--activities-per-user',
+            type=int,
+            help='Activities per user (default: a random 5-15 per user)',
+        )
+        parser.add_argument('--days', type=int, default=30, help='Spread activity dates over this many past days')
+        parser.add_argument('--seed', type=int, help='Random seed for a reproducible dataset')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Documents per insert_many batch')
 
     def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.verbosity = options['verbosity']
+        self.chunk_size = options['chunk_size']
+        self.now = timezone.now()
         self.stdout.write(self.style.SUCCESS('Starting database population...'))
         
         # Delete existing data
         self.stdout.write('Deleting existing data...')
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        for model in (User, Team, Activity, Leaderboard, Workout):
+            model.objects.mongo_delete_many({})
+        cache.clear()
         
-        # Create Teams
+        # Create Teams and Users
         self.stdout.write('Creating teams...')
-        team_marvel = Team.objects.create(
-            name='Team Marvel',
-            description='Earth\'s Mightiest Heroes fitness team'
-        )
-        team_dc = Team.objects.create(
-            name='Team DC',
-            description='Justice League fitness warriors'
-        )
-        
-        # Create Users
-        self.stdout.write('Creating users...')
-        marvel_heroes = [
-            {'name': 'Tony Stark', 'email': 'ironman@marvel.com', 'password': 'stark123'},
-            {'name': 'Steve Rogers', 'email': 'captain@marvel.com', 'password': 'shield123'},
-            {'name': 'Thor Odinson', 'email': 'thor@marvel.com', 'password': 'hammer123'},
-            {'name': 'Natasha Romanoff', 'email': 'blackwidow@marvel.com', 'password': 'widow123'},
-            {'name': 'Bruce Banner', 'email': 'hulk@marvel.com', 'password': 'smash123'},
-            {'name': 'Peter Parker', 'email': 'spiderman@marvel.com', 'password': 'web123'},
+        if options['users'] is None:
+            rosters = [
+                ('Team Marvel', 'Earth\'s Mightiest Heroes fitness team', MARVEL_HEROES),
+                ('Team DC', 'Justice League fitness warriors', DC_HEROES),
+            ]
+        else:
+            rosters = self.synthetic_rosters(options['users'], options['teams'])
+        teams = [
+            {'_id': ObjectId(), 'name': name, 'description': description, 'created_at': self.now}
+            for name, description, _ in rosters
         ]
+        self.insert(Team, teams)
         
-        dc_heroes = [
-            {'name': 'Clark Kent', 'email': 'superman@dc.com', 'password': 'krypton123'},
-            {'name': 'Bruce Wayne', 'email': 'batman@dc.com', 'password': 'gotham123'},
-            {'name': 'Diana Prince', 'email': 'wonderwoman@dc.com', 'password': 'themyscira123'},
-            {'name': 'Barry Allen', 'email': 'flash@dc.com', 'password': 'speed123'},
-            {'name': 'Arthur Curry', 'email': 'aquaman@dc.com', 'password': 'atlantis123'},
-            {'name': 'Hal Jordan', 'email': 'greenlantern@dc.com', 'password': 'willpower123'},
-        ]
-        
-        marvel_users = []
-        for hero in marvel_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                password=hero['password'],
-                team_id=str(team_marvel._id)
-            )
-            marvel_users.append(user)
+        self.stdout.write('Creating users...')
+        user_teams = {}
+        user_names = {}
         
-        dc_users = []
-        for hero in dc_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                password=hero['password'],
-                team_id=str(team_dc._id)
-            )
-            dc_users.append(user)
+        def user_documents():
+            for team, (_, _, members) in zip(teams, rosters):
+                for member in members:
+                    document = dict(member, _id=ObjectId(), team_id=str(team['_id']), created_at=self.now)
+                    user_teams[str(document['_id'])] = document['team_id']
+                    user_names[str(document['_id'])] = document['name']
+                    yield document
         
-        all_users = marvel_users + dc_users
+        self.insert(User, user_documents())
         
         # Create Activities
         self.stdout.write('Creating activities...')
-        activity_types = ['Running', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'HIIT']
+        self.insert(Activity, self.activity_documents(
+            user_names, options['activities_per_user'], options['days']
+        ))
         
-        for user in all_users:
-            num_activities = random.randint(5, 15)
-            for i in range(num_activities):
-                activity_type = random.choice(activity_types)
-                duration = random.randint(20, 90)
-                distance = round(random.uniform(2, 15), 2) if activity_type in ['Running', 'Cycling', 'Swimming'] else None
-                calories = duration * random.randint(5, 12)
-                
-                Activity.objects.create(
-                    user_id=str(user._id),
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=distance,
-                    calories=calories,
-                    date=datetime.now() - timedelta(days=random.randint(0, 30)),
-                    notes=f'{activity_type} session by {user.name}'
-                )
-        
-        # Create Leaderboard entries
+        # Create Leaderboard entries from one server-side aggregation
         self.stdout.write('Creating leaderboard entries...')
-        for user in all_users:
-            user_activities = Activity.objects.filter(user_id=str(user._id))
-            total_calories = sum(activity.calories for activity in user_activities)
-            total_duration = sum(activity.duration for activity in user_activities)
-            total_activities = user_activities.count()
-            
-            Leaderboard.objects.create(
-                user_id=str(user._id),
-                team_id=user.team_id,
-                total_calories=total_calories,
-                total_duration=total_duration,
-                total_activities=total_activities
-            )
+        totals = Activity.objects.mongo_aggregate(leaderboard.totals_pipeline(), allowDiskUse=True)
+        self.insert(Leaderboard, (
+            {
+                '_id': ObjectId(),
+                'user_id': row['_id'],
+                'team_id': user_teams.get(row['_id']),
+                'total_calories': row['total_calories'],
+                'total_duration': row['total_duration'],
+                'total_activities': row['total_activities'],
+                'last_updated': self.now,
+            }
+            for row in totals
+        ))
+        
+        self.stdout.write('Creating daily rollups...')
+        call_command('backfill_rollups', chunk_size=self.chunk_size, stdout=self.stdout)
         
         # Create Workouts
         self.stdout.write('Creating workouts...')
-        workouts = [
-            {
-                'name': 'Iron Man Cardio Blast',
-                'description': 'High-intensity cardio workout to boost stamina and endurance',
-                'activity_type': 'HIIT',
-                'duration': 30,
-                'difficulty': 'hard',
-                'target_calories': 400
-            },
-            {
-                'name': 'Captain America Strength Training',
-                'description': 'Build strength and muscle with this comprehensive workout',
-                'activity_type': 'Weight Training',
-                'duration': 60,
-                'difficulty': 'medium',
-                'target_calories': 450
-            },
-            {
-                'name': 'Thor Thunder Run',
-                'description': 'Long-distance running to build godlike endurance',
-                'activity_type': 'Running',
-                'duration': 45,
-                'difficulty': 'medium',
-                'target_calories': 500
-            },
-            {
-                'name': 'Black Widow Flexibility Flow',
-                'description': 'Yoga and stretching for flexibility and balance',
-                'activity_type': 'Yoga',
-                'duration': 40,
-                'difficulty': 'easy',
-                'target_calories': 200
-            },
-            {
-                'name': 'Superman Speed Cycling',
-                'description': 'Fast-paced cycling workout for speed and power',
-                'activity_type': 'Cycling',
-                'duration': 50,
-                'difficulty': 'hard',
-                'target_calories': 550
-            },
-            {
-                'name': 'Batman Night Patrol',
-                'description': 'Evening run through the city streets',
-                'activity_type': 'Running',
-                'duration': 35,
-                'difficulty': 'easy',
-                'target_calories': 350
-            },
-            {
-                'name': 'Wonder Woman Warrior Training',
-                'description': 'Complete warrior workout combining strength and cardio',
-                'activity_type': 'HIIT',
-                'duration': 45,
-                'difficulty': 'hard',
-                'target_calories': 480
-            },
-            {
-                'name': 'Flash Speed Circuit',
-                'description': 'Lightning-fast circuit training for maximum results',
-                'activity_type': 'HIIT',
-                'duration': 25,
-                'difficulty': 'hard',
-                'target_calories': 380
-            },
-            {
-                'name': 'Aquaman Swim Session',
-                'description': 'Ocean-inspired swimming workout for full body fitness',
-                'activity_type': 'Swimming',
-                'duration': 40,
-                'difficulty': 'medium',
-                'target_calories': 420
-            },
-        ]
-        
-        for workout_data in workouts:
-            Workout.objects.create(**workout_data)
+        self.insert(Workout, (dict(workout, _id=ObjectId(), last_updated=self.now) for workout in WORKOUTS))
+        versions.bump(User, Team, Activity, Leaderboard, Workout)
         
         # Print summary
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
-        self.stdout.write(f'Teams created: {Team.objects.count()}')
-        self.stdout.write(f'Users created: {User.objects.count()}')
-        self.stdout.write(f'Activities created: {Activity.objects.count()}')
-        self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.count()}')
-        self.stdout.write(f'Workouts created: {Workout.objects.count()}')
-        self.stdout.write(self.style.SUCCESS('Database successfully populated with superhero test data!'))
+        self.stdout.write(f'Teams created: {Team.objects.mongo_count_documents({})}')
+        self.stdout.write(f'Users created: {User.objects.mongo_count_documents({})}')
+        self.stdout.write(f'Activities created: {Activity.objects.mongo_count_documents({})}')
+        self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.mongo_count_documents({})}')
+        self.stdout.write(f'Workouts created: {Workout.objects.mongo_count_documents({})}')
+        self.stdout.write(self.style.SUCCESS('Database successfully populated!'))
+
+    def synthetic_rosters(self, users, teams):
+        """Spread ``users`` generated athletes round-robin over ``teams`` teams"""
+        teams = max(1, teams)
+
+        def members(team_number):
+            for number in range(team_number, users, teams):
+                yield {
+                    'name': f'Athlete {number + 1}',
+                    'email': f'athlete{number + 1}@octofit.test',
+                    'password': 'octofit123',
+                }
+
+        return [
+            (f'Team {number + 1}', f'Synthetic load-test team {number + 1}', members(number))
+            for number in range(teams)
+        ]
+
+    def activity_documents(self, user_names, per_user, days):
+        """Generate activity documents lazily, one user at a time"""
+        rng = self.rng
+        for user_id, name in user_names.items():
+            count = per_user if per_user is not None else rng.randint(5, 15)
+            for _ in range(count):
+                activity_type = rng.choice(ACTIVITY_TYPES)
+                duration = rng.randint(20, 90)
+                distance = round(rng.uniform(2, 15), 2) if activity_type in DISTANCE_ACTIVITY_TYPES else None
+                yield {
+                    '_id': ObjectId(),
+                    'user_id': user_id,
+                    'activity_type': activity_type,
+                    'duration': duration,
+                    'distance': distance,
+                    'calories': duration * rng.randint(5, 12),
+                    'date': self.now - timedelta(seconds=rng.randint(0, days * 86400)),
+                    'notes': f'{activity_type} session by {name}',
+                }
+
+    def insert(self, model, documents):
+        """Write ``documents`` in insert_many batches of ``--chunk-size``"""
+        for chunk in chunked(documents, self.chunk_size):
+            model.objects.mongo_insert_many(chunk, ordered=False)
+            if self.verbosity > 1:
+                self.stdout.write(f'  {model._meta.db_table}: +{len(chunk)}')
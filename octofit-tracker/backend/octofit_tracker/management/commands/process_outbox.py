@@ -0,0 +1,32 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import outbox
+
+
+class Command(BaseCommand):
+    help = 'Run write-behind outbox workers in the foreground, or drain the outbox once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.OCTOFIT_OUTBOX_WORKERS or 1, help='Worker threads')
+        parser.add_argument('--drain', action='store_true', help='Process every due event once and exit')
+
+    def handle(self, *args, **options):
+        if options['drain']:
+            handled = outbox.drain()
+            self.stdout.write(self.style.SUCCESS(f'Outbox drained: {handled} events'))
+            self.stdout.write(str(outbox.stats()))
+            return
+
+        pool = outbox.WorkerPool(options['workers'])
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopped.set())
+        pool.start()
+        self.stdout.write(f'Processing the outbox with {pool.size} workers, Ctrl-C to stop')
+        stopped.wait()
+        pool.stop()
+        self.stdout.write(self.style.SUCCESS('Outbox workers stopped'))
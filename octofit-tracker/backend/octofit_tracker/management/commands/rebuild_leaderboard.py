@@ -0,0 +1,110 @@
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import leaderboard, versions
+from octofit_tracker.cache import leaderboard_scopes, response_cache
+from octofit_tracker.management.commands.populate_db import chunked
+from octofit_tracker.models import Activity, Leaderboard
+
+SAMPLE_SIZE = 10
+
+
+def reconcile_chunk(user_ids, dry_run):
+    """
+    Diff one chunk of users and, unless ``dry_run``, write the corrections.
+    Runs in a worker process, so it returns a small summary rather than
+    every drifted row.
+    """
+    drifted = leaderboard.drift(user_ids)
+    teams = set()
+    if not dry_run and drifted:
+        leaderboard.write_corrections(drifted)
+        entries = Leaderboard.objects.mongo_find({'user_id': {'$in': list(drifted)}}, {'team_id': 1})
+        teams.update(entry.get('team_id') for entry in entries)
+    counts = Counter(checked=len(user_ids))
+    delta = Counter()
+    for user_id, changes in drifted.items():
+        missing = changes.get('total_activities', (0, 0))[0] is None
+        counts['missing' if missing else 'drifted'] += 1
+        if 'team_id' in changes and not missing:
+            counts['team_changed'] += 1
+        for field in leaderboard.TOTAL_FIELDS:
+            if field in changes:
+                stored, expected = changes[field]
+                delta[field] += expected - (stored or 0)
+        # An entry that moved team leaves its old team's board too
+        teams.update(changes.get('team_id', ()))
+    return {
+        'counts': counts,
+        'delta': delta,
+        'teams': teams - {None},
+        'sample': dict(list(drifted.items())[:SAMPLE_SIZE]),
+    }
+
+
+def distinct_user_ids(model):
+    rows = model.objects.mongo_aggregate([{'$group': {'_id': '$user_id'}}], allowDiskUse=True)
+    return (row['_id'] for row in rows if row['_id'] is not None)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the leaderboard totals from the activities collection and '
+        'write only the entries that drifted. Unlike populate_db this leaves '
+        'every other collection alone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report the drift without writing anything')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users per aggregation and bulk write')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(os.cpu_count() or 1, 8),
+            help='Worker processes; 1 reconciles in this process',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        user_ids = sorted(set(distinct_user_ids(Activity)) | set(distinct_user_ids(Leaderboard)))
+        chunks = list(chunked(user_ids, options['chunk_size']))
+        workers = max(1, min(options['workers'], len(chunks)))
+        self.stdout.write(f'Checking {len(user_ids)} users in {len(chunks)} chunks with {workers} workers...')
+
+        if workers == 1:
+            results = [reconcile_chunk(chunk, dry_run) for chunk in chunks]
+        else:
+            # Forked workers reconnect to MongoDB on their own (see mongo.py);
+            # spawned ones set Django up again first.
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+                results = list(executor.map(reconcile_chunk, chunks, [dry_run] * len(chunks)))
+
+        counts, delta, teams, sample = Counter(), Counter(), set(), {}
+        for result in results:
+            counts.update(result['counts'])
+            delta.update(result['delta'])
+            teams |= result['teams']
+            sample.update(list(result['sample'].items())[:SAMPLE_SIZE - len(sample)])
+
+        changed = counts['missing'] + counts['drifted']
+        self.stdout.write(f"Missing entries: {counts['missing']}")
+        self.stdout.write(f"Drifted entries: {counts['drifted']} ({counts['team_changed']} with a stale team)")
+        self.stdout.write(f"Unchanged entries: {counts['checked'] - changed}")
+        for field in leaderboard.TOTAL_FIELDS:
+            if delta[field]:
+                self.stdout.write(f'  {field}: {delta[field]:+d} overall')
+        for user_id, changes in sample.items():
+            described = ', '.join(f'{field} {stored} -> {expected}' for field, (stored, expected) in changes.items())
+            self.stdout.write(f'  {user_id}: {described}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'Dry run: {changed} entries would be written'))
+            return
+        if changed:
+            response_cache.invalidate(*leaderboard_scopes(teams))
+            versions.bump(Leaderboard)
+        self.stdout.write(self.style.SUCCESS(f'Leaderboard reconciled: {changed} entries written'))
@@ -9,8 +9,13 @@ class User(models.Model):
     team_id = models.CharField(max_length=24, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id'], name='user_team_idx'),
+        ]
         
     def __str__(self):
         return self.name
@@ -22,6 +27,8 @@ class Team(models.Model):
     description = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'teams'
         
@@ -39,8 +46,16 @@ class Activity(models.Model):
     date = models.DateTimeField()
     notes = models.TextField(null=True, blank=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'activities'
+        # MongoDB walks compound indexes in either direction, so ascending
+        # keys also serve the newest-first (-date, -_id) cursor ordering.
+        indexes = [
+            models.Index(fields=['user_id', 'date', '_id'], name='activity_user_date_idx'),
+            models.Index(fields=['date', '_id'], name='activity_date_idx'),
+        ]
         
     def __str__(self):
         return f"{self.activity_type} - {self.duration} min"
@@ -55,13 +70,133 @@ class Leaderboard(models.Model):
     total_activities = models.IntegerField(default=0)
     last_updated = models.DateTimeField(auto_now=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['team_id', 'total_calories', '_id'], name='leaderboard_team_cal_idx'),
+            models.Index(fields=['total_calories', '_id'], name='leaderboard_cal_idx'),
+            models.Index(fields=['last_updated'], name='leaderboard_updated_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user_id'], name='leaderboard_user_uniq'),
+        ]
         
     def __str__(self):
         return f"User {self.user_id} - {self.total_calories} cal"
 
 
+class ActivityRollup(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    user_id = models.CharField(max_length=24)
+    team_id = models.CharField(max_length=24, null=True, blank=True)
+    day = models.DateTimeField()  # midnight UTC
+    activity_type = models.CharField(max_length=50)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0)  # in kilometers
+    total_activities = models.IntegerField(default=0)
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activity_rollups'
+        indexes = [
+            models.Index(fields=['team_id', 'day'], name='rollup_team_day_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'day', 'activity_type'], name='rollup_user_day_type_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"User {self.user_id} - {self.activity_type} on {self.day:%Y-%m-%d}"
+
+
+class LeaderboardWindow(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    window = models.CharField(max_length=10)  # 7d, 30d
+    user_id = models.CharField(max_length=24)
+    team_id = models.CharField(max_length=24, null=True, blank=True)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_activities = models.IntegerField(default=0)
+    last_updated = models.DateTimeField(auto_now=True)
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'leaderboard_windows'
+        indexes = [
+            models.Index(fields=['window', 'team_id', 'total_calories', '_id'], name='window_team_cal_idx'),
+            models.Index(fields=['window', 'total_calories', '_id'], name='window_cal_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'user_id'], name='window_user_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"User {self.user_id} - {self.total_calories} cal ({self.window})"
+
+
+class LeaderboardWindowState(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    window = models.CharField(max_length=10, unique=True)
+    start = models.DateTimeField()  # first day counted, midnight UTC
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'leaderboard_window_state'
+        
+    def __str__(self):
+        return f"{self.window} from {self.start:%Y-%m-%d}"
+
+
+class OutboxEvent(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    user_id = models.CharField(max_length=24)
+    day = models.DateTimeField()  # midnight UTC
+    partition = models.IntegerField()
+    token = models.CharField(max_length=24)  # changes with every write, see outbox.py
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField()
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activity_outbox'
+        indexes = [
+            models.Index(fields=['partition', 'available_at'], name='outbox_partition_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'day'], name='outbox_user_day_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"User {self.user_id} on {self.day:%Y-%m-%d}"
+
+
+class OutboxLease(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    partition = models.IntegerField()
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activity_outbox_leases'
+        constraints = [
+            models.UniqueConstraint(fields=['partition'], name='outbox_lease_partition_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"Partition {self.partition} ({self.owner})"
+
+
 class Workout(models.Model):
     _id = models.ObjectIdField(primary_key=True)
     name = models.CharField(max_length=100)
@@ -70,9 +205,16 @@ class Workout(models.Model):
     duration = models.IntegerField()  # in minutes
     difficulty = models.CharField(max_length=20)  # easy, medium, hard
     target_calories = models.IntegerField()
+    last_updated = models.DateTimeField(auto_now=True)
+    
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['activity_type', 'difficulty'], name='workout_type_difficulty_idx'),
+            models.Index(fields=['difficulty'], name='workout_difficulty_idx'),
+        ]
         
     def __str__(self):
         return self.name
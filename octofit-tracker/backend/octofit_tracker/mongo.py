@@ -0,0 +1,190 @@
+"""
+Process-wide MongoDB clients and their connection pool statistics.
+
+``get_client()`` returns the one MongoClient of this process. It is the
+client djongo keeps in ``djongo.database.clients`` and hands to every
+Django connection in every thread, so the ORM, the ``mongo_*`` manager
+methods and the raw pymongo paths all share a single pool, sized by
+``settings.MONGO_CLIENT_OPTIONS``. ``get_async_database()`` returns the
+same database on a Motor client bound to the running event loop.
+
+Motor clients cannot be shared between event loops, so there is one per
+loop. The async views are meant to be served by an ASGI server (uvicorn,
+daphne), where each worker process runs one long-lived loop and therefore
+has exactly one Motor client. Under WSGI, every async view call runs on a
+short-lived loop of its own. The client of a loop that has been closed is
+closed, with its pool and monitor threads, as soon as another loop asks
+for a client, so at most one idle client is left behind. The remaining
+clients are closed when the process exits.
+
+MongoClient is not fork-safe. When a pre-forking server such as gunicorn
+forks a worker, the child drops every client it inherited, without closing
+the parent's sockets, and connects afresh on first use.
+
+``pool_stats`` is a ConnectionPoolListener (registered in ``apps.py``) that
+counts connections created, closed and checked out, and the threads
+waiting for one, per server.
+"""
+import asyncio
+import atexit
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import connections
+from djongo import database as djongo_database
+from pymongo import monitoring
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # pragma: no cover - motor is optional
+    AsyncIOMotorClient = None
+
+_async_clients = {}  # event loop -> Motor client
+_async_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def client_settings():
+    """Return the database name and MongoClient options of the default database"""
+    database = settings.DATABASES['default']
+    return database['NAME'], dict(database.get('CLIENT', {}))
+
+
+def _check_fork():
+    # Backstop for platforms without os.register_at_fork
+    if os.getpid() != _pid:
+        reset_after_fork()
+
+
+def get_client():
+    """The MongoClient shared by djongo and every raw pymongo path in this process"""
+    _check_fork()
+    name, options = client_settings()
+    # Same arguments as djongo's DatabaseWrapper.get_new_connection, so both
+    # resolve to the same cached client.
+    return djongo_database.connect(db=name, document_class=OrderedDict, **options)
+
+
+def get_database():
+    """The default database on the shared pymongo client"""
+    return get_client()[client_settings()[0]]
+
+
+def get_async_database():
+    """
+    The default database on a Motor client for the running event loop, or
+    None when Motor is not installed.
+    """
+    if AsyncIOMotorClient is None:
+        return None
+    _check_fork()
+    loop = asyncio.get_running_loop()
+    with _async_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            _close_async_clients(closed_loops_only=True)
+            client = _async_clients[loop] = AsyncIOMotorClient(io_loop=loop, **client_settings()[1])
+    return client[client_settings()[0]]
+
+
+def _close_async_clients(closed_loops_only=False):
+    # The client keeps its loop alive, so neither can be garbage collected
+    # while it is in _async_clients: drop them explicitly.
+    for loop in list(_async_clients):
+        if not closed_loops_only or loop.is_closed():
+            _async_clients.pop(loop).close()
+
+
+@atexit.register
+def close_async_clients():
+    """Close every Motor client of this process"""
+    with _async_lock:
+        _close_async_clients()
+
+
+def reset_after_fork():
+    """Forget every client inherited from the parent process"""
+    global _pid
+    _pid = os.getpid()
+    djongo_database.clients.clear()
+    _async_clients.clear()
+    for connection in connections.all(initialized_only=True):
+        # Drop, don't close: closing would also tear down the parent's pool.
+        connection.connection = None
+        connection.client_connection = None
+    pool_stats.reset()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters per server address"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers = defaultdict(Counter)
+
+    def _update(self, event, **changes):
+        address = '%s:%s' % event.address
+        with self._lock:
+            self._servers[address].update(changes)
+
+    def pool_created(self, event):
+        self._update(event, pools=1)
+
+    def pool_cleared(self, event):
+        self._update(event, cleared=1)
+
+    def pool_closed(self, event):
+        self._update(event, pools=-1)
+
+    def connection_created(self, event):
+        self._update(event, created=1, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, closed=1, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._update(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event, waiting=-1, check_out_failed=1)
+
+    def connection_checked_out(self, event):
+        self._update(event, waiting=-1, checked_out=1, check_outs=1)
+
+    def connection_checked_in(self, event):
+        self._update(event, checked_out=-1)
+
+    def snapshot(self):
+        fields = ('pools', 'open', 'checked_out', 'waiting', 'created', 'closed', 'check_outs',
+                  'check_out_failed', 'cleared')
+        with self._lock:
+            servers = {
+                address: {field: counters[field] for field in fields}
+                for address, counters in sorted(self._servers.items())
+            }
+        options = {key: value for key, value in client_settings()[1].items() if key not in ('username', 'password')}
+        if isinstance(options.get('host'), str):
+            # Hide credentials embedded in a mongodb:// URI
+            options['host'] = re.sub(r'//[^@/]*@', '//***@', options['host'])
+        return {
+            'pid': os.getpid(),
+            'clients': len(djongo_database.clients) + len(_async_clients),
+            'options': options,
+            'servers': servers,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._servers.clear()
+
+
+pool_stats = PoolStats()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
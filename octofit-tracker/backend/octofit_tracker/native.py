@@ -0,0 +1,138 @@
+"""
+Direct pymongo read path for the read-heavy endpoints.
+
+Queries built here skip Django's SQL compiler and djongo's SQL-to-Mongo
+translator. They run as plain ``find`` calls and return the same dicts
+the matching serializer would produce. Which endpoints use this path is
+controlled by ``settings.OCTOFIT_NATIVE_ENDPOINTS``. A single request can
+force either path with ``?query_path=native`` or ``?query_path=orm`` so
+the two can be compared side by side.
+"""
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING
+
+from . import instrumentation
+
+
+def enabled(endpoint, request):
+    """Return True if ``endpoint`` should be served by the native path"""
+    query_path = request.query_params.get('query_path')
+    if query_path in ('native', 'orm'):
+        return query_path == 'native'
+    return endpoint in settings.OCTOFIT_NATIVE_ENDPOINTS
+
+
+class MongoQuery:
+    """
+    A lazy, chainable ``find`` that quacks enough like a QuerySet for
+    DRF's CursorPagination: ``filter``, ``order_by``, ``only`` and slicing.
+    Iterating it yields raw documents.
+    """
+    lookups = {'lt': '$lt', 'lte': '$lte', 'gt': '$gt', 'gte': '$gte', 'in': '$in'}
+
+    def __init__(self, model, serializer_class):
+        self.model = model
+        self.serializer_class = serializer_class
+        self.query = {}
+        self.sort = []
+        self.fields = None
+
+    def _clone(self):
+        clone = MongoQuery(self.model, self.serializer_class)
+        clone.query = dict(self.query)
+        clone.sort = list(self.sort)
+        clone.fields = self.fields
+        return clone
+
+    def _prepare(self, field_name, value):
+        field = self.model._meta.get_field(field_name)
+        if isinstance(value, (list, tuple)):
+            return field.column, [field.to_python(item) for item in value]
+        return field.column, field.to_python(value)
+
+    def filter(self, **kwargs):
+        clone = self._clone()
+        for key, value in kwargs.items():
+            field_name, _, lookup = key.partition('__')
+            column, value = self._prepare(field_name, value)
+            if lookup:
+                clone.query.setdefault(column, {})[self.lookups[lookup]] = value
+            else:
+                clone.query[column] = value
+        return clone
+
+    def order_by(self, *ordering):
+        clone = self._clone()
+        clone.sort = [
+            (
+                self.model._meta.get_field(name.lstrip('-')).column,
+                DESCENDING if name.startswith('-') else ASCENDING,
+            )
+            for name in ordering
+        ]
+        return clone
+
+    def only(self, *names):
+        """Load only the serializer fields in ``names``"""
+        clone = self._clone()
+        clone.fields = names
+        return clone
+
+    @property
+    def projection(self):
+        projection = {name: 1 for name in readable_fields(self.serializer_class, self.fields)}
+        # The cursor paginator reads its position from the sort keys
+        projection.update((column, 1) for column, _ in self.sort)
+        return projection
+
+    def _find(self, skip=0, limit=0):
+        cursor = self.model.objects.mongo_find(self.query, self.projection)
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+        return cursor.skip(skip).limit(limit)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('MongoQuery only supports slicing without a step')
+        start = key.start or 0
+        limit = key.stop - start if key.stop is not None else 0
+        return list(self._find(skip=start, limit=limit))
+
+    def __iter__(self):
+        return iter(self._find())
+
+
+def readable_fields(serializer_class, only=None):
+    """
+    Return the non write-only fields of ``serializer_class`` by name,
+    limited to the names in ``only`` when given.
+    """
+    return {
+        name: field
+        for name, field in serializer_class().fields.items()
+        if not field.write_only and (only is None or name in only)
+    }
+
+
+def representer(serializer_class, only=None):
+    """Return a function that renders one raw document like ``serializer_class``"""
+    fields = readable_fields(serializer_class, only).items()
+
+    def convert(field, value):
+        if value is None:
+            return None
+        if isinstance(value, ObjectId):
+            return str(value)
+        return field.to_representation(value)
+
+    def represent_one(doc):
+        return {name: convert(field, doc.get(name)) for name, field in fields}
+
+    return represent_one
+
+
+def represent(docs, serializer_class, only=None):
+    """Render raw documents the way ``serializer_class(many=True)`` would"""
+    with instrumentation.timer('serialize'):
+        return list(map(representer(serializer_class, only), docs))
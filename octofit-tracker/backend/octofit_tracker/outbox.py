@@ -0,0 +1,283 @@
+"""
+Write-behind for activity writes.
+
+With ``OCTOFIT_WRITE_BEHIND`` an activity write only stores the activity
+and upserts one ``OutboxEvent`` per (user, UTC day) it touched. Everything
+derived from activities is then brought up to date by a pool of worker
+threads: the leaderboard, the daily rollups, the windowed leaderboards and
+the caches built from them.
+
+Events are durable documents in the ``activity_outbox`` collection:
+
+* A burst of writes for the same user and day collapses into one pending
+  event. Each write stamps the event with a new ``token``, and a worker only
+  deletes an event whose token it has processed. A write that lands while
+  the event is being processed therefore keeps it pending.
+* Events are spread over ``OCTOFIT_OUTBOX_PARTITIONS`` partitions by user.
+  A worker holds an expiring lease (``OutboxLease``) on a partition while it
+  processes it, so one user is never recomputed by two workers at once,
+  even across processes.
+* Workers recompute the affected rows from the stored activities
+  (``projections.recompute``) instead of applying increments. A retry after
+  a crash or a partial failure cannot count an activity twice.
+* A failed event is retried with exponential backoff. After
+  ``OCTOFIT_OUTBOX_MAX_ATTEMPTS`` it is left for inspection in the admin
+  until the next write for its user and day revives it.
+
+Every process that enqueues starts ``OCTOFIT_OUTBOX_WORKERS`` worker threads
+on first use. ``manage.py process_outbox`` runs a pool on its own, or
+drains the outbox once.
+
+A worker first asks which partitions have due events (one ``distinct``
+query) and leases only those, so an idle outbox costs one query per poll.
+While nothing is due a worker polls less and less often, from
+``OCTOFIT_OUTBOX_POLL_SECONDS`` up to ``OCTOFIT_OUTBOX_IDLE_POLL_SECONDS``.
+An enqueue in the same process wakes its workers right away.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+import zlib
+from datetime import timedelta, timezone as dt_timezone
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from . import projections
+from .models import OutboxEvent, OutboxLease
+from .rollups import day_of
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+MAX_BACKOFF_SECONDS = 300
+
+
+def partition_of(user_id):
+    """Stable partition of ``user_id``, the same in every process"""
+    return zlib.crc32(str(user_id).encode()) % settings.OCTOFIT_OUTBOX_PARTITIONS
+
+
+def enqueue(changes):
+    """Queue the derived updates of ``(activity, sign)`` pairs"""
+    pairs = {(activity.user_id, day_of(activity.date)) for activity, _ in changes}
+    if not pairs:
+        return
+    now = timezone.now()
+    operations = [
+        UpdateOne(
+            {'user_id': user_id, 'day': day},
+            {
+                '$set': {'token': str(ObjectId()), 'available_at': now, 'attempts': 0},
+                '$setOnInsert': {'partition': partition_of(user_id), 'created_at': now},
+            },
+            upsert=True,
+        )
+        for user_id, day in sorted(pairs)
+    ]
+    try:
+        OutboxEvent.objects.mongo_bulk_write(operations, ordered=False)
+    except BulkWriteError as exc:
+        # Two writes upserting the same new event race on the unique index;
+        # the loser finds the winner's document on a second attempt.
+        errors = exc.details['writeErrors']
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        OutboxEvent.objects.mongo_bulk_write([operations[error['index']] for error in errors], ordered=False)
+    ensure_workers()
+
+
+def acquire(partition, owner):
+    """Take or renew the lease on ``partition``; False if another worker holds it"""
+    now = timezone.now()
+    try:
+        OutboxLease.objects.mongo_update_one(
+            {'partition': partition, '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=settings.OCTOFIT_OUTBOX_LEASE_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def release(partition, owner):
+    OutboxLease.objects.mongo_update_one(
+        {'partition': partition, 'owner': owner}, {'$set': {'expires_at': timezone.now()}}
+    )
+
+
+def backoff(attempts):
+    """Seconds before retry number ``attempts``, with jitter"""
+    return min(2 ** attempts, MAX_BACKOFF_SECONDS) * random.uniform(0.5, 1)
+
+
+def process_batch(partition):
+    """Process the due events of ``partition``; return how many were handled"""
+    now = timezone.now()
+    events = list(
+        OutboxEvent.objects.mongo_find(
+            {
+                'partition': partition,
+                'available_at': {'$lte': now},
+                'attempts': {'$lt': settings.OCTOFIT_OUTBOX_MAX_ATTEMPTS},
+            },
+            {'user_id': 1, 'day': 1, 'token': 1, 'attempts': 1},
+        ).sort('available_at', 1).limit(settings.OCTOFIT_OUTBOX_BATCH_SIZE)
+    )
+    if not events:
+        return 0
+    try:
+        projections.recompute((event['user_id'], day_of(event['day'])) for event in events)
+        done, failed = events, []
+    except Exception:
+        logger.exception('Outbox batch of %d events failed; retrying them one by one', len(events))
+        done, failed = [], []
+        # Isolate the events that fail on their own
+        for event in events:
+            try:
+                projections.recompute([(event['user_id'], day_of(event['day']))])
+                done.append(event)
+            except Exception as exc:
+                failed.append((event, exc))
+
+    operations = [DeleteOne({'_id': event['_id'], 'token': event['token']}) for event in done]
+    for event, exc in failed:
+        attempts = event['attempts'] + 1
+        logger.warning('Outbox event %s failed (attempt %d): %r', event['_id'], attempts, exc)
+        operations.append(UpdateOne(
+            {'_id': event['_id'], 'token': event['token']},
+            {
+                '$set': {
+                    'attempts': attempts,
+                    'available_at': now + timedelta(seconds=backoff(attempts)),
+                    'last_error': repr(exc)[:1000],
+                },
+            },
+        ))
+    OutboxEvent.objects.mongo_bulk_write(operations, ordered=False)
+    return len(events)
+
+
+def process_partition(partition, owner):
+    """Drain ``partition`` while holding its lease; return the events handled"""
+    handled = 0
+    while acquire(partition, owner):
+        try:
+            count = process_batch(partition)
+        except Exception:
+            release(partition, owner)
+            raise
+        handled += count
+        if count < settings.OCTOFIT_OUTBOX_BATCH_SIZE:
+            break
+    release(partition, owner)
+    return handled
+
+
+def due_partitions():
+    """The partitions that have events due now, from one ``distinct`` query"""
+    return OutboxEvent.objects.mongo_distinct('partition', {
+        'available_at': {'$lte': timezone.now()},
+        'attempts': {'$lt': settings.OCTOFIT_OUTBOX_MAX_ATTEMPTS},
+    })
+
+
+def drain(owner=None):
+    """Process every due event of every partition; return how many were handled"""
+    owner = owner or new_owner()
+    partitions = due_partitions()
+    random.shuffle(partitions)
+    return sum(process_partition(partition, owner) for partition in partitions)
+
+
+def new_owner():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def stats():
+    """Pending and failed event counts and the age of the oldest event"""
+    max_attempts = settings.OCTOFIT_OUTBOX_MAX_ATTEMPTS
+    oldest = next(iter(OutboxEvent.objects.mongo_find({}, {'created_at': 1}).sort('created_at', 1).limit(1)), None)
+    age = None
+    if oldest is not None:
+        created_at = oldest['created_at']
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=dt_timezone.utc)
+        age = round((timezone.now() - created_at).total_seconds(), 3)
+    return {
+        'pending': OutboxEvent.objects.mongo_count_documents({'attempts': {'$lt': max_attempts}}),
+        'failed': OutboxEvent.objects.mongo_count_documents({'attempts': {'$gte': max_attempts}}),
+        'oldest_age_seconds': age,
+        'workers': _pool.size if _pool is not None and _pool.pid == os.getpid() else 0,
+    }
+
+
+class WorkerPool:
+    """Threads that keep draining the outbox until stopped"""
+
+    def __init__(self, size):
+        self.size = size
+        self.pid = os.getpid()
+        self.stopping = threading.Event()
+        self.woken = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.run, name=f'outbox-worker-{index}', daemon=True)
+            for index in range(size)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.woken.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def wake(self):
+        """Poll again now, after this process queued new events"""
+        self.woken.set()
+
+    def run(self):
+        owner = new_owner()
+        delay = settings.OCTOFIT_OUTBOX_POLL_SECONDS
+        while not self.stopping.is_set():
+            try:
+                handled = drain(owner)
+            except Exception:
+                logger.exception('Outbox worker failed')
+                handled = 0
+            if handled:
+                delay = settings.OCTOFIT_OUTBOX_POLL_SECONDS
+                continue
+            if self.woken.wait(delay):
+                self.woken.clear()
+                delay = settings.OCTOFIT_OUTBOX_POLL_SECONDS
+            else:
+                delay = min(delay * 2, settings.OCTOFIT_OUTBOX_IDLE_POLL_SECONDS)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def ensure_workers():
+    """Start this process's worker pool unless it is running or disabled"""
+    global _pool
+    if settings.OCTOFIT_OUTBOX_WORKERS <= 0:
+        return
+    with _pool_lock:
+        # Threads do not survive a fork: a forked worker starts its own pool
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = WorkerPool(settings.OCTOFIT_OUTBOX_WORKERS)
+            _pool.start()
+        else:
+            _pool.wake()
@@ -0,0 +1,29 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on ``_id``.
+
+    ObjectIds grow with insertion time, so paging on them never needs an
+    offset scan and every page costs the same regardless of its depth.
+
+    DRF's CursorPagination seeks on the first ordering field only. The
+    subclasses below add ``-_id`` after a field that can tie: it keeps the
+    order of tied rows stable, but it is not part of the cursor. A page
+    that starts inside a run of ties skips the rows already served with
+    an offset, so its cost grows with the length of that run.
+    """
+    ordering = '_id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class ActivityCursorPagination(IdCursorPagination):
+    """Cursor pagination for activities, newest first; seeks on ``date``"""
+    ordering = ('-date', '-_id')
+
+
+class LeaderboardCursorPagination(IdCursorPagination):
+    """Cursor pagination for leaderboard entries, highest calories first; seeks on ``total_calories``"""
+    ordering = ('-total_calories', '-_id')
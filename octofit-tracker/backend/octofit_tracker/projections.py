@@ -0,0 +1,46 @@
+"""
+Apply activity writes to every collection derived from activities: the
+leaderboard totals, the daily rollups and the windowed leaderboards, and
+refresh the cached workout recommendations of the users involved.
+
+``apply`` adds the deltas of ``(activity, sign)`` pairs as they were
+written, so callers never need to re-read them. ``recompute`` instead
+rebuilds the affected rows from the stored activities; the write-behind
+outbox (outbox.py) uses it because it is safe to retry.
+"""
+from . import leaderboard, recommendations, rollups, versions, windows
+from .models import Activity
+
+
+def apply(changes):
+    """Apply ``(activity, sign)`` pairs with one team lookup for all projections"""
+    changes = list(changes)
+    if not changes:
+        return
+    teams = leaderboard.team_ids_for({activity.user_id for activity, _ in changes})
+    leaderboard.apply_deltas(leaderboard.collect_deltas(changes), teams)
+    rollups.apply_deltas(rollups.collect_deltas(changes), teams)
+    windows.apply_deltas(changes, teams)
+    # Bump again now that the rollups are written, so no response built from
+    # the pre-write rollups can keep the ETag of the activity write.
+    versions.bump(Activity)
+    recommendations.refresh({activity.user_id for activity, _ in changes})
+
+
+def recompute(user_days):
+    """
+    Recompute everything derived from the activities of each ``(user_id,
+    day)`` pair from the activities themselves. Idempotent, so the outbox
+    can retry it after any failure.
+    """
+    user_days = set(user_days)
+    if not user_days:
+        return
+    user_ids = {user_id for user_id, _ in user_days}
+    teams = leaderboard.team_ids_for(user_ids)
+    # The windows are summed from the rollups, so those go first
+    rollups.recompute(user_days, teams)
+    leaderboard.recompute(user_ids, teams)
+    windows.recompute(user_ids, teams)
+    versions.bump(Activity)
+    recommendations.refresh(user_ids)
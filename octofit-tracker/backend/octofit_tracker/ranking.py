@@ -0,0 +1,261 @@
+"""
+In-memory rank index over the leaderboard.
+
+Each board (the global one and one per team) keeps its entries as a
+``SortedList`` of ``(-total_calories, user_id)`` keys. A user's rank is one
+bisect and applying an update is one removal and one insertion, all
+O(log n), so rank lookups and "around me" windows never touch MongoDB.
+
+The index is built from the leaderboard collection on first use. Whenever the
+leaderboard version stamp moves, it re-reads only the entries whose
+``last_updated`` changed since the last sync. Deletions are applied through
+the ``post_delete`` signal, and a periodic full rebuild (every
+``OCTOFIT_RANKING_REBUILD_SECONDS``) catches anything the stamps missed,
+such as deletes made by other processes.
+
+Refreshes and rebuilds read MongoDB outside the index lock and only take
+it to apply what they read, so lookups never wait on I/O. Only the very
+first build makes a request wait; later ones run on a background thread
+while lookups keep using the current boards, which are swapped out when the
+new ones are ready.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from sortedcontainers import SortedList
+
+from . import versions
+from .models import Leaderboard
+
+logger = logging.getLogger(__name__)
+
+# Tolerated clock difference between the app servers that stamp last_updated
+CLOCK_SKEW = timedelta(seconds=5)
+PROJECTION = {'_id': 0, 'user_id': 1, 'team_id': 1, 'total_calories': 1}
+
+
+class Board:
+    """Sorted ranking of one leaderboard"""
+
+    def __init__(self, keys=()):
+        self.keys = SortedList(keys)
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def remove(self, key):
+        self.keys.discard(key)
+
+    def rank_of(self, total_calories):
+        """Competition rank: one more than the number of entries with more calories"""
+        return self.keys.bisect_left((-total_calories,)) + 1
+
+    def window(self, key, around):
+        """The entry for ``key`` with up to ``around`` entries above and below"""
+        index = self.keys.bisect_left(key)
+        return self.keys.islice(max(index - around, 0), index + around + 1)
+
+
+class RankIndex:
+    """Global and per-team boards, kept in sync with the leaderboard collection"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.entries = None  # user_id -> (team_id, total_calories)
+        self.boards = {}
+        self.version = None
+        self.synced_at = None
+        self.built_at = 0
+        self._rebuild_lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._rebuilding = False
+        # Users deleted while a refresh or rebuild is reading, see discard()
+        self._loading = 0
+        self._discarded = None
+
+    def _board(self, team_id):
+        board = self.boards.get(team_id)
+        if board is None:
+            board = self.boards[team_id] = Board()
+        return board
+
+    def _put(self, user_id, team_id, total_calories):
+        self._remove(user_id)
+        self.entries[user_id] = (team_id, total_calories)
+        key = (-total_calories, user_id)
+        self._board(None).add(key)
+        if team_id:
+            self._board(team_id).add(key)
+
+    def _remove(self, user_id):
+        previous = self.entries.pop(user_id, None)
+        if previous is not None:
+            team_id, total_calories = previous
+            key = (-total_calories, user_id)
+            self.boards[None].remove(key)
+            if team_id:
+                self.boards[team_id].remove(key)
+
+    def _load(self, documents):
+        for document in documents:
+            self._put(document['user_id'], document.get('team_id'), document.get('total_calories') or 0)
+
+    def _start_reading(self):
+        """Track deletes from here on; call with the lock held"""
+        self._loading += 1
+        if self._discarded is None:
+            self._discarded = set()
+
+    def _stop_reading(self):
+        """Users deleted since ``_start_reading``; call with the lock held"""
+        discarded = self._discarded
+        self._loading -= 1
+        if not self._loading:
+            self._discarded = None
+        return discarded
+
+    @staticmethod
+    def _build(documents):
+        """Entries and boards of ``documents``, sorting each board once"""
+        entries = {
+            document['user_id']: (document.get('team_id'), document.get('total_calories') or 0)
+            for document in documents
+        }
+        keys = defaultdict(list)
+        for user_id, (team_id, total_calories) in entries.items():
+            key = (-total_calories, user_id)
+            keys[None].append(key)
+            if team_id:
+                keys[team_id].append(key)
+        boards = {team_id: Board(board_keys) for team_id, board_keys in keys.items()}
+        boards.setdefault(None, Board())
+        return entries, boards
+
+    def rebuild(self):
+        """Reload every leaderboard entry, then swap the new boards in"""
+        with self._rebuild_lock:
+            with self._lock:
+                self._start_reading()
+            try:
+                synced_at = timezone.now()
+                entries, boards = self._build(Leaderboard.objects.mongo_find({}, PROJECTION))
+            except BaseException:
+                with self._lock:
+                    self._stop_reading()
+                raise
+            with self._lock:
+                discarded = self._stop_reading()
+                self.entries, self.boards = entries, boards
+                for user_id in discarded:
+                    self._remove(user_id)
+                self.synced_at = synced_at
+                self.built_at = time.monotonic()
+                # Writes that landed during the load are re-read on next use
+                self.version = None
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('Rank index rebuild failed')
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+
+        threading.Thread(target=run, name='rank-index-rebuild', daemon=True).start()
+
+    def refresh(self, version):
+        """Re-read the entries updated since the last sync, then mark the index as of ``version``"""
+        # One refresh at a time; lookups keep reading the boards meanwhile
+        with self._refresh_lock:
+            with self._lock:
+                if version == self.version:
+                    return
+                since, built_at = self.synced_at, self.built_at
+                self._start_reading()
+            try:
+                synced_at = timezone.now()
+                documents = list(Leaderboard.objects.mongo_find(
+                    {'last_updated': {'$gte': since - CLOCK_SKEW}}, PROJECTION
+                ))
+            except BaseException:
+                with self._lock:
+                    self._stop_reading()
+                raise
+            with self._lock:
+                discarded = self._stop_reading()
+                if self.built_at != built_at:
+                    # A rebuild swapped newer boards in and left the version
+                    # unset, so the next lookup refreshes from its sync point
+                    return
+                self._load(documents)
+                for user_id in discarded:
+                    self._remove(user_id)
+                self.synced_at = synced_at
+                self.version = version
+
+    def ensure_fresh(self):
+        version = versions.stamps(Leaderboard)[0]
+        if self.entries is None:
+            # Nothing to serve yet: the first build has to be waited for
+            with self._rebuild_lock:
+                if self.entries is None:
+                    self.rebuild()
+        elif time.monotonic() - self.built_at > settings.OCTOFIT_RANKING_REBUILD_SECONDS:
+            self._rebuild_in_background()
+        if version != self.version:
+            self.refresh(version)
+
+    def discard(self, user_id):
+        """Drop a deleted leaderboard entry"""
+        with self._lock:
+            if self._discarded is not None:
+                self._discarded.add(user_id)
+            if self.entries is not None:
+                self._remove(user_id)
+
+    def lookup(self, user_id, around=0, by_team=False):
+        """
+        Rank of ``user_id`` on the global board, or on its team's board, with
+        up to ``around`` neighbours on each side. Returns None for users that
+        have no leaderboard entry.
+        """
+        self.ensure_fresh()
+        with self._lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            team_id, total_calories = entry
+            board = self.boards[team_id if by_team and team_id else None]
+            key = (-total_calories, user_id)
+            return {
+                'user_id': user_id,
+                'team_id': team_id,
+                'scope': 'team' if by_team and team_id else 'global',
+                'rank': board.rank_of(total_calories),
+                'total_calories': total_calories,
+                'total_entries': len(board.keys),
+                'window': [
+                    {
+                        'rank': board.rank_of(-negative_calories),
+                        'user_id': neighbour_id,
+                        'team_id': self.entries[neighbour_id][0],
+                        'total_calories': -negative_calories,
+                    }
+                    for negative_calories, neighbour_id in board.window(key, around)
+                ],
+            }
+
+
+rank_index = RankIndex()
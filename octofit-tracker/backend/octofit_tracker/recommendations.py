@@ -0,0 +1,230 @@
+"""
+Workout recommendations ranked from each user's activity history.
+
+A user's profile comes from their daily rollups over the last
+``OCTOFIT_RECOMMENDATION_HISTORY_DAYS``:
+
+* how their minutes split across activity types,
+* their typical session length (minutes per activity),
+* their calorie rate (calories per minute).
+
+Every workout of the catalog gets a score between 0 and 1, a weighted sum
+of three parts:
+
+* ``type``: the user's preference for the workout's activity type,
+  relative to their favourite type.
+* ``duration``: how close the workout's duration is to the typical
+  session, as ``min(a, b) / max(a, b)``.
+* ``calories``: how close ``target_calories`` is to what the user burns
+  in that duration at their usual rate, measured the same way.
+
+Scoring is one NumPy expression over a (users x workouts) matrix, so a
+batch of users costs one aggregation and no Python loop over the catalog.
+Users without history get a neutral profile: a median session and rate,
+with no type preference.
+
+The top ``OCTOFIT_RECOMMENDATIONS_TOP_K`` workouts of every user are kept
+in the Django cache together with the workout data. ``refresh`` recomputes
+them after activity writes (see projections.py). Each entry records the
+digest of the catalog it was scored against, and is recomputed on its next
+read only when the workouts themselves changed.
+
+Each process keeps the catalog for the current Workout version stamp. The
+stamp may expire from the cache and come back with a new value while the
+workouts are unchanged, so a new stamp first costs one aggregation: the
+workout count, newest ``_id`` and newest ``last_updated``. The catalog is
+only reloaded when that fingerprint moved. Serving a user's recommendations
+is otherwise a single cache lookup.
+
+The lists live in the ``recommendations`` cache alias, apart from the
+response cache and version stamps, so they cannot evict those. Lists of
+users with history expire after ``OCTOFIT_RECOMMENDATION_TTL`` unless an
+activity write refreshes them first. Users without history, including ids
+that match no user at all, are cached for ``OCTOFIT_CACHE_TTL`` only, so
+arbitrary ids cannot grow the cache.
+"""
+import hashlib
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
+
+from . import versions
+from .models import ActivityRollup, Workout
+from .rollups import day_of
+
+WEIGHTS = {'type': 0.5, 'duration': 0.25, 'calories': 0.25}
+WORKOUT_FIELDS = ('name', 'description', 'activity_type', 'duration', 'difficulty', 'target_calories')
+
+cache = ConnectionProxy(caches, 'recommendations')
+
+
+def _key(user_id):
+    return f'octofit:recommendations:{user_id}'
+
+
+class Catalog:
+    """Every workout as parallel NumPy arrays, built for one Workout version stamp"""
+
+    def __init__(self, stamp, fingerprint, documents):
+        self.stamp = stamp
+        self.fingerprint = fingerprint
+        self.items = sorted(
+            ({'_id': str(doc['_id']), **{field: doc.get(field) for field in WORKOUT_FIELDS}} for doc in documents),
+            key=lambda item: item['_id'],
+        )
+        # Identifies the catalog contents across stamps and processes
+        self.digest = hashlib.sha1(repr(self.items).encode()).hexdigest()
+        self.types = sorted({item['activity_type'] for item in self.items})
+        type_index = {activity_type: index for index, activity_type in enumerate(self.types)}
+        self.type_ids = np.array([type_index[item['activity_type']] for item in self.items], dtype=np.intp)
+        # Zero or missing values would divide by zero below
+        self.durations = np.array([max(item['duration'] or 0, 1) for item in self.items], dtype=float)
+        self.targets = np.array([max(item['target_calories'] or 0, 1) for item in self.items], dtype=float)
+        if self.items:
+            self.default_duration = float(np.median(self.durations))
+            self.default_rate = float(np.median(self.targets / self.durations))
+        else:
+            self.default_duration = self.default_rate = 1.0
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def fingerprint():
+    """Workout count, newest ``_id`` and newest ``last_updated``, from one aggregation"""
+    rows = list(Workout.objects.mongo_aggregate([
+        {'$group': {
+            '_id': None,
+            'count': {'$sum': 1},
+            'last_id': {'$max': '$_id'},
+            'last_updated': {'$max': '$last_updated'},
+        }},
+    ]))
+    if not rows:
+        return (0, None, None)
+    return (rows[0]['count'], rows[0]['last_id'], rows[0]['last_updated'])
+
+
+def get_catalog(stamp):
+    """This process's catalog, reloaded when the Workout version and fingerprint moved"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is not None and _catalog.stamp == stamp:
+            return _catalog
+        # Taken before the find, so a write in between only causes a reload next time
+        current = fingerprint()
+        if _catalog is not None and _catalog.fingerprint == current:
+            _catalog.stamp = stamp
+        else:
+            _catalog = Catalog(stamp, current, Workout.objects.mongo_find({}, dict.fromkeys(WORKOUT_FIELDS, 1)))
+        return _catalog
+
+
+def profiles(user_ids, catalog):
+    """
+    Profile matrices of ``user_ids`` from their recent rollups: the share
+    of minutes of each catalog type (users x types), and the typical
+    duration and calorie rate of every user (NaN without history).
+    """
+    since = day_of(timezone.now() - timedelta(days=settings.OCTOFIT_RECOMMENDATION_HISTORY_DAYS))
+    pipeline = [
+        {'$match': {'user_id': {'$in': list(user_ids)}, 'day': {'$gte': since}}},
+        {
+            '$group': {
+                '_id': {'user_id': '$user_id', 'activity_type': '$activity_type'},
+                'total_calories': {'$sum': '$total_calories'},
+                'total_duration': {'$sum': '$total_duration'},
+                'total_activities': {'$sum': '$total_activities'},
+            }
+        },
+    ]
+    rows = {user_id: index for index, user_id in enumerate(user_ids)}
+    columns = {activity_type: index for index, activity_type in enumerate(catalog.types)}
+    minutes = np.zeros((len(user_ids), len(catalog.types)))
+    # Calories, minutes and activity count of every user, across all types
+    totals = np.zeros((len(user_ids), 3))
+    for row in ActivityRollup.objects.mongo_aggregate(pipeline):
+        user = rows[row['_id']['user_id']]
+        totals[user] += (row['total_calories'], row['total_duration'], row['total_activities'])
+        column = columns.get(row['_id']['activity_type'])
+        if column is not None:
+            minutes[user, column] += row['total_duration']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = minutes / totals[:, 1:2]
+        typical = totals[:, 1] / totals[:, 2]
+        rate = totals[:, 0] / totals[:, 1]
+    shares[~np.isfinite(shares)] = 0
+    typical[~(typical > 0)] = np.nan
+    rate[~(rate > 0)] = np.nan
+    return shares, typical, rate
+
+
+def closeness(a, b):
+    """``min(a, b) / max(a, b)`` elementwise: 1 when equal, towards 0 apart"""
+    return np.minimum(a, b) / np.maximum(a, b)
+
+
+def score(catalog, shares, typical, rate):
+    """Score every workout for every user; returns a (users x workouts) matrix"""
+    typical = np.where(np.isnan(typical), catalog.default_duration, typical)[:, None]
+    rate = np.where(np.isnan(rate), catalog.default_rate, rate)[:, None]
+
+    favourite = shares.max(axis=1, keepdims=True) if shares.size else np.zeros((len(shares), 1))
+    preference = np.divide(shares, favourite, out=np.zeros_like(shares), where=favourite > 0)
+    type_score = preference[:, catalog.type_ids]
+    duration_score = closeness(catalog.durations[None, :], typical)
+    calorie_score = closeness(catalog.targets[None, :], rate * catalog.durations[None, :])
+    return (
+        WEIGHTS['type'] * type_score
+        + WEIGHTS['duration'] * duration_score
+        + WEIGHTS['calories'] * calorie_score
+    )
+
+
+def top_k(scores, k):
+    """Column indices of the ``k`` best scores of every row, best first"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+def refresh(user_ids):
+    """Recompute and cache the recommendations of ``user_ids``; returns them by user"""
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return {}
+    catalog = get_catalog(versions.stamps(Workout)[0])
+    shares, typical, rate = profiles(user_ids, catalog)
+    known = ~np.isnan(typical)
+    scores = score(catalog, shares, typical, rate)
+    entries, lasting, expiring = {}, {}, {}
+    best_k = top_k(scores, settings.OCTOFIT_RECOMMENDATIONS_TOP_K)
+    for user_id, row, best, has_history in zip(user_ids, scores, best_k, known):
+        entries[user_id] = {
+            'catalog': catalog.digest,
+            'items': [{**catalog.items[index], 'score': round(float(row[index]), 4)} for index in best],
+        }
+        (lasting if has_history else expiring)[_key(user_id)] = entries[user_id]
+    if lasting:
+        cache.set_many(lasting, timeout=settings.OCTOFIT_RECOMMENDATION_TTL)
+    if expiring:
+        cache.set_many(expiring, timeout=settings.OCTOFIT_CACHE_TTL)
+    return entries
+
+
+def for_user(user_id):
+    """The cached recommendations of ``user_id``, best first, refreshed if missing or stale"""
+    entry = cache.get(_key(user_id))
+    if entry is None or entry['catalog'] != get_catalog(versions.stamps(Workout)[0]).digest:
+        entry = refresh([user_id])[user_id]
+    return entry['items']
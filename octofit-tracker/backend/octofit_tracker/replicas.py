@@ -0,0 +1,93 @@
+"""
+Read-replica routing for the API's safe requests.
+
+``ReadReplicaRouter`` sends ORM reads, and ``Model.objects.mongo_*`` calls,
+to the ``replica`` alias while ``replica_reads()`` is active, and everything
+else to ``default``. Both aliases share one MongoClient; the replica alias
+only adds a read preference (see ``backends/replica``), so on a standalone
+mongod or a single-node replica set it reads the same data as the primary.
+
+Reads stay on the primary when they could observe replication lag:
+
+* for a write request, and for the rest of a request once it has written;
+* for clients carrying the pin cookie set by their own recent write;
+* for collections written within ``OCTOFIT_REPLICA_PIN_SECONDS``, e.g. an
+  activity fetched right after it was created. This also keeps stale
+  secondary data out of responses cached or tagged with the new version.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from . import versions
+
+REPLICA_DB_ALIAS = 'replica'
+PIN_COOKIE = 'octofit_primary'
+
+_replica_reads = contextvars.ContextVar('octofit_replica_reads', default=False)
+
+
+def enabled():
+    return settings.OCTOFIT_READ_REPLICA and REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def use_replica(request, models=()):
+    """Whether ``request`` may read the collections of ``models`` from secondaries"""
+    if not enabled() or request.method not in SAFE_METHODS or request.COOKIES.get(PIN_COOKIE):
+        return False
+    if models:
+        pin_ns = settings.OCTOFIT_REPLICA_PIN_SECONDS * 1_000_000_000
+        return time.time_ns() - max(versions.stamps(*models)) > pin_ns
+    return True
+
+
+def begin():
+    """Route reads to the replica until ``end()`` is called with the returned token"""
+    return _replica_reads.set(True)
+
+
+def end(token):
+    _replica_reads.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    token = begin()
+    try:
+        yield
+    finally:
+        end(token)
+
+
+def reading_from_replica():
+    return _replica_reads.get()
+
+
+def pin(response):
+    """Keep the client on the primary while its write replicates"""
+    response.set_cookie(
+        PIN_COOKIE, '1', max_age=settings.OCTOFIT_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+    )
+
+
+class ReadReplicaRouter:
+    """Database router for the ``default`` and ``replica`` aliases"""
+
+    def db_for_read(self, model, **hints):
+        return REPLICA_DB_ALIAS if _replica_reads.get() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the request
+        _replica_reads.set(False)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        return obj1._state.db in aliases and obj2._state.db in aliases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB_ALIAS
@@ -0,0 +1,168 @@
+"""
+Daily activity rollups and the day/week/month statistics built from them.
+
+Every activity write adds its totals to one ``ActivityRollup`` document per
+(user, UTC day, activity type). A statistics query therefore reads a few
+bucket documents per day instead of scanning raw activities.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta, timezone
+
+from pymongo import DeleteMany, UpdateOne
+
+from . import leaderboard
+from .models import Activity, ActivityRollup
+
+PERIODS = ('day', 'week', 'month')
+TOTAL_FIELDS = ('total_calories', 'total_duration', 'total_distance', 'total_activities')
+
+
+def day_of(moment):
+    """Return midnight UTC of the day ``moment`` (a datetime or a date) falls on"""
+    if not isinstance(moment, datetime):
+        return datetime.combine(moment, time.min, tzinfo=timezone.utc)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return datetime.combine(moment.date(), time.min, tzinfo=timezone.utc)
+
+
+def period_start(day, period):
+    """Return the first day of the day, ISO week or month containing ``day``"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def collect_deltas(changes):
+    """Fold ``(activity, sign)`` pairs into one delta per rollup bucket"""
+    deltas = defaultdict(Counter)
+    for activity, sign in changes:
+        key = (activity.user_id, day_of(activity.date), activity.activity_type)
+        deltas[key].update({
+            'total_calories': sign * activity.calories,
+            'total_duration': sign * activity.duration,
+            'total_distance': sign * (activity.distance or 0),
+            'total_activities': sign,
+        })
+    return deltas
+
+
+def bucket_pipeline(query):
+    """
+    Aggregation pipeline summing the activities matched by ``query`` into
+    one row per (user, UTC day, activity type), with the day as YYYY-MM-DD.
+    """
+    return [
+        {'$match': query},
+        {
+            '$group': {
+                '_id': {
+                    'user_id': '$user_id',
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+                    'activity_type': '$activity_type',
+                },
+                'total_calories': {'$sum': '$calories'},
+                'total_duration': {'$sum': '$duration'},
+                'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+                'total_activities': {'$sum': 1},
+            }
+        },
+    ]
+
+
+def parse_day(value):
+    """Midnight UTC of a YYYY-MM-DD day from ``bucket_pipeline``"""
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+
+def apply_deltas(deltas, teams=None):
+    """Apply bucket deltas with atomic ``$inc`` upserts"""
+    deltas = leaderboard.nonzero_deltas(deltas)
+    if not deltas:
+        return
+    if teams is None:
+        teams = leaderboard.team_ids_for({user_id for user_id, _, _ in deltas})
+    operations = [
+        UpdateOne(
+            {'user_id': user_id, 'day': day, 'activity_type': activity_type},
+            {'$inc': delta, '$setOnInsert': {'team_id': teams.get(user_id)}},
+            upsert=True,
+        )
+        for (user_id, day, activity_type), delta in deltas.items()
+    ]
+    ActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+
+
+def recompute(user_days, teams=None):
+    """
+    Set the buckets of every ``(user_id, day)`` in ``user_days`` to the sums
+    of that user's activities on that day, and drop buckets left empty.
+    Idempotent, unlike ``apply_deltas``.
+    """
+    user_days = set(user_days)
+    if not user_days:
+        return
+    if teams is None:
+        teams = leaderboard.team_ids_for({user_id for user_id, _ in user_days})
+    query = {'$or': [
+        {'user_id': user_id, 'date': {'$gte': day, '$lt': day + timedelta(days=1)}}
+        for user_id, day in user_days
+    ]}
+    found = defaultdict(list)
+    operations = []
+    for row in Activity.objects.mongo_aggregate(bucket_pipeline(query)):
+        user_id, activity_type = row['_id']['user_id'], row['_id']['activity_type']
+        day = parse_day(row['_id']['day'])
+        found[user_id, day].append(activity_type)
+        operations.append(UpdateOne(
+            {'user_id': user_id, 'day': day, 'activity_type': activity_type},
+            {
+                '$set': {field: row[field] for field in TOTAL_FIELDS},
+                '$setOnInsert': {'team_id': teams.get(user_id)},
+            },
+            upsert=True,
+        ))
+    operations += [
+        DeleteMany({'user_id': user_id, 'day': day, 'activity_type': {'$nin': found[user_id, day]}})
+        for user_id, day in user_days
+    ]
+    ActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+
+
+def period_stats(match, period, start, end):
+    """
+    Totals per ``period`` between the ``start`` and ``end`` days (inclusive)
+    for the rollups selected by ``match``, broken down by activity type.
+    """
+    query = dict(match, day={'$gte': day_of(start), '$lt': day_of(end) + timedelta(days=1)})
+    pipeline = [
+        {'$match': query},
+        {
+            '$group': {
+                '_id': {'day': '$day', 'activity_type': '$activity_type'},
+                **{field: {'$sum': f'${field}'} for field in TOTAL_FIELDS},
+            }
+        },
+    ]
+    buckets = defaultdict(lambda: defaultdict(Counter))
+    for row in ActivityRollup.objects.mongo_aggregate(pipeline):
+        start_day = period_start(day_of(row['_id']['day']), period)
+        buckets[start_day][row['_id']['activity_type']].update(
+            {field: row[field] for field in TOTAL_FIELDS}
+        )
+
+    def totals(counter):
+        values = {field: counter[field] for field in TOTAL_FIELDS}
+        values['total_distance'] = round(values['total_distance'], 2)
+        return values
+
+    return [
+        {
+            'period': start_day.date().isoformat(),
+            **totals(sum(by_type.values(), Counter())),
+            'by_type': {activity_type: totals(counter) for activity_type, counter in sorted(by_type.items())},
+        }
+        for start_day, by_type in sorted(buckets.items())
+    ]
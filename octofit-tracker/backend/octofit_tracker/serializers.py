@@ -1,39 +1,240 @@
+from bson import ObjectId
+from django.db import models
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from . import instrumentation, loaders, versions
+from .models import User, Team, Activity, Leaderboard, LeaderboardWindow, Workout
 
 
-class UserSerializer(serializers.ModelSerializer):
+def requested_fields(params, available):
+    """
+    Field names listed in ``?fields=`` (comma separated), or None when the
+    parameter is absent. Names missing from ``available`` are rejected.
+    """
+    value = params.get('fields')
+    if not value:
+        return None
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in available]
+    if unknown:
+        raise serializers.ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}'})
+    return requested
+
+
+class SparseFieldsMixin:
+    """
+    Drops every field not listed in the request's ``?fields=`` from the
+    output of read requests, so method fields that were not asked for are
+    never computed. Writes always validate and return every field.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        readable = [name for name, field in self.fields.items() if not field.write_only]
+        requested = requested_fields(request.query_params, readable)
+        if requested is not None:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+
+class TimedDataMixin:
+    """Adds the time spent building ``.data`` to the request's serializer timing"""
+    
+    @property
+    def data(self):
+        with instrumentation.timer('serialize'):
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class LoaderListSerializer(TimedListSerializer):
+    """
+    Lets the child queue what every item will load (``queue_loads``) before
+    any item is represented, so each loader serves the whole list with one
+    query.
+    """
+    
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        for item in items:
+            self.child.queue_loads(item)
+        return super().to_representation(items)
+
+
+class UserSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['_id', 'name', 'email', 'password', 'team_id', 'created_at']
+        list_serializer_class = TimedListSerializer
         extra_kwargs = {'password': {'write_only': True}}
 
 
-class TeamSerializer(serializers.ModelSerializer):
+def count_members(team_ids):
+    """Count the members of every team in ``team_ids`` with one aggregation"""
+    team_ids = list(team_ids)
+    pipeline = [
+        {'$match': {'team_id': {'$in': team_ids}}},
+        {'$group': {'_id': '$team_id', 'count': {'$sum': 1}}},
+    ]
+    counts = {team_id: 0 for team_id in team_ids}
+    for row in User.objects.mongo_aggregate(pipeline):
+        counts[row['_id']] = row['count']
+    return counts
+
+
+def members_counts():
+    """Loader of the number of members by team id"""
+    return loaders.get_loader((User, 'members_count'), count_members, default=0)
+
+
+class TeamSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     members_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'created_at', 'members_count']
+        list_serializer_class = LoaderListSerializer
+    
+    def queue_loads(self, team):
+        if 'members_count' in self.fields:
+            members_counts().queue([str(team._id)])
     
     def get_members_count(self, obj):
         """Calculate the number of members in this team"""
-        return User.objects.filter(team_id=str(obj._id)).count()
+        return members_counts().load(str(obj._id))
+
 
+def requested_expansions(params, expansions, fields):
+    """
+    Relations listed in ``?expand=`` (comma separated), or an empty list.
+    Each must be one of ``expansions`` and keep the id field it joins on.
+    """
+    value = params.get('expand')
+    if not value:
+        return []
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in expansions]
+    if unknown:
+        raise serializers.ValidationError({'expand': f'Unknown relations: {", ".join(unknown)}'})
+    missing = [expansions[name][1] for name in requested if expansions[name][1] not in fields]
+    if missing:
+        raise serializers.ValidationError({'expand': f'Needs these fields: {", ".join(missing)}'})
+    return requested
 
-class ActivitySerializer(serializers.ModelSerializer):
+
+def expand_rows(rows, names, expansions):
+    """
+    Embed ``{"_id", "name"}`` of the related object of every relation in
+    ``names`` into ``rows``, in place, with at most one query per relation.
+    """
+    for name in names:
+        model, id_field = expansions[name]
+        loader = loaders.documents(model)
+        loader.queue(row[id_field] for row in rows)
+        for row in rows:
+            document = loader.load(row[id_field])
+            row[name] = None if document is None else {'_id': str(document['_id']), 'name': document['name']}
+    return rows
+
+
+class ExpandMixin:
+    """
+    ``?expand=`` embeds the id and name of related users and teams. Lists
+    queue the ids of all their rows first, so each relation costs one
+    ``$in`` query per request.
+    """
+    expansions = {}
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expand = []
+        request = self.context.get('request')
+        if request is not None and request.method in SAFE_METHODS:
+            self.expand = requested_expansions(request.query_params, self.expansions, self.fields)
+    
+    def queue_loads(self, instance):
+        for name in self.expand:
+            model, id_field = self.expansions[name]
+            loaders.documents(model).queue([getattr(instance, id_field)])
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        return expand_rows([data], self.expand, self.expansions)[0]
+
+
+class ActivityListSerializer(LoaderListSerializer):
+    """
+    Validates each activity on its own so one bad item does not reject the
+    whole batch. Failures are collected in ``item_errors`` by list index and
+    only the valid items end up in ``validated_data``.
+    """
+    
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail_batch('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail_batch('empty')
+        if self.max_length is not None and len(data) > self.max_length:
+            self.fail_batch('max_length', max_length=self.max_length)
+        
+        self.item_errors = {}
+        validated = []
+        for index, item in enumerate(data):
+            try:
+                validated.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                self.item_errors[index] = exc.detail
+        return validated
+    
+    def fail_batch(self, key, **kwargs):
+        """Reject the batch as a whole, in the same shape as ListSerializer"""
+        message = self.error_messages[key].format(**kwargs)
+        raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code=key)
+    
+    def create(self, validated_data):
+        """Insert every valid activity with one batched insert"""
+        activities = [Activity(_id=ObjectId(), **attrs) for attrs in validated_data]
+        Activity.objects.bulk_create(activities, batch_size=len(activities) or None)
+        versions.bump(Activity)
+        return activities
+
+
+class ActivitySerializer(ExpandMixin, SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
+    expansions = {'user': (User, 'user_id')}
+    
     class Meta:
         model = Activity
         fields = ['_id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'notes']
+        list_serializer_class = ActivityListSerializer
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(ExpandMixin, SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
+    expansions = {'user': (User, 'user_id'), 'team': (Team, 'team_id')}
+    
     class Meta:
         model = Leaderboard
         fields = ['_id', 'user_id', 'team_id', 'total_calories', 'total_duration', 'total_activities', 'last_updated']
+        list_serializer_class = LoaderListSerializer
+
+
+class LeaderboardWindowSerializer(ExpandMixin, SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
+    expansions = LeaderboardSerializer.expansions
+    
+    class Meta:
+        model = LeaderboardWindow
+        fields = ['_id', 'window', 'user_id', 'team_id', 'total_calories', 'total_duration', 'total_activities', 'last_updated']
+        list_serializer_class = LoaderListSerializer
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'description', 'activity_type', 'duration', 'difficulty', 'target_calories']
+        list_serializer_class = TimedListSerializer
@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.InstrumentationMiddleware',
+    'octofit_tracker.loaders.LoaderMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -88,18 +90,114 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# MongoClient and connection pool options, one pool per worker process
+# (see octofit_tracker/mongo.py). Unset options keep the pymongo defaults:
+# maxPoolSize 100, no idle timeout, wait forever for a free connection,
+# primary reads and no wire compression. Compressors are a comma separated
+# list of zlib, snappy and zstd; the last two need their Python packages.
+def optional_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+MONGO_CLIENT_OPTIONS = {
+    key: value
+    for key, value in {
+        'maxPoolSize': optional_int('OCTOFIT_MONGO_MAX_POOL_SIZE'),
+        'minPoolSize': optional_int('OCTOFIT_MONGO_MIN_POOL_SIZE'),
+        'maxIdleTimeMS': optional_int('OCTOFIT_MONGO_MAX_IDLE_TIME_MS'),
+        'waitQueueTimeoutMS': optional_int('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        'serverSelectionTimeoutMS': optional_int('OCTOFIT_MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+        'readPreference': os.getenv('OCTOFIT_MONGO_READ_PREFERENCE'),
+        'compressors': os.getenv('OCTOFIT_MONGO_COMPRESSORS'),
+    }.items()
+    if value is not None
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
+        # djongo closes its MongoClient, and with it the pool, whenever
+        # Django closes the connection. Keep connections open so the pool
+        # outlives individual requests.
+        'CONN_MAX_AGE': None,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.getenv('OCTOFIT_MONGO_HOST', 'localhost'),
+            'port': int(os.getenv('OCTOFIT_MONGO_PORT', '27017')),
+            **MONGO_CLIENT_OPTIONS,
         }
     }
 }
 
+# Safe API reads can be served by replica set secondaries. The 'replica'
+# alias shares the default alias' MongoClient and only adds a read
+# preference (octofit_tracker/backends/replica), so it needs no hosts of its
+# own; point OCTOFIT_MONGO_HOST at the replica set, e.g.
+# mongodb://a,b,c/?replicaSet=rs0. See octofit_tracker/replicas.py.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'ENGINE': 'octofit_tracker.backends.replica',
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['octofit_tracker.replicas.ReadReplicaRouter']
+
+OCTOFIT_READ_REPLICA = os.getenv('OCTOFIT_READ_REPLICA', 'false').lower() in ('1', 'true', 'yes')
+OCTOFIT_REPLICA_READ_PREFERENCE = os.getenv('OCTOFIT_REPLICA_READ_PREFERENCE', 'secondaryPreferred')
+# Secondaries lagging further behind are not read from (MongoDB's minimum is 90)
+OCTOFIT_REPLICA_MAX_STALENESS_SECONDS = optional_int('OCTOFIT_REPLICA_MAX_STALENESS_SECONDS')
+# Seconds after a write during which its collections, and the writing
+# client, are read from the primary
+OCTOFIT_REPLICA_PIN_SECONDS = int(os.getenv('OCTOFIT_REPLICA_PIN_SECONDS', '10'))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# An in-process LRU by default; set OCTOFIT_CACHE_URL (e.g. redis://localhost:6379/0)
+# to share cached responses between worker processes (requires the redis package).
+
+OCTOFIT_CACHE_URL = os.getenv('OCTOFIT_CACHE_URL')
+if OCTOFIT_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': OCTOFIT_CACHE_URL,
+        },
+        'recommendations': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': OCTOFIT_CACHE_URL,
+            'KEY_PREFIX': 'recommendations',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'octofit',
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('OCTOFIT_CACHE_MAX_ENTRIES', '5000')),
+            },
+        },
+        # Per-user workout recommendations get their own cache, so they
+        # never evict response generations or version stamps.
+        'recommendations': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'octofit-recommendations',
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('OCTOFIT_RECOMMENDATION_CACHE_MAX_ENTRIES', '10000')),
+            },
+        },
+    }
+
+# Seconds a cached leaderboard or workout response may be served
+OCTOFIT_CACHE_TTL = int(os.getenv('OCTOFIT_CACHE_TTL', '30'))
+
+# Seconds a collection version stamp (used for ETags) lives. Stamps in the
+# per-process cache cannot see writes made by other workers, so they expire
+# to bound how long those workers may keep answering 304 Not Modified.
+OCTOFIT_VERSION_TTL = None if OCTOFIT_CACHE_URL else OCTOFIT_CACHE_TTL
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -142,6 +240,81 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+# https://www.django-rest-framework.org/api-guide/pagination/
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.fastjson.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'octofit_tracker.fastjson.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Endpoints served by the direct pymongo read path in octofit_tracker/native.py
+# (leaderboard, top_users, by_team, user_activities, activities), as a comma
+# separated list.
+OCTOFIT_NATIVE_ENDPOINTS = [
+    endpoint.strip()
+    for endpoint in os.getenv('OCTOFIT_NATIVE_ENDPOINTS', '').split(',')
+    if endpoint.strip()
+]
+
+# Per-request instrumentation (octofit_tracker/instrumentation.py). Every
+# response carries a Server-Timing header unless it is switched off. Requests
+# making more MongoDB round trips than the threshold are logged as warnings;
+# set OCTOFIT_REQUEST_LOG_LEVEL=INFO to log every request.
+OCTOFIT_SERVER_TIMING = os.getenv('OCTOFIT_SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+OCTOFIT_QUERY_WARNING_THRESHOLD = int(os.getenv('OCTOFIT_QUERY_WARNING_THRESHOLD', '20'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'octofit_tracker.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('OCTOFIT_REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Write-behind for activity writes (octofit_tracker/outbox.py). Writes queue
+# an event per user and day and worker threads update the leaderboard and
+# rollups; switch it off to update them inside the request. Drain the outbox
+# (manage.py process_outbox --drain) before changing the partition count.
+# Idle workers back off from the poll interval to the idle one.
+OCTOFIT_WRITE_BEHIND = os.getenv('OCTOFIT_WRITE_BEHIND', 'true').lower() in ('1', 'true', 'yes')
+OCTOFIT_OUTBOX_WORKERS = int(os.getenv('OCTOFIT_OUTBOX_WORKERS', '2'))
+OCTOFIT_OUTBOX_PARTITIONS = int(os.getenv('OCTOFIT_OUTBOX_PARTITIONS', '16'))
+OCTOFIT_OUTBOX_BATCH_SIZE = int(os.getenv('OCTOFIT_OUTBOX_BATCH_SIZE', '500'))
+OCTOFIT_OUTBOX_POLL_SECONDS = float(os.getenv('OCTOFIT_OUTBOX_POLL_SECONDS', '0.5'))
+OCTOFIT_OUTBOX_IDLE_POLL_SECONDS = float(os.getenv('OCTOFIT_OUTBOX_IDLE_POLL_SECONDS', '10'))
+OCTOFIT_OUTBOX_MAX_ATTEMPTS = int(os.getenv('OCTOFIT_OUTBOX_MAX_ATTEMPTS', '10'))
+OCTOFIT_OUTBOX_LEASE_SECONDS = int(os.getenv('OCTOFIT_OUTBOX_LEASE_SECONDS', '30'))
+
+# The test suite runs without outbox workers, see octofit_tracker/testing.py
+TEST_RUNNER = 'octofit_tracker.testing.TestRunner'
+
+# Workout recommendations (octofit_tracker/recommendations.py): how many
+# workouts are cached per user, and how far back their history counts.
+OCTOFIT_RECOMMENDATIONS_TOP_K = int(os.getenv('OCTOFIT_RECOMMENDATIONS_TOP_K', '10'))
+OCTOFIT_RECOMMENDATION_HISTORY_DAYS = int(os.getenv('OCTOFIT_RECOMMENDATION_HISTORY_DAYS', '90'))
+# Seconds the list of a user with history stays cached without new activities
+OCTOFIT_RECOMMENDATION_TTL = int(os.getenv('OCTOFIT_RECOMMENDATION_TTL', '86400'))
+
+# Seconds between full rebuilds of the in-memory leaderboard rank index
+OCTOFIT_RANKING_REBUILD_SECONDS = int(os.getenv('OCTOFIT_RANKING_REBUILD_SECONDS', '300'))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
@@ -0,0 +1,50 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import loaders, versions
+from .cache import leaderboard_scopes, response_cache
+from .models import User, Team, Activity, Leaderboard, Workout
+from .ranking import rank_index
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Team)
+@receiver([post_save, post_delete], sender=Activity)
+@receiver([post_save, post_delete], sender=Leaderboard)
+@receiver([post_save, post_delete], sender=Workout)
+def bump_version(sender, **kwargs):
+    """Change the ETag of every response built from this collection"""
+    versions.bump(sender)
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Team)
+def forget_loaded(sender, **kwargs):
+    """Reload documents of this collection that the request's loaders already fetched"""
+    loaders.forget(sender)
+
+
+@receiver([post_save, post_delete], sender=Leaderboard)
+def invalidate_leaderboard(sender, instance, **kwargs):
+    """Evict the cached leaderboards that include this entry"""
+    response_cache.invalidate(*leaderboard_scopes([instance.team_id]))
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Team)
+def invalidate_expanded_leaderboards(sender, instance, **kwargs):
+    """Evict cached leaderboards, which may embed this user's or team's name"""
+    team_id = instance.team_id if sender is User else str(instance._id)
+    response_cache.invalidate(*leaderboard_scopes([team_id]))
+
+
+@receiver([post_save, post_delete], sender=Workout)
+def invalidate_workouts(sender, instance, **kwargs):
+    """Evict the cached workout listings"""
+    response_cache.invalidate('workouts')
+
+
+@receiver(post_delete, sender=Leaderboard)
+def discard_rank(sender, instance, **kwargs):
+    """Remove a deleted entry from this process's rank index"""
+    rank_index.discard(instance.user_id)
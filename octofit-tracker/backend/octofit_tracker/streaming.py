@@ -0,0 +1,50 @@
+"""
+Streaming encoders for exports. Rows are encoded one at a time as they come
+off a MongoDB cursor, so memory use does not grow with the export size.
+"""
+import csv
+
+from . import fastjson, native
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def stream_documents(model, serializer_class, query, sort, batch_size, only=None):
+    """Yield serializer-shaped rows from a bounded-batch cursor"""
+    represent = native.representer(serializer_class, only)
+    projection = {name: 1 for name in native.readable_fields(serializer_class, only)}
+    cursor = model.objects.mongo_find(query, projection).sort(sort).batch_size(batch_size)
+    try:
+        for doc in cursor:
+            yield represent(doc)
+    finally:
+        cursor.close()
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield fastjson.dumps(row) + b'\n'
+
+
+def csv_lines(rows, fieldnames):
+    writer = csv.DictWriter(Echo(), fieldnames=fieldnames)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def encode(rows, output, fieldnames):
+    """Encode ``rows`` as lines of ``output`` ('ndjson' or 'csv')"""
+    if output == 'csv':
+        return csv_lines(rows, fieldnames)
+    return ndjson_lines(rows)
@@ -1,9 +1,29 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, router
+from django.test import TestCase, override_settings
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from django.utils import timezone
+from . import fastjson, instrumentation, loaders, mongo, outbox, projections, recommendations, replicas, versions, windows
+from .cache import by_team_scope, response_cache
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, LeaderboardWindow, OutboxEvent, Workout
+from .management.commands import benchmark_api
+from .ranking import rank_index
+from .serializers import ActivitySerializer
+from .views import ActivityViewSet
+from datetime import datetime, timedelta, timezone as dt_timezone
+import asyncio
+import json
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+from bson import ObjectId
 
 
 class UserModelTest(TestCase):
@@ -141,6 +161,21 @@ class TeamAPITest(APITestCase):
         url = reverse('team-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_teams_list_includes_members_count(self):
+        """Test that members_count is resolved for every team in the list"""
+        other_team = Team.objects.create(name="Empty Team")
+        for i in range(3):
+            User.objects.create(
+                name=f"Member {i}",
+                email=f"member{i}@example.com",
+                password="testpass123",
+                team_id=str(self.team._id)
+            )
+        response = self.client.get(reverse('team-list'))
+        counts = {team['_id']: team['members_count'] for team in response.data['results']}
+        self.assertEqual(counts[str(self.team._id)], 3)
+        self.assertEqual(counts[str(other_team._id)], 0)
 
 
 class ActivityAPITest(APITestCase):
@@ -161,6 +196,39 @@ class ActivityAPITest(APITestCase):
         url = reverse('activity-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_activities_list_is_cursor_paginated(self):
+        """Test that activities are paged newest first with a next cursor"""
+        for day in range(1, 4):
+            Activity.objects.create(
+                user_id="user123",
+                activity_type="Cycling",
+                duration=20,
+                calories=200,
+                date=datetime(2024, 1, day)
+            )
+        url = reverse('activity-list')
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        
+        following = self.client.get(response.data['next'])
+        self.assertEqual(len(following.data['results']), 2)
+        self.assertIsNone(following.data['next'])
+        seen = [item['_id'] for item in response.data['results'] + following.data['results']]
+        self.assertEqual(len(set(seen)), 4)
+    
+    def test_list_applies_filter_backends(self):
+        """Test that filter backends apply to the activity list on both query paths"""
+        class CyclingOnly(BaseFilterBackend):
+            def filter_queryset(self, request, queryset, view):
+                return queryset.filter(activity_type="Cycling")
+        
+        Activity.objects.create(user_id="user123", activity_type="Cycling", duration=20, calories=200, date=datetime.now())
+        with mock.patch.object(ActivityViewSet, 'filter_backends', [CyclingOnly]):
+            for query_path in ('orm', 'native'):
+                response = self.client.get(reverse('activity-list'), {'query_path': query_path})
+                self.assertEqual([item['activity_type'] for item in response.data['results']], ["Cycling"])
 
 
 class WorkoutAPITest(APITestCase):
@@ -182,3 +250,1165 @@ class WorkoutAPITest(APITestCase):
         url = reverse('workout-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=False)
+class LeaderboardIncrementalUpdateTest(APITestCase):
+    """Test that activity writes keep the leaderboard totals up to date"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Delta Team")
+        self.user = User.objects.create(
+            name="Delta User",
+            email="delta@example.com",
+            password="testpass123",
+            team_id=str(self.team._id)
+        )
+        self.user_id = str(self.user._id)
+    
+    def create_activity(self, calories, duration):
+        url = reverse('activity-list')
+        return self.client.post(url, {
+            'user_id': self.user_id,
+            'activity_type': 'Running',
+            'duration': duration,
+            'calories': calories,
+            'date': '2024-01-01T10:00:00Z'
+        }, format='json')
+    
+    def test_create_upserts_leaderboard_entry(self):
+        """Test that the first activity creates the user's leaderboard entry"""
+        response = self.create_activity(300, 30)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        entry = Leaderboard.objects.get(user_id=self.user_id)
+        self.assertEqual(entry.team_id, str(self.team._id))
+        self.assertEqual(entry.total_calories, 300)
+        self.assertEqual(entry.total_duration, 30)
+        self.assertEqual(entry.total_activities, 1)
+    
+    def test_update_and_delete_apply_deltas(self):
+        """Test that edits and deletes adjust the existing totals"""
+        self.create_activity(300, 30)
+        response = self.create_activity(200, 20)
+        url = reverse('activity-detail', args=[response.data['_id']])
+        
+        self.client.patch(url, {'calories': 250}, format='json')
+        entry = Leaderboard.objects.get(user_id=self.user_id)
+        self.assertEqual(entry.total_calories, 550)
+        self.assertEqual(entry.total_activities, 2)
+        
+        self.client.delete(url)
+        entry = Leaderboard.objects.get(user_id=self.user_id)
+        self.assertEqual(entry.total_calories, 300)
+        self.assertEqual(entry.total_duration, 30)
+        self.assertEqual(entry.total_activities, 1)
+
+
+class EnsureIndexesCommandTest(TestCase):
+    """Test cases for the ensure_indexes management command"""
+    
+    def test_indexes_are_created_and_verified(self):
+        """Test that the command is idempotent and --check passes afterwards"""
+        call_command('ensure_indexes', stdout=StringIO())
+        call_command('ensure_indexes', stdout=StringIO())
+        call_command('ensure_indexes', '--check', stdout=StringIO())
+        keys = Activity.objects.mongo_index_information()['activity_user_date_idx']['key']
+        self.assertEqual([field for field, _ in keys], ['user_id', 'date', '_id'])
+    
+    def test_check_reports_missing_index(self):
+        """Test that --check fails when a declared index was dropped"""
+        call_command('ensure_indexes', stdout=StringIO())
+        Workout.objects.mongo_drop_index('workout_difficulty_idx')
+        with self.assertRaises(CommandError):
+            call_command('ensure_indexes', '--check', stdout=StringIO())
+
+
+class NativeQueryPathTest(APITestCase):
+    """Test that the native pymongo path matches the ORM path"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Native User",
+            email="native@example.com",
+            password="testpass123",
+            team_id="team123"
+        )
+        for day, calories in enumerate([300, 150, 450], start=1):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type="Running",
+                duration=30,
+                calories=calories,
+                date=datetime(2024, 1, day)
+            )
+        for user_id, calories in [("user1", 900), ("user2", 500)]:
+            Leaderboard.objects.create(
+                user_id=user_id,
+                team_id="team123",
+                total_calories=calories
+            )
+    
+    def assertSameResponse(self, url, params=None):
+        params = params or {}
+        orm = self.client.get(url, {**params, 'query_path': 'orm'})
+        mongo = self.client.get(url, {**params, 'query_path': 'native'})
+        self.assertEqual(orm.status_code, status.HTTP_200_OK)
+        self.assertEqual(orm.json().get('results', orm.json()), mongo.json().get('results', mongo.json()))
+    
+    def test_user_activities_match(self):
+        """Test that both paths return the same user activities"""
+        self.assertSameResponse(reverse('user-activities', args=[str(self.user._id)]))
+    
+    def test_by_team_matches(self):
+        """Test that both paths return the same team leaderboard"""
+        self.assertSameResponse(reverse('leaderboard-by-team'), {'team_id': 'team123'})
+    
+    def test_top_users_matches(self):
+        """Test that both paths return the same top users"""
+        response = self.client.get(reverse('leaderboard-top-users'), {'query_path': 'native'})
+        self.assertEqual([entry['user_id'] for entry in response.json()], ["user1", "user2"])
+        self.assertSameResponse(reverse('leaderboard-top-users'))
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=False)
+class ActivityBulkCreateTest(APITestCase):
+    """Test cases for the bulk activity ingestion endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('activity-bulk')
+    
+    def activity(self, user_id, calories):
+        return {
+            'user_id': user_id,
+            'activity_type': 'Cycling',
+            'duration': 40,
+            'calories': calories,
+            'date': '2024-02-01T08:00:00Z'
+        }
+    
+    def test_bulk_create_reports_item_errors(self):
+        """Test that valid items are stored even when others fail validation"""
+        payload = [
+            self.activity('bulk1', 100),
+            {'user_id': 'bulk1', 'activity_type': 'Cycling'},
+            self.activity('bulk1', 200),
+            self.activity('bulk2', 50),
+        ]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['created']), 3)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertEqual(Activity.objects.filter(user_id='bulk1').count(), 2)
+        
+        entry = Leaderboard.objects.get(user_id='bulk1')
+        self.assertEqual(entry.total_calories, 300)
+        self.assertEqual(entry.total_activities, 2)
+    
+    def test_bulk_create_rejects_non_list(self):
+        """Test that a payload that is not a list is rejected as a whole"""
+        response = self.client.post(self.url, self.activity('bulk1', 100), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseCacheTest(APITestCase):
+    """Test cases for the leaderboard and workout response cache"""
+    
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Cached User",
+            email="cached@example.com",
+            password="testpass123",
+            team_id="team1"
+        )
+        Leaderboard.objects.create(
+            user_id=str(self.user._id),
+            team_id="team1",
+            total_calories=100
+        )
+        Leaderboard.objects.create(user_id="user2", team_id="team2", total_calories=50)
+    
+    def by_team(self, team_id):
+        response = self.client.get(reverse('leaderboard-by-team'), {'team_id': team_id})
+        return [entry['total_calories'] for entry in response.data['results']]
+    
+    def test_repeated_reads_are_cache_hits(self):
+        """Test that the second identical request is served from the cache"""
+        before = response_cache.stats()['endpoints'].get('top_users', {'hits': 0})['hits']
+        self.client.get(reverse('leaderboard-top-users'))
+        self.client.get(reverse('leaderboard-top-users'))
+        after = response_cache.stats()['endpoints']['top_users']['hits']
+        self.assertEqual(after - before, 1)
+    
+    def test_activity_write_evicts_only_affected_team(self):
+        """Test that an activity for team1 evicts team1 but not team2"""
+        self.assertEqual(self.by_team("team1"), [100])
+        self.assertEqual(self.by_team("team2"), [50])
+        
+        team2_generation = response_cache.generation(by_team_scope("team2"))
+        projections.apply([(Activity(
+            user_id=str(self.user._id),
+            activity_type="Yoga",
+            duration=5,
+            calories=25,
+            date=datetime(2024, 1, 1)
+        ), 1)])
+        self.assertEqual(self.by_team("team1"), [125])
+        self.assertEqual(response_cache.generation(by_team_scope("team2")), team2_generation)
+    
+    def test_activity_write_evicts_team_stored_on_entry(self):
+        """Test that the team on a user's leaderboard entry is evicted after the user changes team"""
+        self.assertEqual(self.by_team("team1"), [100])
+        User.objects.filter(pk=self.user.pk).update(team_id="team3")
+        projections.apply([(Activity(
+            user_id=str(self.user._id),
+            activity_type="Yoga",
+            duration=5,
+            calories=25,
+            date=datetime(2024, 1, 1)
+        ), 1)])
+        self.assertEqual(self.by_team("team1"), [125])
+    
+    def test_workout_write_evicts_workout_list(self):
+        """Test that creating a workout is visible on the next list request"""
+        url = reverse('workout-list')
+        self.assertEqual(len(self.client.get(url).data['results']), 0)
+        Workout.objects.create(
+            name="Cached Workout",
+            description="Appears after eviction",
+            activity_type="Yoga",
+            duration=20,
+            difficulty="easy",
+            target_calories=100
+        )
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+
+
+class ConditionalGetTest(APITestCase):
+    """Test cases for ETag / Last-Modified support"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.workout = Workout.objects.create(
+            name="ETag Workout",
+            description="Conditional GET target",
+            activity_type="Running",
+            duration=30,
+            difficulty="easy",
+            target_calories=250
+        )
+        self.url = reverse('workout-list')
+    
+    def test_matching_etag_returns_not_modified(self):
+        """Test that If-None-Match with the current ETag returns 304"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+        
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(cached.content, b'')
+    
+    def test_write_changes_etag(self):
+        """Test that a write to the collection invalidates the old ETag"""
+        etag = self.client.get(self.url)['ETag']
+        self.workout.target_calories = 300
+        self.workout.save()
+        
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_detail_etag_differs_from_list(self):
+        """Test that list and detail responses carry different ETags"""
+        detail = reverse('workout-detail', args=[str(self.workout._id)])
+        self.assertNotEqual(self.client.get(self.url)['ETag'], self.client.get(detail)['ETag'])
+
+
+class PopulateDbCommandTest(TestCase):
+    """Test cases for the populate_db management command"""
+    
+    def test_synthetic_dataset(self):
+        """Test that a synthetic dataset has the requested size and totals"""
+        call_command(
+            'populate_db', '--users', '20', '--teams', '3',
+            '--activities-per-user', '4', '--seed', '42', '--chunk-size', '7',
+            stdout=StringIO()
+        )
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Activity.objects.count(), 80)
+        self.assertEqual(Leaderboard.objects.count(), 20)
+        
+        entry = Leaderboard.objects.all()[0]
+        activities = Activity.objects.filter(user_id=entry.user_id)
+        self.assertEqual(entry.total_activities, 4)
+        self.assertEqual(entry.total_calories, sum(activity.calories for activity in activities))
+        self.assertEqual(entry.team_id, User.objects.get(_id=entry.user_id).team_id)
+
+
+class RebuildLeaderboardCommandTest(TestCase):
+    """Test cases for the rebuild_leaderboard management command"""
+    
+    def setUp(self):
+        call_command(
+            'populate_db', '--users', '6', '--teams', '2',
+            '--activities-per-user', '3', '--seed', '7',
+            stdout=StringIO()
+        )
+        self.entry = Leaderboard.objects.all()[0]
+        self.expected = self.entry.total_calories
+        Leaderboard.objects.filter(pk=self.entry.pk).update(total_calories=self.expected + 50)
+        Leaderboard.objects.exclude(pk=self.entry.pk)[0].delete()
+    
+    def rebuild(self, *args):
+        out = StringIO()
+        call_command('rebuild_leaderboard', '--workers', '1', '--chunk-size', '4', *args, stdout=out)
+        return out.getvalue()
+    
+    def test_dry_run_reports_drift_without_writing(self):
+        """Test that a dry run reports the drifted and missing entries only"""
+        output = self.rebuild('--dry-run')
+        self.assertIn('Missing entries: 1', output)
+        self.assertIn('Drifted entries: 1', output)
+        self.assertIn('total_calories: -50 overall', output)
+        self.assertEqual(Leaderboard.objects.count(), 5)
+        self.assertEqual(Leaderboard.objects.get(pk=self.entry.pk).total_calories, self.expected + 50)
+    
+    def test_rebuild_writes_only_drifted_entries(self):
+        """Test that the rebuild restores the totals and leaves correct entries alone"""
+        untouched = Leaderboard.objects.exclude(pk=self.entry.pk)[0]
+        output = self.rebuild()
+        self.assertIn('2 entries written', output)
+        self.assertEqual(Leaderboard.objects.count(), 6)
+        self.assertEqual(Leaderboard.objects.get(pk=self.entry.pk).total_calories, self.expected)
+        self.assertEqual(Leaderboard.objects.get(pk=untouched.pk).last_updated, untouched.last_updated)
+        self.assertIn('Dry run: 0 entries', self.rebuild('--dry-run'))
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=False)
+class ActivityStatsTest(APITestCase):
+    """Test cases for the rollup-backed activity statistics endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Stats User",
+            email="stats@example.com",
+            password="testpass123",
+            team_id="team1"
+        )
+        self.user_id = str(self.user._id)
+        for day, activity_type, calories in [
+            ('2024-03-04', 'Running', 300),
+            ('2024-03-05', 'Running', 200),
+            ('2024-03-05', 'Yoga', 100),
+            ('2024-03-12', 'Running', 400),
+        ]:
+            self.client.post(reverse('activity-list'), {
+                'user_id': self.user_id,
+                'activity_type': activity_type,
+                'duration': 30,
+                'distance': 5.0,
+                'calories': calories,
+                'date': f'{day}T07:30:00Z'
+            }, format='json')
+    
+    def stats(self, **params):
+        params.setdefault('start', '2024-03-01')
+        params.setdefault('end', '2024-03-31')
+        return self.client.get(reverse('activity-stats'), params)
+    
+    def test_weekly_stats_per_user(self):
+        """Test that daily rollups are folded into ISO weeks"""
+        response = self.stats(user_id=self.user_id, period='week')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        weeks = {row['period']: row for row in response.data['results']}
+        self.assertEqual(weeks['2024-03-04']['total_calories'], 600)
+        self.assertEqual(weeks['2024-03-04']['by_type']['Yoga']['total_activities'], 1)
+        self.assertEqual(weeks['2024-03-11']['total_distance'], 5.0)
+    
+    def test_monthly_stats_per_team(self):
+        """Test that team statistics include every member's activities"""
+        response = self.stats(team_id='team1', period='month')
+        self.assertEqual(response.data['results'][0]['total_calories'], 1000)
+    
+    def test_backfill_matches_incremental_rollups(self):
+        """Test that rebuilding the rollups gives the same statistics"""
+        before = self.stats(user_id=self.user_id).data['results']
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(self.stats(user_id=self.user_id).data['results'], before)
+    
+    def test_backfill_replaces_buckets_in_place(self):
+        """Test that the backfill drops stale buckets and keeps ones written while it runs"""
+        bucket = {
+            'user_id': self.user_id,
+            'team_id': 'team1',
+            'activity_type': 'Swimming',
+            'total_calories': 999,
+            'total_duration': 60,
+            'total_distance': 1.0,
+            'total_activities': 1,
+        }
+        stale = ObjectId.from_datetime(timezone.now() - timedelta(days=1))
+        ActivityRollup.objects.mongo_insert_many([
+            {**bucket, '_id': stale, 'day': datetime(2024, 3, 20, tzinfo=dt_timezone.utc)},
+            {**bucket, '_id': ObjectId.from_datetime(timezone.now() + timedelta(minutes=1)),
+             'day': datetime(2024, 3, 21, tzinfo=dt_timezone.utc)},
+        ])
+        out = StringIO()
+        call_command('backfill_rollups', stdout=out)
+        self.assertIn('1 stale ones deleted', out.getvalue())
+        self.assertFalse(ActivityRollup.objects.filter(pk=stale).exists())
+        self.assertEqual(ActivityRollup.objects.filter(activity_type='Swimming').count(), 1)
+        self.assertEqual(ActivityRollup.objects.filter(activity_type='Running').count(), 3)
+    
+    def test_requires_user_or_team(self):
+        """Test that the scope must be exactly one user or team"""
+        self.assertEqual(self.stats().status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.stats(user_id=self.user_id, period='year')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_daily_stats_between_dates(self):
+        """Test that start and end bound the days returned, both inclusive"""
+        response = self.stats(user_id=self.user_id, start='2024-03-05', end='2024-03-12')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['start'], '2024-03-05')
+        self.assertEqual(
+            [(row['period'], row['total_calories']) for row in response.data['results']],
+            [('2024-03-05', 300), ('2024-03-12', 400)],
+        )
+    
+    def test_default_range_ends_today(self):
+        """Test that without start and end the range fits the period and ends today"""
+        self.client.post(reverse('activity-list'), {
+            'user_id': self.user_id,
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': 250,
+            'date': timezone.now().isoformat()
+        }, format='json')
+        response = self.client.get(reverse('activity-stats'), {'user_id': self.user_id, 'period': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['end'], timezone.now().date().isoformat())
+        self.assertEqual([row['total_calories'] for row in response.data['results']], [250])
+    
+    def test_rejects_impossible_dates(self):
+        """Test that a well formed but impossible date is a 400, not a 500"""
+        response = self.stats(user_id=self.user_id, start='2024-02-31')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('start', response.data)
+
+
+class ActivityExportTest(APITestCase):
+    """Test cases for the streaming activity export"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for day in range(1, 4):
+            Activity.objects.create(
+                user_id="exporter",
+                activity_type="Swimming",
+                duration=45,
+                distance=1.5,
+                calories=350,
+                date=datetime(2024, 4, day)
+            )
+        Activity.objects.create(
+            user_id="someone-else",
+            activity_type="Yoga",
+            duration=30,
+            calories=120,
+            date=datetime(2024, 4, 1)
+        )
+        self.url = reverse('activity-export')
+    
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+    
+    def test_ndjson_export_streams_user_rows(self):
+        """Test that the NDJSON export has one JSON object per activity"""
+        response = self.client.get(self.url, {'user_id': 'exporter'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row['date'][:10] for row in rows], ['2024-04-01', '2024-04-02', '2024-04-03'])
+    
+    def test_csv_export_has_header(self):
+        """Test that the CSV export starts with the serializer field names"""
+        response = self.client.get(self.url, {'output': 'csv'})
+        lines = self.read(response).splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(lines[0], '_id,user_id,activity_type,duration,distance,calories,date,notes')
+        self.assertEqual(len(lines), 5)
+
+
+class AsyncEndpointTest(TestCase):
+    """Test cases for the async (ASGI-native) read endpoints"""
+    
+    def setUp(self):
+        self.team = Team.objects.create(name="Async Team")
+        self.user = User.objects.create(
+            name="Async User",
+            email="async@example.com",
+            password="testpass123",
+            team_id=str(self.team._id)
+        )
+        for day in range(1, 6):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type="Running",
+                duration=30,
+                calories=100 * day,
+                date=datetime(2024, 5, day)
+            )
+    
+    def test_user_activities_match_sync_endpoint(self):
+        """Test that the async pages line up with the DRF endpoint"""
+        url = reverse('async-user-activities', args=[str(self.user._id)])
+        first = self.client.get(url, {'page_size': 3}).json()
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(second['next'])
+        
+        expected = self.client.get(reverse('user-activities', args=[str(self.user._id)])).json()
+        self.assertEqual(first['results'] + second['results'], expected['results'])
+    
+    def test_team_members_and_missing_team(self):
+        """Test team members and the 404 for an unknown team"""
+        response = self.client.get(reverse('async-team-members', args=[str(self.team._id)]))
+        self.assertEqual([member['name'] for member in response.json()['results']], ["Async User"])
+        self.assertNotIn('password', response.json()['results'][0])
+        
+        missing = self.client.get(reverse('async-team-members', args=['0' * 24]))
+        self.assertEqual(missing.status_code, 404)
+
+
+class LeaderboardRankTest(APITestCase):
+    """Test cases for rank lookups and "around me" windows"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for user_id, team_id, calories in [
+            ("rank1", "teamA", 900),
+            ("rank2", "teamB", 700),
+            ("rank3", "teamA", 700),
+            ("rank4", "teamA", 300),
+            ("rank5", "teamB", 100),
+        ]:
+            Leaderboard.objects.create(user_id=user_id, team_id=team_id, total_calories=calories)
+        rank_index.rebuild()
+    
+    def rank(self, user_id, **params):
+        return self.client.get(reverse('leaderboard-rank', args=[user_id]), params)
+    
+    def test_global_rank_and_window(self):
+        """Test that ties share a rank and the window is centered on the user"""
+        response = self.rank("rank3", around=1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 2)
+        self.assertEqual([entry['user_id'] for entry in response.data['window']], ["rank2", "rank3", "rank4"])
+        self.assertEqual([entry['rank'] for entry in response.data['window']], [2, 2, 4])
+    
+    def test_team_rank(self):
+        """Test that scope=team ranks the user within their team only"""
+        response = self.rank("rank4", scope='team', around=0)
+        self.assertEqual(response.data['rank'], 3)
+        self.assertEqual(response.data['total_entries'], 3)
+    
+    def test_rank_follows_leaderboard_updates(self):
+        """Test that new totals are picked up after a leaderboard write"""
+        entry = Leaderboard.objects.get(user_id="rank5")
+        entry.total_calories = 1000
+        entry.save()
+        self.assertEqual(self.rank("rank5").data['rank'], 1)
+        
+        entry.delete()
+        self.assertEqual(self.rank("rank5").status_code, status.HTTP_404_NOT_FOUND)
+    
+    @override_settings(OCTOFIT_RANKING_REBUILD_SECONDS=0)
+    def test_stale_index_rebuilds_in_background(self):
+        """Test that a due rebuild does not hold up the lookup that triggers it"""
+        boards = rank_index.boards
+        with mock.patch('octofit_tracker.ranking.threading.Thread') as thread:
+            self.assertEqual(self.rank("rank1").data['rank'], 1)
+        self.assertIs(rank_index.boards, boards)
+        thread.return_value.start.assert_called_once_with()
+        rank_index._rebuilding = False
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=False)
+class WindowedLeaderboardTest(APITestCase):
+    """Test cases for the 7 and 30 day leaderboards"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Window User",
+            email="window@example.com",
+            password="testpass123",
+            team_id="team1"
+        )
+        self.user_id = str(self.user._id)
+        self.now = timezone.now()
+        windows.advance(self.now)
+        for days_ago, calories in [(0, 100), (10, 200), (40, 400)]:
+            self.client.post(reverse('activity-list'), {
+                'user_id': self.user_id,
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories': calories,
+                'date': (self.now - timedelta(days=days_ago)).isoformat()
+            }, format='json')
+    
+    def top_calories(self, window):
+        response = self.client.get(reverse('leaderboard-top-users'), {'window': window})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [entry['total_calories'] for entry in response.data]
+    
+    def test_windows_count_recent_activities_only(self):
+        """Test that activity writes only reach the windows they fall inside"""
+        self.assertEqual(self.top_calories('7d'), [100])
+        self.assertEqual(self.top_calories('30d'), [300])
+        self.assertEqual(self.top_calories('all'), [700])
+    
+    def test_advance_expires_old_days(self):
+        """Test that days sliding out of a window are subtracted"""
+        windows.advance(self.now + timedelta(days=8))
+        self.assertFalse(LeaderboardWindow.objects.filter(window='7d').exists())
+        self.assertEqual(LeaderboardWindow.objects.get(window='30d').total_calories, 300)
+        
+        windows.advance(self.now + timedelta(days=25))
+        self.assertEqual(LeaderboardWindow.objects.get(window='30d').total_calories, 100)
+    
+    def test_rebuild_matches_incremental_totals(self):
+        """Test that rebuilding from the rollups gives the same totals"""
+        windows.rebuild_all(self.now)
+        self.assertEqual(self.top_calories('7d'), [100])
+        self.assertEqual(self.top_calories('30d'), [300])
+    
+    def test_invalid_window(self):
+        """Test that unknown windows are rejected"""
+        response = self.client.get(reverse('leaderboard-top-users'), {'window': '1y'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_list_honours_window(self):
+        """Test that the list route pages the windowed board when asked"""
+        response = self.client.get(reverse('leaderboard-list'), {'window': '30d'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['total_calories'] for entry in response.data['results']], [300])
+        self.assertEqual(response.data['results'][0]['window'], '30d')
+    
+    def test_window_rejected_where_unsupported(self):
+        """Test that endpoints without windowed boards refuse ?window="""
+        response = self.client.get(reverse('leaderboard-rank', args=[self.user_id]), {'window': '7d'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsTest(APITestCase):
+    """Test cases for ?fields= sparse fieldsets"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Sparse Team")
+        Activity.objects.create(
+            user_id="user123",
+            activity_type="Running",
+            duration=30,
+            calories=300,
+            date=datetime(2024, 1, 1),
+            notes="A long note that nobody asked for"
+        )
+    
+    def test_activities_only_return_requested_fields(self):
+        """Test that both query paths return only the requested fields"""
+        for query_path in ('orm', 'native'):
+            response = self.client.get(reverse('activity-list'), {'fields': 'calories,date', 'query_path': query_path})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(set(response.data['results'][0]), {'calories', 'date'})
+    
+    def test_members_count_is_skipped_unless_requested(self):
+        """Test that teams without members_count in ?fields= leave it out"""
+        response = self.client.get(reverse('team-list'), {'fields': '_id,name'})
+        self.assertEqual(response.data['results'], [{'_id': str(self.team._id), 'name': "Sparse Team"}])
+    
+    def test_unknown_field_is_rejected(self):
+        """Test that asking for a field the serializer does not have is an error"""
+        response = self.client.get(reverse('activity-list'), {'fields': 'calories,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastJSONTest(TestCase):
+    """Test cases for the fast JSON renderer and parser"""
+    
+    def test_renderer_encodes_object_ids_and_datetimes(self):
+        """Test that ObjectId and datetime values are encoded without a serializer"""
+        object_id = ObjectId()
+        rendered = fastjson.JSONRenderer().render({'_id': object_id, 'date': datetime(2024, 1, 1, 7, 30)})
+        self.assertEqual(json.loads(rendered), {'_id': str(object_id), 'date': '2024-01-01T07:30:00'})
+    
+    def test_parser_round_trip(self):
+        """Test that the parser reads what the renderer writes"""
+        data = {'name': 'Zoë', 'calories': [1, 2.5, None]}
+        body = fastjson.JSONRenderer().render(data)
+        self.assertEqual(fastjson.JSONParser().parse(BytesIO(body)), data)
+    
+    def test_fallback_matches_fast_path(self):
+        """Test that the stdlib fallback produces the same document"""
+        data = {'_id': ObjectId(), 'values': [1, 'two', {'three': 3.0}]}
+        with mock.patch.object(fastjson, 'orjson', None):
+            fallback = fastjson.dumps(data)
+        self.assertEqual(json.loads(fallback), json.loads(fastjson.dumps(data)))
+    
+    def test_datetimes_match_drf_renderer(self):
+        """Test that datetimes of a stored model render exactly as DRF renders them"""
+        activity = Activity.objects.create(
+            user_id="user1",
+            activity_type="running",
+            duration=30,
+            distance=5.0,
+            calories=300,
+            date=datetime(2024, 1, 1, 7, 30, 15, 120000, tzinfo=dt_timezone.utc),
+        )
+        activity.refresh_from_db()
+        data = {
+            'serialized': ActivitySerializer(activity).data,
+            'document': {field.attname: getattr(activity, field.attname) for field in Activity._meta.concrete_fields},
+            'datetimes': [
+                datetime(2024, 1, 1, 7, 30, tzinfo=dt_timezone.utc),
+                datetime(2024, 1, 1, 7, 30, 0, 5, tzinfo=dt_timezone.utc),
+                datetime(2024, 1, 1, 7, 30),
+                datetime(2024, 1, 1, 9, 30, tzinfo=dt_timezone(timedelta(hours=2))),
+            ],
+        }
+        data['document']['_id'] = str(data['document']['_id'])
+        self.assertEqual(fastjson.JSONRenderer().render(data), DRFJSONRenderer().render(data))
+
+
+class BenchmarkHelpersTest(TestCase):
+    """Test cases for the API benchmark helpers"""
+    
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark_api.percentile(values, 0.50), 50)
+        self.assertEqual(benchmark_api.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark_api.percentile([7], 0.99), 7)
+    
+    def test_command_counter_ignores_driver_chatter(self):
+        """Test that handshakes and pings are not counted as queries"""
+        counter = benchmark_api.CommandCounter()
+        for command_name in ('hello', 'find', 'ping', 'aggregate', 'getMore'):
+            counter.started(mock.Mock(command_name=command_name))
+        self.assertEqual(counter.count, 3)
+    
+    def test_compare_skips_failed_endpoints(self):
+        """Test that an endpoint that failed in either run is not compared"""
+        command = benchmark_api.Command(stdout=StringIO())
+        measured = {'p50_ms': 1.0, 'queries': 1}
+        baseline = {'meta': {'size': '1k'}, 'results': {'users': measured, 'activity_stats': {'error': 'boom'}}}
+        report = {'meta': {'size': '1k'}, 'results': {'users': measured, 'activity_stats': dict(measured, p50_ms=9.0)}}
+        command.compare(baseline, report, 0.2)
+        self.assertIn('failed: boom', command.format_row('activity_stats', {'error': 'boom'}))
+
+
+class InstrumentationTest(APITestCase):
+    """Test cases for per-request instrumentation"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        instrumentation.registry.reset()
+        Leaderboard.objects.create(user_id="user123", team_id="team123", total_calories=500)
+    
+    def test_server_timing_header(self):
+        """Test that responses report DB, translation, serializer and render time"""
+        response = self.client.get(reverse('leaderboard-top-users'))
+        timing = response['Server-Timing']
+        for name in ('db', 'translate', 'serialize', 'render', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+    
+    def test_metrics_endpoint_aggregates_per_route(self):
+        """Test that requests are folded into per-route histograms"""
+        for _ in range(2):
+            self.client.get(reverse('leaderboard-top-users'), {'query_path': 'orm'})
+        route = self.client.get(reverse('metrics')).data['GET leaderboard-top-users']
+        self.assertEqual(route['count'], 2)
+        self.assertGreater(route['queries']['sum'], 0)
+        self.assertEqual(route['duration_ms']['buckets']['+Inf'], 2)
+    
+    def test_many_queries_are_logged_as_warnings(self):
+        """Test that requests over the query threshold are flagged"""
+        with self.settings(OCTOFIT_QUERY_WARNING_THRESHOLD=0):
+            with self.assertLogs('octofit_tracker.requests', 'WARNING') as logs:
+                self.client.get(reverse('leaderboard-top-users'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'GET leaderboard-top-users')
+        self.assertGreater(record['queries'], 0)
+
+
+class MongoPoolTest(APITestCase):
+    """Test cases for the shared MongoDB client and its pool statistics"""
+    
+    def test_orm_and_raw_paths_share_one_client(self):
+        """Test that djongo and mongo.get_client() use the same pool"""
+        connection.ensure_connection()
+        self.assertIs(mongo.get_client(), connection.client_connection)
+    
+    def test_pool_stats_endpoint(self):
+        """Test that pool counters are reported per server"""
+        User.objects.create(name="Pool User", email="pool@example.com", password="password123")
+        response = self.client.get(reverse('mongo-pool-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(response.data['clients'], 1)
+        self.assertNotIn('password', response.data['options'])
+        self.assertTrue(any(server['created'] > 0 for server in response.data['servers'].values()))
+    
+    def test_async_clients_of_closed_loops_are_closed(self):
+        """Test that a short-lived event loop does not leave its Motor client open"""
+        async def database():
+            return mongo.get_async_database()
+        
+        with mock.patch.object(mongo, 'AsyncIOMotorClient') as motor:
+            first, second = mock.MagicMock(), mock.MagicMock()
+            motor.side_effect = [first, second]
+            asyncio.run(database())
+            asyncio.run(database())
+            first.close.assert_called_once_with()
+            second.close.assert_not_called()
+            mongo.close_async_clients()
+            second.close.assert_called_once_with()
+
+
+@override_settings(OCTOFIT_READ_REPLICA=True)
+class ReadReplicaRoutingTest(APITestCase):
+    """Test cases for routing safe reads to the replica alias (a mirror of default in tests)"""
+    databases = {'default', 'replica'}
+    
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        Workout.objects.create(
+            name="Replica Workout",
+            description="Read from a secondary",
+            activity_type="Yoga",
+            duration=20,
+            difficulty="easy",
+            target_calories=100
+        )
+    
+    def request_on_replica(self, method, url, data=None):
+        """Make a request and return it with the statements run on the replica"""
+        statements = []
+        
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+        
+        with connections['replica'].execute_wrapper(record):
+            response = getattr(self.client, method)(url, data, format='json')
+        return response, statements
+    
+    def test_safe_reads_use_replica(self):
+        """Test that GETs of settled collections are served by the replica"""
+        with self.settings(OCTOFIT_REPLICA_PIN_SECONDS=0):
+            response, statements = self.request_on_replica('get', reverse('workout-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['name'], "Replica Workout")
+        self.assertTrue(statements)
+    
+    def test_recently_written_collections_read_from_primary(self):
+        """Test that a collection written within the pin window is read from the primary"""
+        response, statements = self.request_on_replica('get', reverse('workout-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(statements, [])
+    
+    def test_writes_pin_client_to_primary(self):
+        """Test that a client reads its own writes from the primary"""
+        response, statements = self.request_on_replica('post', reverse('user-list'), {
+            'name': 'Pinned User', 'email': 'pinned@example.com', 'password': 'testpass123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertEqual(statements, [])
+        with self.settings(OCTOFIT_REPLICA_PIN_SECONDS=0):
+            response, statements = self.request_on_replica('get', reverse('user-detail', args=[response.data['_id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(statements, [])
+    
+    def test_router_sends_writes_to_default(self):
+        """Test that writes go to the primary even inside a replica read"""
+        with replicas.replica_reads():
+            self.assertEqual(User.objects.all().db, replicas.REPLICA_DB_ALIAS)
+            self.assertEqual(router.db_for_write(User), 'default')
+            self.assertEqual(User.objects.all().db, 'default')
+
+
+class LeaderboardExpandTest(APITestCase):
+    """Test cases for embedding user and team names with ?expand="""
+    
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.team = Team.objects.create(name="Expand Team")
+        self.user = User.objects.create(
+            name="Expand User",
+            email="expand@example.com",
+            password="testpass123",
+            team_id=str(self.team._id)
+        )
+        Leaderboard.objects.create(user_id=str(self.user._id), team_id=str(self.team._id), total_calories=900)
+    
+    def queries(self, response):
+        return int(response['Server-Timing'].split('desc="')[1].split(' ')[0])
+    
+    def test_expand_embeds_names(self):
+        """Test that entries carry the names of their user and team"""
+        for query_path in ('orm', 'native'):
+            response = self.client.get(reverse('leaderboard-top-users'), {'expand': 'user,team', 'query_path': query_path})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            entry = response.data[0]
+            self.assertEqual(entry['user'], {'_id': str(self.user._id), 'name': "Expand User"})
+            self.assertEqual(entry['team'], {'_id': str(self.team._id), 'name': "Expand Team"})
+    
+    def test_expand_queries_do_not_grow_with_rows(self):
+        """Test that each relation is resolved with one query for the whole page"""
+        url = reverse('leaderboard-list')
+        before = self.queries(self.client.get(url, {'expand': 'user,team'}))
+        for index in range(3):
+            user = User.objects.create(name=f"Extra {index}", email=f"extra{index}@example.com", password="testpass123")
+            Leaderboard.objects.create(user_id=str(user._id), team_id=str(self.team._id), total_calories=index)
+        cache.clear()
+        response = self.client.get(url, {'expand': 'user,team'})
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(self.queries(response), before)
+    
+    def test_renamed_user_is_not_served_from_cache(self):
+        """Test that cached expanded leaderboards follow user renames"""
+        url = reverse('leaderboard-top-users')
+        self.client.get(url, {'expand': 'user'})
+        self.user.name = "Renamed User"
+        self.user.save()
+        response = self.client.get(url, {'expand': 'user'})
+        self.assertEqual(response.data[0]['user']['name'], "Renamed User")
+    
+    def test_unknown_relation_rejected(self):
+        """Test that unknown relations are a 400 error"""
+        response = self.client.get(reverse('leaderboard-list'), {'expand': 'workout'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LoaderTest(APITestCase):
+    """Test cases for the request-scoped batch loaders"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.batches = []
+    
+    def batch(self, keys):
+        self.batches.append(sorted(keys))
+        return {key: key.upper() for key in keys}
+    
+    def test_queued_keys_load_in_one_batch(self):
+        """Test that the first load resolves every queued key and memoizes them"""
+        loader = loaders.Loader(self.batch)
+        loader.queue(['a', 'b', None])
+        self.assertEqual(loader.load('a'), 'A')
+        self.assertEqual(loader.load_many(['b', 'c']), {'b': 'B', 'c': 'C'})
+        self.assertEqual(self.batches, [['a', 'b'], ['c']])
+    
+    def test_scope_shares_loaders(self):
+        """Test that loaders are shared by name within a scope only"""
+        with loaders.scope():
+            first = loaders.get_loader((User, 'test'), self.batch)
+            self.assertIs(loaders.get_loader((User, 'test'), self.batch), first)
+        self.assertIsNot(loaders.get_loader((User, 'test'), self.batch), first)
+    
+    def test_activities_expand_user_in_one_query(self):
+        """Test that expanding a page of activities fetches its users once"""
+        users = [
+            User.objects.create(name=f"Loader User {index}", email=f"loader{index}@example.com", password="testpass123")
+            for index in range(3)
+        ]
+        for user in users:
+            Activity.objects.create(
+                user_id=str(user._id), activity_type="Running", duration=30, calories=300, date=timezone.now()
+            )
+        with mock.patch.object(loaders.Loader, 'dispatch', autospec=True, side_effect=loaders.Loader.dispatch) as dispatch:
+            response = self.client.get(reverse('activity-list'), {'expand': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {activity['user']['name'] for activity in response.data['results']},
+            {user.name for user in users},
+        )
+        self.assertEqual(dispatch.call_count, 1)
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=True)
+class OutboxTest(APITestCase):
+    """Test cases for the write-behind activity outbox"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Outbox Team")
+        self.user = User.objects.create(
+            name="Outbox User",
+            email="outbox@example.com",
+            password="testpass123",
+            team_id=str(self.team._id)
+        )
+        self.user_id = str(self.user._id)
+    
+    def create_activity(self, calories):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': self.user_id,
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': calories,
+            'date': '2024-03-01T10:00:00Z'
+        }, format='json')
+    
+    def test_writes_collapse_into_one_event_per_user_day(self):
+        """Test that the leaderboard is updated by the worker, not the request"""
+        self.create_activity(300)
+        self.create_activity(200)
+        self.assertFalse(Leaderboard.objects.filter(user_id=self.user_id).exists())
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+        # The test runner keeps background workers from racing the tests
+        self.assertEqual(outbox.stats()['workers'], 0)
+        
+        out = StringIO()
+        call_command('process_outbox', '--drain', stdout=out)
+        self.assertIn('Outbox drained: 1 events', out.getvalue())
+        entry = Leaderboard.objects.get(user_id=self.user_id)
+        self.assertEqual(entry.team_id, str(self.team._id))
+        self.assertEqual(entry.total_calories, 500)
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(OutboxEvent.objects.count(), 0)
+    
+    def test_reprocessing_is_idempotent(self):
+        """Test that processing the same user and day twice counts activities once"""
+        response = self.create_activity(300)
+        outbox.drain()
+        outbox.enqueue([(Activity.objects.get(_id=ObjectId(response.data['_id'])), 1)])
+        outbox.drain()
+        entry = Leaderboard.objects.get(user_id=self.user_id)
+        self.assertEqual(entry.total_calories, 300)
+        self.assertEqual(entry.total_activities, 1)
+    
+    def test_failed_events_are_retried(self):
+        """Test that a failure leaves the event pending with a backoff"""
+        self.create_activity(300)
+        with mock.patch.object(projections, 'recompute', side_effect=RuntimeError('boom')):
+            self.assertEqual(outbox.drain(), 1)
+        event = OutboxEvent.objects.get(user_id=self.user_id)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('boom', event.last_error)
+        self.assertEqual(outbox.drain(), 0)
+        
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now())
+        outbox.drain()
+        self.assertEqual(Leaderboard.objects.get(user_id=self.user_id).total_calories, 300)
+        self.assertEqual(outbox.stats()['pending'], 0)
+    
+    def test_only_due_partitions_are_leased(self):
+        """Test that draining leases the partitions with due events and nothing else"""
+        with mock.patch.object(outbox, 'acquire', wraps=outbox.acquire) as acquire:
+            self.assertEqual(outbox.drain(), 0)
+            acquire.assert_not_called()
+            
+            self.create_activity(300)
+            self.assertEqual(outbox.drain(), 1)
+        self.assertEqual({call.args[0] for call in acquire.call_args_list}, {outbox.partition_of(self.user_id)})
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=False)
+class WorkoutRecommendationTest(APITestCase):
+    """Test cases for the workout recommendation endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('workout-recommended')
+        for name, activity_type, duration, target_calories in [
+            ("Easy Run", "Running", 30, 300),
+            ("Long Run", "Running", 90, 900),
+            ("Flow Yoga", "Yoga", 45, 150),
+        ]:
+            Workout.objects.create(
+                name=name, description=name, activity_type=activity_type,
+                duration=duration, difficulty="medium", target_calories=target_calories
+            )
+        self.user_id = str(ObjectId())
+    
+    def log(self, activity_type, duration, calories):
+        self.client.post(reverse('activity-list'), {
+            'user_id': self.user_id,
+            'activity_type': activity_type,
+            'duration': duration,
+            'calories': calories,
+            'date': timezone.now().isoformat()
+        }, format='json')
+    
+    def names(self, **params):
+        response = self.client.get(self.url, {'user_id': self.user_id, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [workout['name'] for workout in response.data['results']]
+    
+    def test_ranks_workouts_from_history(self):
+        """Test that the preferred type and typical duration rank first"""
+        self.log('Running', 30, 300)
+        self.log('Running', 32, 310)
+        self.assertEqual(self.names(), ["Easy Run", "Long Run", "Flow Yoga"])
+        self.assertEqual(self.names(limit=1), ["Easy Run"])
+    
+    def test_new_activities_refresh_cached_list(self):
+        """Test that reads are served from the cache until the user logs activities"""
+        self.log('Running', 30, 300)
+        self.names()
+        with mock.patch.object(recommendations, 'refresh', wraps=recommendations.refresh) as refresh:
+            self.assertEqual(self.names()[0], "Easy Run")
+        refresh.assert_not_called()
+        
+        for _ in range(5):
+            self.log('Yoga', 45, 150)
+        self.assertEqual(self.names()[0], "Flow Yoga")
+    
+    def test_expired_workout_stamp_keeps_cached_list(self):
+        """Test that only a change to the workouts, not a new stamp, recomputes the list"""
+        self.log('Running', 30, 300)
+        catalog = mock.patch.object(recommendations, 'Catalog', wraps=recommendations.Catalog)
+        with mock.patch.object(recommendations, 'refresh', wraps=recommendations.refresh) as refresh, catalog as built:
+            with mock.patch.object(versions, 'stamps', return_value=[time.time_ns()]):
+                self.names()
+            refresh.assert_not_called()
+            built.assert_not_called()
+            Workout.objects.filter(name="Easy Run").update(
+                target_calories=500, last_updated=timezone.now() + timedelta(seconds=1)
+            )
+            with mock.patch.object(versions, 'stamps', return_value=[time.time_ns()]):
+                self.names()
+            refresh.assert_called_once_with([self.user_id])
+            built.assert_called_once()
+    
+    def test_users_without_history_expire(self):
+        """Test that lists of unknown users are cached with a finite timeout"""
+        with mock.patch.object(recommendations.cache, 'set_many', wraps=recommendations.cache.set_many) as set_many:
+            self.names()
+        set_many.assert_called_once_with(mock.ANY, timeout=settings.OCTOFIT_CACHE_TTL)
+    
+    def test_lists_stay_out_of_the_default_cache(self):
+        """Test that recommendations are kept apart from responses and version stamps"""
+        self.log('Running', 30, 300)
+        self.names()
+        key = recommendations._key(self.user_id)
+        self.assertIsNotNone(recommendations.cache.get(key))
+        self.assertIsNone(cache.get(key))
+    
+    def test_requires_user_id(self):
+        """Test that user_id is required"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
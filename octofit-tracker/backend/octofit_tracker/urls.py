@@ -20,12 +20,17 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 import os
+from . import async_views
 from .views import (
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
-    WorkoutViewSet
+    WorkoutViewSet,
+    cache_stats,
+    metrics,
+    mongo_pool_stats,
+    outbox_status
 )
 
 
@@ -64,5 +69,15 @@ router.register(r'workouts', WorkoutViewSet, basename='workout')
 urlpatterns = [
     path('', api_root, name='api-root'),
     path('api/', include(router.urls)),
+    path('api/cache/stats/', cache_stats, name='cache-stats'),
+    path('api/metrics/', metrics, name='metrics'),
+    path('api/mongo/pool/', mongo_pool_stats, name='mongo-pool-stats'),
+    path('api/outbox/', outbox_status, name='outbox-status'),
+    # Async (ASGI-native) read endpoints, see async_views.py
+    path('api/async/leaderboard/top_users/', async_views.top_users, name='async-leaderboard-top-users'),
+    path('api/async/leaderboard/by_team/', async_views.leaderboard_by_team, name='async-leaderboard-by-team'),
+    path('api/async/users/<str:pk>/activities/', async_views.user_activities, name='async-user-activities'),
+    path('api/async/teams/<str:pk>/members/', async_views.team_members, name='async-team-members'),
+    path('api/async/workouts/', async_views.workouts, name='async-workouts'),
     path('admin/', admin.site.urls),
 ]
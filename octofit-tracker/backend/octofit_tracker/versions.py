@@ -0,0 +1,41 @@
+"""
+Per-collection version stamps used for ETag and Last-Modified headers.
+
+A stamp is the ``time.time_ns()`` of the last write to a collection, kept
+in the Django cache. Every write path bumps it: ORM saves and deletes
+through signals, and raw pymongo writes explicitly. Reading a stamp is one
+cache lookup, so a conditional GET can be answered without touching MongoDB.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _key(model):
+    return f'octofit:version:{model._meta.db_table}'
+
+
+def bump(*models):
+    """Record a write to the collections of ``models``"""
+    now = time.time_ns()
+    cache.set_many({_key(model): now for model in models}, timeout=settings.OCTOFIT_VERSION_TTL)
+
+
+def stamps(*models):
+    """Return the current version stamp of each collection in ``models``"""
+    keys = [_key(model) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Unknown collections start at "now", which can only make a
+            # client revalidate once more than strictly necessary.
+            now = time.time_ns()
+            cache.add(key, now, timeout=settings.OCTOFIT_VERSION_TTL)
+            found[key] = cache.get(key) or now
+    return [found[key] for key in keys]
+
+
+def last_modified(versions):
+    """Return the newest of ``versions`` as a Unix timestamp in seconds"""
+    return max(versions) // 1_000_000_000
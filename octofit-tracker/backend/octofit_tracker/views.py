@@ -1,99 +1,472 @@
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+from pymongo import ASCENDING
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
+from copy import copy
+from . import instrumentation, mongo, native, outbox, projections, recommendations, replicas, rollups, streaming, versions, windows
+from .cache import by_team_scope, cached_response, response_cache
+from .models import User, Team, Activity, Leaderboard, LeaderboardWindow, Workout
+from .pagination import ActivityCursorPagination, LeaderboardCursorPagination
+from .ranking import rank_index
 from .serializers import (
     UserSerializer,
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
-    WorkoutSerializer
+    LeaderboardWindowSerializer,
+    WorkoutSerializer,
+    expand_rows,
+    requested_expansions,
+    requested_fields,
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class NotModified(Exception):
+    """Raised to stop a GET early when the client's copy is still current"""
+    
+    def __init__(self, response):
+        self.response = response
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe requests from replica set secondaries where replication lag
+    cannot show: writes, clients that just wrote and collections written in
+    the last few seconds (by ConditionalGetMixin's version stamps) stay on
+    the primary.
+    """
+    
+    def initial(self, request, *args, **kwargs):
+        if replicas.use_replica(request, self.get_version_models()):
+            self.replica_token = replicas.begin()
+        super().initial(request, *args, **kwargs)
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            self.replica_token = None
+            replicas.end(token)
+        elif replicas.enabled() and request.method not in SAFE_METHODS and response.status_code < 400:
+            replicas.pin(response)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified support for GET requests.
+    
+    The validators are derived from the version stamps of the collections a
+    response is built from, so a matching If-None-Match or If-Modified-Since
+    is answered with 304 before any query runs or any serializer is built.
+    """
+    version_models = ()
+    action_version_models = {}
+    
+    def get_version_models(self):
+        models = self.action_version_models.get(self.action, self.version_models)
+        expansions = getattr(self.get_serializer_class(), 'expansions', None)
+        if expansions and self.request.query_params.get('expand'):
+            # Embedded names change with the related collections
+            models = tuple(dict.fromkeys([*models, *(model for model, _ in expansions.values())]))
+        return models
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = self.last_modified = None
+        if request.method not in ('GET', 'HEAD') or not self.get_version_models():
+            return
+        
+        stamps = versions.stamps(*self.get_version_models())
+        raw = repr((stamps, request.get_host(), request.get_full_path(), request.accepted_media_type))
+        self.etag = f'"{hashlib.sha1(raw.encode()).hexdigest()}"'
+        self.last_modified = versions.last_modified(stamps)
+        not_modified = get_conditional_response(
+            request._request, etag=self.etag, last_modified=self.last_modified
+        )
+        if not_modified is not None:
+            raise NotModified(not_modified)
+    
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+
+class ProjectionMixin:
+    """
+    Sparse fieldsets: with `?fields=a,b` a read loads only the model fields
+    behind the requested serializer fields, on the ORM and native paths
+    alike. The serializers drop the other fields from the output.
+    """
+    projected_actions = ('list', 'retrieve')
+    
+    def requested_fields(self, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        return requested_fields(self.request.query_params, native.readable_fields(serializer_class))
+    
+    def project(self, queryset, serializer_class=None):
+        """Restrict ``queryset`` to the columns needed for the requested fields"""
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        serializer_class = serializer_class or self.get_serializer_class()
+        fields = self.requested_fields(serializer_class)
+        if fields is None:
+            return queryset
+        if isinstance(queryset, native.MongoQuery):
+            return queryset.only(*fields)
+        
+        readable = native.readable_fields(serializer_class)
+        names = {readable[name].source for name in fields}
+        # Cursor pagination reads its position from the ordering fields;
+        # deferring them would cost one query per row.
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        names.update(name.lstrip('-') for name in ([ordering] if isinstance(ordering, str) else ordering))
+        return queryset.only(*[name for name in names if self.is_concrete(queryset.model, name)])
+    
+    @staticmethod
+    def is_concrete(model, name):
+        try:
+            return model._meta.get_field(name).concrete
+        except FieldDoesNotExist:
+            return False
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.projected_actions:
+            queryset = self.project(queryset)
+        return queryset
+
+
+class PaginatedActionMixin(ProjectionMixin):
+    """
+    Paginate custom list actions the same way as the default list route.
+    """
+    
+    def paginated_response(self, queryset, serializer_class=None):
+        """Serialize one page of ``queryset`` and wrap it with cursor links"""
+        serializer_class = serializer_class or self.get_serializer_class()
+        queryset = self.project(queryset, serializer_class)
+        raw = isinstance(queryset, native.MongoQuery)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize(page, serializer_class, raw))
+        return Response(self.serialize(queryset, serializer_class, raw))
+    
+    def serialize(self, items, serializer_class, raw=False):
+        """Serialize model instances, or raw documents from the native path"""
+        if raw:
+            fields = self.requested_fields(serializer_class)
+            rows = native.represent(items, serializer_class, fields)
+            expansions = getattr(serializer_class, 'expansions', None)
+            if expansions:
+                # Serializers expand ORM rows themselves; expand native rows alike
+                names = requested_expansions(
+                    self.request.query_params, expansions, fields or native.readable_fields(serializer_class),
+                )
+                expand_rows(rows, names, expansions)
+            return rows
+        context = self.get_serializer_context()
+        return serializer_class(items, many=True, context=context).data
+
+
+class UserViewSet(ReplicaReadMixin, ConditionalGetMixin, PaginatedActionMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing users.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    version_models = (User,)
+    action_version_models = {'activities': (User, Activity)}
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=ActivityCursorPagination)
     def activities(self, request, pk=None):
         """Get all activities for a specific user"""
         user = self.get_object()
-        activities = Activity.objects.filter(user_id=str(user._id))
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        if native.enabled('user_activities', request):
+            activities = native.MongoQuery(Activity, ActivitySerializer)
+        else:
+            activities = Activity.objects.all()
+        activities = activities.filter(user_id=str(user._id))
+        return self.paginated_response(activities, ActivitySerializer)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ReplicaReadMixin, ConditionalGetMixin, PaginatedActionMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing teams.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    version_models = (Team, User)
     
     @action(detail=True, methods=['get'])
     def members(self, request, pk=None):
         """Get all members of a specific team"""
         team = self.get_object()
         members = User.objects.filter(team_id=str(team._id))
-        serializer = UserSerializer(members, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(members, UserSerializer)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ReplicaReadMixin, ConditionalGetMixin, PaginatedActionMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing activities.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityCursorPagination
+    version_models = (Activity,)
+    bulk_max_items = 1000
+    export_batch_size = 1000
+    stats_default_range = {
+        'day': timedelta(days=30),
+        'week': timedelta(weeks=12),
+        'month': timedelta(days=365),
+    }
     
     def get_queryset(self):
         """
         Optionally restricts the returned activities to a given user,
         by filtering against a `user_id` query parameter in the URL.
         """
-        queryset = Activity.objects.all()
+        if self.action == 'list' and native.enabled('activities', self.request):
+            queryset = native.MongoQuery(Activity, ActivitySerializer)
+        else:
+            queryset = Activity.objects.all()
         user_id = self.request.query_params.get('user_id', None)
         if user_id is not None:
             queryset = queryset.filter(user_id=user_id)
         return queryset
+    
+    def list(self, request, *args, **kwargs):
+        """List activities through the ORM or the native query path"""
+        return self.paginated_response(self.filter_queryset(self.get_queryset()))
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create a batch of activities in one insert. Invalid items are
+        reported by index in ``errors`` and do not block the valid ones.
+        """
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        activities = serializer.save() if serializer.validated_data else []
+        self.record([(activity, 1) for activity in activities])
+        
+        errors = [
+            {'index': index, 'errors': item_errors}
+            for index, item_errors in serializer.item_errors.items()
+        ]
+        response_status = status.HTTP_201_CREATED if activities else status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': self.get_serializer(activities, many=True).data,
+            'errors': errors,
+        }, status=response_status)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream activities, optionally limited to `user_id`, as NDJSON (the
+        default) or CSV with `?output=csv`. Rows are encoded straight from
+        a MongoDB cursor, so memory use stays flat for any export size.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in streaming.FORMATS:
+            raise ValidationError({'output': f'Must be one of: {", ".join(streaming.FORMATS)}'})
+        
+        query = {}
+        user_id = request.query_params.get('user_id', None)
+        if user_id is not None:
+            query['user_id'] = user_id
+        fields = self.requested_fields(ActivitySerializer)
+        rows = streaming.stream_documents(
+            Activity, ActivitySerializer, query,
+            sort=[('date', ASCENDING), ('_id', ASCENDING)],
+            batch_size=self.export_batch_size,
+            only=fields,
+        )
+        content_type, extension = streaming.FORMATS[output]
+        response = StreamingHttpResponse(
+            streaming.encode(rows, output, list(native.readable_fields(ActivitySerializer, fields))),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{extension}"'
+        return response
+    
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """
+        Day, week or month totals for one user (`user_id`) or one team
+        (`team_id`), broken down by activity type and read from the daily
+        rollups. `start` and `end` are ISO dates and default to a range
+        that fits the period.
+        """
+        params = request.query_params
+        period = params.get('period', 'day')
+        if period not in rollups.PERIODS:
+            raise ValidationError({'period': f'Must be one of: {", ".join(rollups.PERIODS)}'})
+        
+        match = {key: params[key] for key in ('user_id', 'team_id') if params.get(key)}
+        if len(match) != 1:
+            raise ValidationError('Provide exactly one of user_id or team_id')
+        
+        dates = {}
+        for key in ('start', 'end'):
+            value = params.get(key)
+            try:
+                dates[key] = parse_date(value) if value else None
+            except ValueError:
+                # Well formed but not a real day, such as 2024-02-31
+                dates[key] = None
+            if value and dates[key] is None:
+                raise ValidationError({key: 'Must be a date in YYYY-MM-DD format'})
+        end = dates['end'] or timezone.now().date()
+        start = dates['start'] or end - self.stats_default_range[period]
+        
+        return Response({
+            'period': period,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            **match,
+            'results': rollups.period_stats(match, period, start, end),
+        })
+    
+    def record(self, changes):
+        """
+        Bring the leaderboard and rollups up to date with ``(activity, sign)``
+        pairs, through the write-behind outbox unless it is switched off
+        """
+        if settings.OCTOFIT_WRITE_BEHIND:
+            outbox.enqueue(changes)
+        else:
+            projections.apply(changes)
+    
+    def perform_create(self, serializer):
+        """Save the activity and add it to the leaderboard and rollups"""
+        activity = serializer.save()
+        self.record([(activity, 1)])
+    
+    def perform_update(self, serializer):
+        """Save the activity and apply the difference to the leaderboard and rollups"""
+        before = copy(serializer.instance)
+        activity = serializer.save()
+        self.record([(before, -1), (activity, 1)])
+    
+    def perform_destroy(self, instance):
+        """Delete the activity and subtract it from the leaderboard and rollups"""
+        instance.delete()
+        self.record([(instance, -1)])
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ReplicaReadMixin, ConditionalGetMixin, PaginatedActionMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing leaderboard entries.
     """
     queryset = Leaderboard.objects.all().order_by('-total_calories')
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardCursorPagination
+    version_models = (Leaderboard, LeaderboardWindow)
+    rank_max_around = 50
+    windowed_actions = ('list', 'top_users', 'by_team')
+    
+    def initial(self, request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and self.leaderboard_window(request) != windows.ALL_TIME:
+            if self.action not in self.windowed_actions:
+                raise ValidationError({'window': 'Not supported by this endpoint'})
+            # Slide the windows before the ETag is computed, so the first request
+            # of a new day already sees (and validates against) the new totals.
+            windows.advance()
+        super().initial(request, *args, **kwargs)
+    
+    def leaderboard_window(self, request):
+        window = request.query_params.get('window', windows.ALL_TIME)
+        if window != windows.ALL_TIME and window not in windows.WINDOWS:
+            raise ValidationError({'window': f'Must be one of: {", ".join([*windows.WINDOWS, windows.ALL_TIME])}'})
+        return window
+    
+    def window_entries(self, request, endpoint):
+        """
+        Entries of the all-time board, or of the `?window=7d|30d` board, and
+        the serializer that renders them.
+        """
+        window = self.leaderboard_window(request)
+        if window == windows.ALL_TIME:
+            model, serializer_class = Leaderboard, LeaderboardSerializer
+        else:
+            model, serializer_class = LeaderboardWindow, LeaderboardWindowSerializer
+        if native.enabled(endpoint, request):
+            entries = native.MongoQuery(model, serializer_class)
+        else:
+            entries = model.objects.all()
+        if window != windows.ALL_TIME:
+            entries = entries.filter(window=window)
+        return entries, serializer_class
+    
+    def list(self, request, *args, **kwargs):
+        """List entries by calories, all time or over `?window=7d|30d`"""
+        entries, serializer_class = self.window_entries(request, 'leaderboard')
+        return self.paginated_response(self.filter_queryset(entries), serializer_class)
     
     @action(detail=False, methods=['get'])
+    @cached_response('top_users', 'top_users')
     def top_users(self, request):
-        """Get top 10 users by calories"""
-        top_entries = Leaderboard.objects.all().order_by('-total_calories')[:10]
-        serializer = self.get_serializer(top_entries, many=True)
-        return Response(serializer.data)
+        """Get top 10 users by calories, all time or over `?window=7d|30d`"""
+        entries, serializer_class = self.window_entries(request, 'top_users')
+        top_entries = self.project(entries, serializer_class).order_by('-total_calories')[:10]
+        raw = isinstance(entries, native.MongoQuery)
+        return Response(self.serialize(top_entries, serializer_class, raw))
+    
+    @action(detail=False, methods=['get'], url_path=r'rank/(?P<user_id>[^/.]+)')
+    def rank(self, request, user_id=None):
+        """
+        Rank of a user on the global board, or on their team's board with
+        `?scope=team`, plus `?around=N` neighbours above and below.
+        """
+        try:
+            around = min(max(int(request.query_params.get('around', 5)), 0), self.rank_max_around)
+        except ValueError:
+            raise ValidationError({'around': 'Must be an integer'})
+        by_team = request.query_params.get('scope', 'global') == 'team'
+        result = rank_index.lookup(user_id, around=around, by_team=by_team)
+        if result is None:
+            raise NotFound('This user has no leaderboard entry')
+        return Response(result)
     
     @action(detail=False, methods=['get'])
+    @cached_response('by_team', lambda request: by_team_scope(request.query_params.get('team_id')))
     def by_team(self, request):
         """Get leaderboard grouped by team"""
         team_id = request.query_params.get('team_id', None)
+        entries, serializer_class = self.window_entries(request, 'by_team')
         if team_id:
-            entries = Leaderboard.objects.filter(team_id=team_id).order_by('-total_calories')
-        else:
-            entries = Leaderboard.objects.all().order_by('-total_calories')
-        serializer = self.get_serializer(entries, many=True)
-        return Response(serializer.data)
+            entries = entries.filter(team_id=team_id)
+        return self.paginated_response(entries.order_by('-total_calories'), serializer_class)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ReplicaReadMixin, ConditionalGetMixin, ProjectionMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing workout suggestions.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    version_models = (Workout,)
+    action_version_models = {'recommended': (Workout, Activity)}
     
     def get_queryset(self):
         """
@@ -110,3 +483,65 @@ class WorkoutViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(activity_type=activity_type)
         
         return queryset
+    
+    @cached_response('workouts', 'workouts')
+    def list(self, request, *args, **kwargs):
+        """List workouts, served from the response cache when possible"""
+        return super().list(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['get'])
+    def recommended(self, request):
+        """
+        The workouts that best fit the activity history of `user_id`, best
+        first, with their score. `limit` caps the list at up to
+        OCTOFIT_RECOMMENDATIONS_TOP_K entries.
+        """
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            raise ValidationError({'user_id': 'This parameter is required'})
+        try:
+            limit = int(request.query_params.get('limit', settings.OCTOFIT_RECOMMENDATIONS_TOP_K))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be at least 1'})
+        return Response({
+            'user_id': user_id,
+            'results': recommendations.for_user(user_id)[:limit],
+        })
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """
+    Response cache hit/miss counters of the worker serving this request.
+    """
+    return Response(response_cache.stats())
+
+
+@api_view(['GET'])
+def metrics(request):
+    """
+    Per-route request metrics of the worker serving this request: latency
+    and query-count histograms plus DB, translation, serializer and render
+    time totals.
+    """
+    return Response(instrumentation.registry.snapshot())
+
+
+@api_view(['GET'])
+def mongo_pool_stats(request):
+    """
+    MongoDB client and connection pool statistics of the worker serving
+    this request: open, checked out and created connections, and waiters.
+    """
+    return Response(mongo.pool_stats.snapshot())
+
+
+@api_view(['GET'])
+def outbox_status(request):
+    """
+    Backlog of the write-behind outbox: pending and failed events, the age
+    of the oldest one, and the worker threads of this process.
+    """
+    return Response(outbox.stats())
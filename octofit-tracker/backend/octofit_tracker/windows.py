@@ -0,0 +1,206 @@
+"""
+Sliding time-window leaderboards (last 7 and last 30 days).
+
+Each window keeps one ``LeaderboardWindow`` document per user, holding the
+totals of that user's daily rollups from the window's ``start`` day onward.
+``LeaderboardWindowState`` records ``start``. Activity writes add their
+deltas when they fall inside the window, in the same ``$inc`` style as the
+all-time leaderboard. When a new day begins, ``advance`` subtracts the
+rollup buckets that have slid out of the window. That is one aggregation
+over a day of rollups, not a rescan of the whole window. Serving a window
+is then the same indexed, sorted find as the all-time leaderboard.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+from pymongo import DeleteOne, UpdateOne
+
+from . import leaderboard, versions
+from .cache import leaderboard_scopes, response_cache
+from .models import ActivityRollup, LeaderboardWindow, LeaderboardWindowState
+from .rollups import day_of
+
+WINDOWS = {'7d': 7, '30d': 30}
+ALL_TIME = 'all'
+TOTAL_FIELDS = ('total_calories', 'total_duration', 'total_activities')
+
+
+def window_start(days, now=None):
+    """First day counted by a window of ``days`` days ending today"""
+    return day_of(now or timezone.now()) - timedelta(days=days - 1)
+
+
+def starts():
+    """Return the stored start day of every initialised window"""
+    return {
+        state['window']: day_of(state['start'])
+        for state in LeaderboardWindowState.objects.mongo_find({}, {'window': 1, 'start': 1})
+    }
+
+
+def bucket_totals(query):
+    """Sum the rollups matched by ``query`` per user"""
+    pipeline = [
+        {'$match': query},
+        {
+            '$group': {
+                '_id': '$user_id',
+                'team_id': {'$last': '$team_id'},
+                'total_calories': {'$sum': '$total_calories'},
+                'total_duration': {'$sum': '$total_duration'},
+                'total_activities': {'$sum': '$total_activities'},
+            }
+        },
+    ]
+    return ActivityRollup.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+
+
+def _invalidate(teams):
+    response_cache.invalidate(*leaderboard_scopes(teams))
+    versions.bump(LeaderboardWindow)
+
+
+def apply_deltas(changes, teams):
+    """Add ``(activity, sign)`` pairs to every window they fall inside"""
+    window_starts = starts()
+    deltas = defaultdict(Counter)
+    for activity, sign in changes:
+        day = day_of(activity.date)
+        for window, start in window_starts.items():
+            if day >= start:
+                deltas[window, activity.user_id].update(leaderboard.activity_delta(activity, sign))
+    deltas = leaderboard.nonzero_deltas(deltas)
+    if not deltas:
+        return
+    user_ids = {user_id for _, user_id in deltas}
+    stored_teams = leaderboard.stored_team_ids(LeaderboardWindow, user_ids)
+    now = timezone.now()
+    operations = [
+        UpdateOne(
+            {'window': window, 'user_id': user_id},
+            {
+                '$inc': delta,
+                '$set': {'last_updated': now},
+                '$setOnInsert': {'team_id': teams.get(user_id)},
+            },
+            upsert=True,
+        )
+        for (window, user_id), delta in deltas.items()
+    ]
+    LeaderboardWindow.objects.mongo_bulk_write(operations, ordered=False)
+    _invalidate({teams.get(user_id) for user_id in user_ids} | stored_teams)
+
+
+def recompute(user_ids, teams):
+    """
+    Set the window totals of ``user_ids`` to the sums of their rollups since
+    each window's start. Idempotent, unlike ``apply_deltas``; run it after
+    the rollups are recomputed.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    now = timezone.now()
+    operations = []
+    # Windows without a state yet are built from scratch by advance()
+    for window, start in starts().items():
+        rows = {
+            row['_id']: row
+            for row in bucket_totals({'user_id': {'$in': user_ids}, 'day': {'$gte': start}})
+        }
+        for user_id in user_ids:
+            row = rows.get(user_id)
+            if row is None or row['total_activities'] <= 0:
+                operations.append(DeleteOne({'window': window, 'user_id': user_id}))
+                continue
+            operations.append(UpdateOne(
+                {'window': window, 'user_id': user_id},
+                {
+                    '$set': {**{field: row[field] for field in TOTAL_FIELDS}, 'last_updated': now},
+                    '$setOnInsert': {'team_id': teams.get(user_id)},
+                },
+                upsert=True,
+            ))
+    if operations:
+        # Read the stored teams before the deletes drop their rows
+        stored_teams = leaderboard.stored_team_ids(LeaderboardWindow, user_ids)
+        LeaderboardWindow.objects.mongo_bulk_write(operations, ordered=False)
+        _invalidate({teams.get(user_id) for user_id in user_ids} | stored_teams)
+
+
+def rebuild(window, now=None):
+    """Recompute one window from the daily rollups"""
+    start = window_start(WINDOWS[window], now)
+    now = now or timezone.now()
+    rows = list(bucket_totals({'day': {'$gte': start}}))
+    LeaderboardWindow.objects.mongo_delete_many({'window': window})
+    if rows:
+        # Upserts rather than inserts, so a write racing the rebuild cannot
+        # make it fail on the (window, user_id) unique index.
+        LeaderboardWindow.objects.mongo_bulk_write([
+            UpdateOne(
+                {'window': window, 'user_id': row['_id']},
+                {'$set': {
+                    'team_id': row.get('team_id'),
+                    **{field: row[field] for field in TOTAL_FIELDS},
+                    'last_updated': now,
+                }},
+                upsert=True,
+            )
+            for row in rows
+        ], ordered=False)
+    LeaderboardWindowState.objects.mongo_update_one(
+        {'window': window}, {'$set': {'start': start}}, upsert=True
+    )
+    _invalidate({row.get('team_id') for row in rows})
+
+
+def rebuild_all(now=None):
+    """Recompute every window from the daily rollups"""
+    for window in WINDOWS:
+        rebuild(window, now)
+
+
+def expire(window, old_start, new_start):
+    """Subtract the rollups of the days in ``[old_start, new_start)``"""
+    rows = list(bucket_totals({'day': {'$gte': old_start, '$lt': new_start}}))
+    now = timezone.now()
+    if rows:
+        LeaderboardWindow.objects.mongo_bulk_write([
+            UpdateOne(
+                {'window': window, 'user_id': row['_id']},
+                {
+                    '$inc': {field: -row[field] for field in TOTAL_FIELDS},
+                    '$set': {'last_updated': now},
+                },
+            )
+            for row in rows
+        ], ordered=False)
+    # Users with nothing left in the window drop off its board
+    LeaderboardWindow.objects.mongo_delete_many({'window': window, 'total_activities': {'$lte': 0}})
+    _invalidate({row.get('team_id') for row in rows})
+
+
+def advance(now=None):
+    """
+    Slide every window forward to today. Cheap when nothing changed: one
+    find on the window state. Each day boundary is expired by exactly one
+    caller, which claims it by moving ``start`` with a conditional update.
+    """
+    window_starts = starts()
+    for window, days in WINDOWS.items():
+        start = window_start(days, now)
+        current = window_starts.get(window)
+        if current is None:
+            claimed = LeaderboardWindowState.objects.mongo_update_one(
+                {'window': window}, {'$setOnInsert': {'start': start}}, upsert=True
+            )
+            if claimed.upserted_id is not None:
+                rebuild(window, now)
+        elif current < start:
+            claimed = LeaderboardWindowState.objects.mongo_update_one(
+                {'window': window, 'start': current}, {'$set': {'start': start}}
+            )
+            if claimed.modified_count:
+                expire(window, current, start)
@@ -2,7 +2,6 @@ import React, { useEffect, useState } from 'react';
 
 const Leaderboard = () => {
   const [leaderboard, setLeaderboard] = useState([]);
-  const [users, setUsers] = useState({});
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
@@ -10,50 +9,29 @@ const Leaderboard = () => {
     const fetchData = async () => {
       try {
         const codespace = process.env.REACT_APP_CODESPACE_NAME;
+        // expand=user,team embeds the user and team names in every entry
         const leaderboardUrl = codespace
-          ? `https://${codespace}-8000.app.github.dev/api/leaderboard/`
-          : 'http://localhost:8000/api/leaderboard/';
-        const usersUrl = codespace
-          ? `https://${codespace}-8000.app.github.dev/api/users/`
-          : 'http://localhost:8000/api/users/';
+          ? `https://${codespace}-8000.app.github.dev/api/leaderboard/?expand=user,team`
+          : 'http://localhost:8000/api/leaderboard/?expand=user,team';
         
         console.log('Fetching leaderboard from:', leaderboardUrl);
-        console.log('Fetching users from:', usersUrl);
         
-        // Fetch both leaderboard and users data
-        const [leaderboardResponse, usersResponse] = await Promise.all([
-          fetch(leaderboardUrl),
-          fetch(usersUrl)
-        ]);
+        const leaderboardResponse = await fetch(leaderboardUrl);
 
-        if (!leaderboardResponse.ok || !usersResponse.ok) {
+        if (!leaderboardResponse.ok) {
           throw new Error(`HTTP error! status: ${leaderboardResponse.status}`);
         }
         
         const leaderboardData = await leaderboardResponse.json();
-        const usersData = await usersResponse.json();
         
         console.log('Leaderboard API Response:', leaderboardData);
-        console.log('Users API Response:', usersData);
         
         // Handle both paginated (.results) and plain array responses
         const leaderboardArray = Array.isArray(leaderboardData.results || leaderboardData) 
           ? (leaderboardData.results || leaderboardData) 
           : [];
-        const usersArray = Array.isArray(usersData.results || usersData)
-          ? (usersData.results || usersData)
-          : [];
-        
-        // Create a map of user_id to user name
-        const userMap = {};
-        usersArray.forEach(user => {
-          userMap[String(user._id)] = user.name;
-        });
-        
-        console.log('User Map:', userMap);
         
         setLeaderboard(leaderboardArray);
-        setUsers(userMap);
         setLoading(false);
       } catch (err) {
         console.error('Error fetching data:', err);
@@ -117,7 +95,8 @@ const Leaderboard = () => {
                     const avgDuration = entry.total_activities > 0 
                       ? (entry.total_duration / entry.total_activities).toFixed(1)
                       : 0;
-                    const username = users[entry.user_id] || entry.user_id || 'Unknown';
+                    const username = (entry.user && entry.user.name) || entry.user_id || 'Unknown';
+                    const teamName = (entry.team && entry.team.name) || entry.team_id;
                     
                     return (
                       <tr key={entry._id || entry.id || index}>
@@ -132,7 +111,7 @@ const Leaderboard = () => {
                           </span>
                         </td>
                         <td><strong>{username}</strong></td>
-                        <td>{entry.team_id || <span className="text-muted">N/A</span>}</td>
+                        <td>{teamName || <span className="text-muted">N/A</span>}</td>
                         <td>
                           <span className="badge bg-success">
                             {entry.total_calories || 0} cal